@@ -0,0 +1,73 @@
+"""Cost of rejecting bad requests, before and after src/api/errors.py.
+
+Sends `--requests` sign-ups with a wrong content type to SignupView, which
+rejects them with a 415, and as many activations without credentials to
+ActivateView, which rejects them with a 400 raised while handling another one:
+
+* "print_exc (before)": every HttpError printing the current traceback when
+  built, as it did before, and no other report
+* "reported": the compact line of the ErrorReporter, for all of them and for
+  a sample of 1%
+
+The tracebacks and the logs go to stderr, redirect it to compare the CPU
+cost alone:
+
+    python -m benchmarks.bench_errors --requests 10000 2>/dev/null
+"""
+import argparse
+import traceback
+from unittest.mock import patch
+
+from benchmarks.common import setup_django, summarize, Timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=10000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import RequestFactory
+    from src.api import decorators
+    from src.api.errors import ErrorReporter
+    from src.api.exceptions import HttpError
+    from src.api.views import ActivateView, SignupView
+
+    factory = RequestFactory()
+    bad_requests = [
+        (SignupView.as_view(), factory.post('/api/v1/sign_up/', data='foo', content_type='text/plain'),
+         415),
+        (ActivateView.as_view(), factory.patch('/api/v1/activate/', data={'token': 'abcd'},
+                                               content_type='application/json'), 403),
+    ]
+    original_init = HttpError.__init__
+
+    def printing_init(self, *init_args, **kwargs):
+        original_init(self, *init_args, **kwargs)
+        traceback.print_exc()
+
+    def run(view, request, status_code):
+        latencies = []
+        with Timer() as total:
+            for _ in range(args.requests):
+                with Timer() as timer:
+                    response = view(request)
+                latencies.append(timer.elapsed)
+        assert response.status_code == status_code
+        return latencies, total.elapsed
+
+    with patch.object(HttpError, '__init__', printing_init), \
+            patch.object(decorators, 'report_error', lambda err, request=None: None):
+        for view, request, status_code in bad_requests:
+            summarize(f'{status_code} print_exc (before)', *run(view, request, status_code))
+
+    for sample_rate in (1, 0.01):
+        reporter = ErrorReporter(tracebacks_per_minute=10, sample_rate=sample_rate)
+        with patch.object(decorators, 'report_error', reporter.report):
+            for view, request, status_code in bad_requests:
+                summarize(f'{status_code} reported sample={sample_rate}',
+                          *run(view, request, status_code))
+
+
+if __name__ == '__main__':
+    main()
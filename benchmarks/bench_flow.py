@@ -0,0 +1,328 @@
+"""End-to-end benchmark of the sign-up and activation flow, with baselines.
+
+Signs up `--users` users, then activates them with the tokens of the sign-up
+responses, through SignupView and ActivateView:
+
+* `--server client`: in this process, with the Django test client, one
+  request at a time through the whole middleware stack
+* `--server wsgi` / `--server asgi`: over HTTP, with `--concurrency`
+  keep-alive connections, against gunicorn / uvicorn started for the run on
+  a free port (see requirements.txt of this directory)
+
+The activation emails queued by the sign-ups are then sent to a local SMTP
+sink by the outbox Dispatcher. The throttles are disabled for the run.
+
+Every step reports its req/s and p50/p95/p99 latencies. The costs of a
+request don't depend on the server, so they are measured in this process,
+on `--cost-users` more users: the database round trips (the statements of
+src/api/queries.py sent at once, and the ORM queries) and the memory
+allocated per request (its tracemalloc peak), e.g.:
+
+    python -m benchmarks.bench_flow --server client --save-baseline baseline-client.json
+    python -m benchmarks.bench_flow --server client --baseline baseline-client.json
+
+Compared to a baseline, the run exits with the status 1 when a throughput or
+a latency got worse by more than `--tolerance`, the memory allocated per
+request grew by more than it, or the round trips per request increased.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from unittest.mock import patch
+from urllib.parse import urlsplit
+
+from benchmarks.common import percentile, setup_django, summarize, Timer
+from benchmarks.load_signup import Client as HttpClient
+from benchmarks.smtp_sink import SMTPSink
+
+
+SIGNUP_PATH = '/api/v1/sign_up/'
+ACTIVATE_PATH = '/api/v1/activate/'
+PASSWORD = 'baz'
+
+# metrics of a step, and whether a higher value is better
+METRICS = {'rps': True, 'p50': False, 'p95': False, 'p99': False, 'round_trips': False, 'alloc_kb': False}
+
+
+def auth_header(email):
+    return 'Basic ' + base64.b64encode(f'{email}:{PASSWORD}'.encode()).decode('ascii')
+
+
+def step_metrics(latencies, elapsed):
+    return {
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+    }
+
+
+class InProcessFlow(object):
+    """The requests of the flow sent with the Django test client"""
+
+    def __init__(self):
+        from django.test import Client
+        self.client = Client(HTTP_HOST='localhost')
+
+    def signup(self, email):
+        response = self.client.post(SIGNUP_PATH, {'email': email, 'password': PASSWORD},
+                                    content_type='application/json')
+        return response.status_code, response.json().get('token')
+
+    def activate(self, email, token):
+        response = self.client.patch(ACTIVATE_PATH, {'token': token}, content_type='application/json',
+                                     HTTP_AUTHORIZATION=auth_header(email))
+        return response.status_code, None
+
+    def run(self, send, jobs):
+        latencies, statuses, results = [], Counter(), []
+        with Timer() as total:
+            for job in jobs:
+                with Timer() as timer:
+                    status, result = send(*job)
+                latencies.append(timer.elapsed)
+                statuses[status] += 1
+                results.append(result)
+        return latencies, total.elapsed, statuses, results
+
+
+class HttpFlow(object):
+    """The requests of the flow sent to a server, over `concurrency`
+    keep-alive connections"""
+
+    def __init__(self, url, concurrency):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.concurrency = concurrency
+
+    async def _run(self, requests):
+        pending = list(enumerate(requests))[::-1]
+        latencies, statuses, results = [], Counter(), [None] * len(requests)
+
+        async def worker():
+            client = HttpClient(self.host, self.port)
+            try:
+                while pending:
+                    i, (method, path, payload, headers) = pending.pop()
+                    start = time.perf_counter()
+                    try:
+                        status, body = await client.request(method, path, payload, headers)
+                        results[i] = body
+                    except (OSError, asyncio.IncompleteReadError) as ex:
+                        status = type(ex).__name__
+                    latencies.append(time.perf_counter() - start)
+                    statuses[status] += 1
+            finally:
+                client.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        return latencies, time.perf_counter() - start, statuses, results
+
+    def signups(self, emails):
+        latencies, elapsed, statuses, bodies = asyncio.run(self._run([
+            ('POST', SIGNUP_PATH, {'email': email, 'password': PASSWORD}, None) for email in emails]))
+        tokens = [json.loads(body).get('token') if body else None for body in bodies]
+        return latencies, elapsed, statuses, tokens
+
+    def activations(self, emails, tokens):
+        return asyncio.run(self._run([
+            ('PATCH', ACTIVATE_PATH, {'token': token}, {'Authorization': auth_header(email)})
+            for email, token in zip(emails, tokens)]))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, workers, threads):
+    """Start gunicorn (`wsgi`) or uvicorn (`asgi`), returns (process, url)"""
+    port = free_port()
+    if kind == 'wsgi':
+        command = [sys.executable, '-m', 'gunicorn', 'src.wsgi', '-w', str(workers), '--threads', str(threads),
+                   '-b', f'127.0.0.1:{port}', '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'src.asgi:application', '--workers', str(workers),
+                   '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    env = dict(os.environ, API_THROTTLE_IP_RATE='', API_THROTTLE_SIGNUP_RATE='',
+               API_THROTTLE_ACTIVATION_RATE='')
+    # in its own process group, stopped with the hashing processes of its workers
+    process = subprocess.Popen(command, env=env, start_new_session=True)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'{command[2]} exited with {process.returncode}, see benchmarks/requirements.txt')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    sys.exit(f'{command[2]} did not start listening on {port}')
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def request_costs(flow, emails):
+    """Round trips to the database and KB allocated per request of each step"""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from src.api import queries
+
+    round_trips = Counter()
+
+    def counted(execute):
+        def wrapper(*args, **kwargs):
+            round_trips['prepared'] += 1
+            return execute(*args, **kwargs)
+        return wrapper
+
+    def measure(send, jobs):
+        allocated, tokens = [], []
+        round_trips.clear()
+        tracemalloc.start()
+        try:
+            with patch.object(queries, 'execute', counted(queries.execute)), \
+                    patch.object(queries, 'aexecute', counted(queries.aexecute)), \
+                    CaptureQueriesContext(connection) as orm_queries:
+                for job in jobs:
+                    current, _ = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                    tokens.append(send(*job)[1])
+                    allocated.append(tracemalloc.get_traced_memory()[1] - current)
+        finally:
+            tracemalloc.stop()
+        return {
+            'round_trips': (round_trips['prepared'] + len(orm_queries)) / len(jobs),
+            'alloc_kb': percentile(allocated, 50) / 1024,
+        }, tokens
+
+    signup, tokens = measure(flow.signup, [(email,) for email in emails])
+    activate, _ = measure(flow.activate, list(zip(emails, tokens)))
+    return {'signup': signup, 'activate': activate}
+
+
+def compare(results, baseline, tolerance):
+    """Print the changes from `baseline`, returns the regressions"""
+    regressions = []
+    for step, metrics in results.items():
+        for name, value in metrics.items():
+            base = baseline.get(step, {}).get(name)
+            if base is None:
+                continue
+            change = (value - base) / base if base else 0.0
+            if name == 'round_trips':
+                regressed = value > base + 0.01
+            elif METRICS[name]:
+                regressed = change < -tolerance
+            else:
+                regressed = change > tolerance
+            print('%-10s %-12s %10.2f -> %10.2f  %+7.1f%%%s' % (
+                step, name, base, value, change * 100, '  REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append(f'{step} {name}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=('client', 'wsgi', 'asgi'), default='client')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--cost-users', type=int, default=50,
+                        help='Users the round trips and the allocations are measured on.')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=1, help='Processes of the server.')
+    parser.add_argument('--threads', type=int, default=32, help='Threads of a gunicorn worker.')
+    parser.add_argument('--smtp-latency', type=float, default=0.0)
+    parser.add_argument('--baseline', help='JSON file of the metrics to compare the run with.')
+    parser.add_argument('--save-baseline', help='JSON file the metrics of the run are saved to.')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from src.api import outbox, throttling
+    from src.api.utils import execute_insert_update_statement
+
+    sink = SMTPSink(latency=args.smtp_latency).start()
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    settings.EMAIL_HOST, settings.EMAIL_PORT = sink.server_address
+    prefix = 'bench-flow-%s' % uuid.uuid4().hex[:8]
+    emails = [f'{prefix}-{i}@example.com' for i in range(args.users)]
+    server = None
+    results = {}
+
+    try:
+        with patch.object(throttling, '_throttler', throttling.Throttler(throttling.LocalBackend(1))):
+            in_process = InProcessFlow()
+            if args.server == 'client':
+                signups = in_process.run(in_process.signup, [(email,) for email in emails])
+                tokens = signups[3]
+                activations = in_process.run(in_process.activate, list(zip(emails, tokens)))
+            else:
+                server, url = start_server(args.server, args.workers, args.threads)
+                flow = HttpFlow(url, args.concurrency)
+                signups = flow.signups(emails)
+                activations = flow.activations(emails, signups[3])
+
+            for step, (latencies, elapsed, statuses, _) in (('signup', signups), ('activate', activations)):
+                results[step] = step_metrics(latencies, elapsed)
+                summarize(f'{args.server} {step}', latencies, elapsed, {'statuses': dict(statuses)})
+
+            costs = request_costs(in_process, [f'{prefix}-cost-{i}@example.com' for i in range(args.cost_users)])
+            for step, metrics in costs.items():
+                results[step].update(metrics)
+                print('%-28s %6.2f round trips/request  %8.1f KB allocated/request' % (
+                    f'{step} costs', metrics['round_trips'], metrics['alloc_kb']))
+
+        dispatcher = outbox.Dispatcher(batch_size=100)
+        try:
+            with Timer() as timer:
+                while dispatcher.deliver_pending()['claimed']:
+                    pass
+        finally:
+            dispatcher.close()
+        results['emails'] = {'rps': dispatcher.stats['sent'] / timer.elapsed if timer.elapsed else 0.0}
+        print('%-28s %8.1f emails/s  %d received by the sink' % (
+            'activation emails', results['emails']['rps'], sink.messages))
+    finally:
+        if server is not None:
+            stop_server(server)
+        execute_insert_update_statement(
+            "with deleted as (delete from api_apiuser where email like %s returning email) "
+            "delete from api_outboxemail where recipient in (select email from deleted)",
+            [prefix + '%'])
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            sys.exit('Regressions: ' + ', '.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
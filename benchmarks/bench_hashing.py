@@ -0,0 +1,46 @@
+"""Password hashes per second, in the request threads and in worker processes.
+
+Every simulated request hashes one password, from `--threads` threads like
+the ones of a threaded WSGI server. The "inline" run hashes in the threads,
+as the views did before src/api/hashing.py, and can't use more than one core.
+The "pool" run uses `--workers` processes, by default one per core.
+
+    python -m benchmarks.bench_hashing --requests 200 --threads 16
+"""
+import argparse
+import os
+
+from benchmarks.bench_pool import run
+from benchmarks.common import setup_django, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    setup_django()
+    from src.api.hashing import Hasher
+
+    for name, workers in (('inline', 0), ('pool workers=%s' % args.workers, args.workers)):
+        hasher = Hasher(workers=workers, max_pending=args.threads)
+        try:
+            # start the workers before measuring
+            hasher.make_password('warm up')
+            latencies, elapsed = run(lambda i: hasher.make_password('password %s' % i),
+                                     args.requests, args.threads)
+            stats = hasher.stats()
+        finally:
+            hasher.close()
+        summarize(name, latencies, elapsed, {
+            'hash_ms': '%.1f' % (stats['avg_hash_time'] * 1000),
+            'wait_ms': '%.1f' % (stats['avg_wait_time'] * 1000),
+            'max_pending': stats['max_pending_seen'],
+            'rejected': stats['rejected'],
+        })
+
+
+if __name__ == '__main__':
+    main()
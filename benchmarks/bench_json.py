@@ -0,0 +1,63 @@
+"""Per-response cost of the JSON encoding, in microseconds.
+
+Builds the responses of @jsonify for a sign-up body and for a 415 error, and
+parses a sign-up request body, with:
+
+* "stdlib (before)": json.dumps to a str, as the views did before
+  src/api/serializers.py, and json.loads on the body
+* the serializers of src/api/serializers.py, with the 415 body encoded once
+
+    python -m benchmarks.bench_json --number 20000
+"""
+import argparse
+import json
+import timeit
+
+from benchmarks.common import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.http.response import HttpResponse
+    from src.api import decorators, serializers
+    from src.api.exceptions import Http415Error
+
+    content = {'message': 'Activation mail sent to foo@bar.com.', 'token': 'abcd'}
+    body = json.dumps({'email': 'foo@bar.com', 'password': 'baz'}).encode()
+    try:
+        raise Http415Error()
+    except Http415Error as ex:
+        error = ex
+
+    def before_response():
+        response = HttpResponse(status=201, content=json.dumps(content))
+        response['Content-Type'] = 'application/json'
+
+    def before_error():
+        response = HttpResponse(status=415, content=json.dumps(error.response))
+        response['Content-Type'] = 'application/json'
+
+    candidates = [('stdlib (before)', before_response, before_error, lambda: json.loads(body))]
+    for serializer_class in (serializers.JsonSerializer, serializers.OrjsonSerializer):
+        if serializer_class is serializers.OrjsonSerializer and serializers.orjson is None:
+            continue
+        serializer = serializer_class()
+        candidates.append((
+            serializer.name,
+            lambda s=serializer: decorators._json_response(content, 201, body=s.dumps(content)),
+            lambda: decorators._error_response(error),
+            lambda s=serializer: s.loads(body),
+        ))
+
+    for name, response, error_response, parse in candidates:
+        timings = [timeit.timeit(func, number=args.number) / args.number * 1e6
+                   for func in (response, error_response, parse)]
+        print('%-16s response=%6.2fus  error=%6.2fus  parse=%6.2fus' % ((name,) + tuple(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Throughput of the activation email delivery, against a local SMTP sink.
+
+Queues `--emails` activation emails in the outbox, and sends them once with a
+new SMTP connection per email, like send_activation_email does, then with the
+outbox Dispatcher, over one connection per worker.
+
+    python -m benchmarks.bench_mail --emails 2000 --latency 0.001
+"""
+import argparse
+import uuid
+
+from benchmarks.common import setup_django, Timer
+from benchmarks.smtp_sink import SMTPSink
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--emails', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Delay of every SMTP reply of the sink, in seconds.')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from src.api import outbox
+    from src.api.utils import (
+        activation_email, execute_insert_update_statement, send_activation_email
+    )
+
+    sink = SMTPSink(latency=args.latency).start()
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    settings.EMAIL_HOST, settings.EMAIL_PORT = sink.server_address
+
+    prefix = 'bench-mail-%s' % uuid.uuid4().hex[:8]
+    recipients = ['%s-%s@example.com' % (prefix, i) for i in range(args.emails)]
+    subject, body = activation_email('abcd')
+
+    with Timer() as timer:
+        for recipient in recipients:
+            send_activation_email(recipient, 'abcd')
+    print('%-28s %8.1f emails/s  %d SMTP connections' % (
+        'connection per email', args.emails / timer.elapsed, sink.connections))
+
+    execute_insert_update_statement(
+        "insert into api_outboxemail (recipient, subject, body, status, attempts, next_attempt_at, created_at) "
+        "select unnest(%s), %s, %s, 'pending', 0, now(), now()", [recipients, subject, body])
+    connections = sink.connections
+    dispatcher = outbox.Dispatcher(batch_size=args.batch_size)
+    try:
+        with Timer() as timer:
+            while dispatcher.deliver_pending()['claimed'] == args.batch_size:
+                pass
+    finally:
+        dispatcher.close()
+        execute_insert_update_statement(
+            "delete from api_outboxemail where recipient like %s", [prefix + '%'])
+    print('%-28s %8.1f emails/s  %d SMTP connections  (dispatcher: %.1f emails/s)' % (
+        'outbox dispatcher', dispatcher.stats['sent'] / timer.elapsed,
+        sink.connections - connections, dispatcher.throughput()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Connects per sign-up and latency, with and without the connection pool.
+
+Every simulated sign-up runs the same three statements as SignupView
+(select the user, insert it, save the token). The "connect per query" run
+opens and closes a psycopg2 connection for every statement, like the raw SQL
+helpers did before src/api/pool.py, the "pooled" run goes through the helpers.
+
+    python -m benchmarks.bench_pool --requests 2000 --threads 16
+"""
+import argparse
+import threading
+import time
+import uuid
+
+from benchmarks.common import setup_django, summarize, Timer
+
+
+def run(signup, requests, threads):
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        local = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            signup(i)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    with Timer() as timer:
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    return latencies, timer.elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    setup_django()
+    import psycopg2
+    from django.conf import settings
+    from src.api import utils
+    from src.api.pool import get_pool
+
+    prefix = 'bench-pool-%s' % uuid.uuid4().hex[:8]
+    connects = [0]
+    connects_lock = threading.Lock()
+
+    def execute(query):
+        conn = psycopg2.connect(
+            host=settings.DB_DEFAULT_HOST,
+            database=settings.DB_DEFAULT_NAME,
+            user=settings.DB_DEFAULT_USER,
+            password=settings.DB_DEFAULT_PASSWORD
+        )
+        with connects_lock:
+            connects[0] += 1
+        try:
+            cur = conn.cursor()
+            cur.execute(query)
+            result = cur.fetchall() if cur.description else None
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    def connect_per_query_signup(i):
+        email = '%s-a%s@example.com' % (prefix, i)
+        execute("select * from api_apiuser where email='%s' limit 1;" % email)
+        execute("insert into api_apiuser (email, password, activated, created_at) "
+                "values ('%s', 'x', false, now());" % email)
+        execute("update api_apiuser set token='abcd', token_sent_at=now() "
+                "where email='%s';" % email)
+
+    def pooled_signup(i):
+        email = '%s-b%s@example.com' % (prefix, i)
+        utils.execute_select_statement(
+            "select * from api_apiuser where email='%s' limit 1;" % email)
+        utils.execute_insert_update_statement(
+            "insert into api_apiuser (email, password, activated, created_at) "
+            "values ('%s', 'x', false, now());" % email)
+        utils.execute_insert_update_statement(
+            "update api_apiuser set token='abcd', token_sent_at=now() "
+            "where email='%s';" % email)
+
+    try:
+        latencies, elapsed = run(connect_per_query_signup, args.requests, args.threads)
+        summarize('connect per query', latencies, elapsed,
+                  {'connects/req': '%.2f' % (connects[0] / float(args.requests))})
+
+        before = get_pool().stats()['connects']
+        latencies, elapsed = run(pooled_signup, args.requests, args.threads)
+        stats = get_pool().stats()
+        summarize('pooled', latencies, elapsed, {
+            'connects/req': '%.4f' % ((stats['connects'] - before) / float(args.requests)),
+            'pool_size': stats['size'],
+            'waits': stats['waits'],
+        })
+    finally:
+        utils.execute_insert_update_statement(
+            "delete from api_apiuser where email like '%s%%';" % prefix)
+
+
+if __name__ == '__main__':
+    main()
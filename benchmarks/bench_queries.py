@@ -0,0 +1,67 @@
+"""Per query cost of string-built SQL against the prepared statements.
+
+Runs the get_api_user lookup and the save_token update back to back on one
+pooled connection, first formatted into the SQL with f-strings like the
+helpers used to do (parsed and planned by postgres on every call), then
+through the prepared statements of src/api/queries.py.
+
+    python -m benchmarks.bench_queries --iterations 20000
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime
+
+from benchmarks.common import setup_django, summarize, Timer
+
+
+def measure(run, iterations):
+    latencies = []
+    with Timer() as timer:
+        for i in range(iterations):
+            start = time.perf_counter()
+            run(i)
+            latencies.append(time.perf_counter() - start)
+    return latencies, timer.elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=10000)
+    args = parser.parse_args()
+
+    setup_django()
+    from src.api import queries
+    from src.api.pool import get_pool
+    from src.api.utils import delete_api_user, insert_api_user
+
+    email = 'bench-queries-%s@example.com' % uuid.uuid4().hex[:8]
+    insert_api_user(email, 'x')
+    try:
+        with get_pool().connection() as conn:
+            cur = conn.cursor()
+
+            def string_built(i):
+                cur.execute(f"select * from api_apiuser where email='{email}' "
+                            f"order by created_at desc limit 1;")
+                cur.fetchall()
+                cur.execute(f"update api_apiuser set token='{i % 10000:04}', "
+                            f"token_sent_at='{datetime.utcnow()}' where email='{email}';")
+
+            def prepared(i):
+                queries.execute(conn, [queries.GET_API_USER], {'email': email}).fetchall()
+                queries.execute(conn, [queries.SAVE_TOKEN], {
+                    'email': email, 'token': f'{i % 10000:04}',
+                    'token_sent_at': datetime.utcnow()})
+
+            for name, run in [('string built', string_built), ('prepared', prepared)]:
+                measure(run, min(1000, args.iterations))  # warm up
+                latencies, elapsed = measure(run, args.iterations)
+                summarize(name, latencies, elapsed,
+                          {'us/iteration': '%.1f' % (elapsed / args.iterations * 1e6)})
+    finally:
+        delete_api_user(email)
+
+
+if __name__ == '__main__':
+    main()
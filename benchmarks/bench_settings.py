@@ -0,0 +1,108 @@
+"""Startup and per request costs of the full settings, src/settings.py, and
+of the API only ones, src/settings_api.py.
+
+Starts `--runs` processes per settings module, each loading the WSGI
+application and sending `--requests` requests to it in process, without a
+server: GET /api/v1/sign_up/ (a 405) and POST /api/v1/sign_up/ without the
+email (a 400), which go through the whole middleware chain without
+touching the database. Reports the medians:
+
+    python -m benchmarks.bench_settings --runs 5 --requests 20000
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+
+PROFILES = ('src.settings', 'src.settings_api')
+
+
+def environ(method, body=b''):
+    return {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': '/api/v1/sign_up/',
+        'QUERY_STRING': '',
+        'SERVER_NAME': '127.0.0.1',
+        'SERVER_PORT': '8000',
+        'HTTP_HOST': '127.0.0.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+    }
+
+
+def child(requests):
+    """Measures the settings of DJANGO_SETTINGS_MODULE, prints them as JSON"""
+    started = time.perf_counter()
+    from django.core.wsgi import get_wsgi_application
+    from django.urls import get_resolver
+    application = get_wsgi_application()
+    get_resolver().url_patterns
+    startup = time.perf_counter() - started
+
+    def start_response(status, headers):
+        pass
+
+    results = {'startup': startup, 'modules': len(sys.modules),
+               'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    for name, method, body in (('405', 'GET', b''), ('400', 'POST', b'{}')):
+        with_body = [environ(method, body) for _ in range(requests)]
+        started = time.perf_counter()
+        for env in with_body:
+            response = application(env, start_response)
+            response.close()
+        results[name] = (time.perf_counter() - started) / requests
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.requests)
+
+    # the 4xx are logged in a line each, and would be throttled
+    env = dict(os.environ, PASSWORD_HASHING_WORKERS='0', API_THROTTLE_IP_RATE='',
+               LOG_LEVELS='src.api.errors=WARNING,django.request=ERROR')
+    measures = {}
+    for settings_module in PROFILES:
+        runs = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_settings', '--child', '--requests', str(args.requests)],
+                env=dict(env, DJANGO_SETTINGS_MODULE=settings_module), check=True, capture_output=True,
+                text=True).stdout
+            run = json.loads(output.splitlines()[-1])
+            run['process'] = time.perf_counter() - started
+            runs.append(run)
+        measures[settings_module] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+    print('%-18s %10s %10s %8s %9s %12s %12s' % (
+        'settings', 'startup', 'process', 'modules', 'rss', '405', '400'))
+    for settings_module, measure in measures.items():
+        print('%-18s %8.1fms %8.1fms %8d %7dKB %8.2fus/req %8.2fus/req' % (
+            settings_module, measure['startup'] * 1000, measure['process'] * 1000, measure['modules'],
+            measure['rss'], measure['405'] * 1e6, measure['400'] * 1e6))
+    full, api = (measures[settings_module] for settings_module in PROFILES)
+    print('gain: startup -%.1fms, 405 -%.2fus/req (%.0f%%), 400 -%.2fus/req (%.0f%%)' % (
+        (full['startup'] - api['startup']) * 1000,
+        (full['405'] - api['405']) * 1e6, (1 - api['405'] / full['405']) * 100,
+        (full['400'] - api['400']) * 1e6, (1 - api['400'] / full['400']) * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Overhead of the throttling of src/api/throttling.py per request.
+
+Runs `--requests` requests through ThrottleMiddleware in front of a view
+returning a constant response, without the middleware, and with it for one
+client IP and for `--clients` of them, as well as the sign-up and the
+activation checks of a view, on the local backend:
+
+    python -m benchmarks.bench_throttle --requests 200000
+"""
+import argparse
+from unittest.mock import patch
+
+from benchmarks.common import setup_django, Timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--clients', type=int, default=10000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from src.api import throttling
+
+    factory = RequestFactory()
+    response = HttpResponse()
+    requests = [factory.post('/api/v1/sign_up/', REMOTE_ADDR=f'10.0.{i // 256 % 256}.{i % 256}')
+                for i in range(args.clients)]
+    baseline = None
+
+    def report(name, elapsed):
+        per_request = elapsed / args.requests * 1e6
+        overhead = f'  +{per_request - baseline:.2f}us' if baseline is not None else ''
+        print('%-28s n=%-7d %8.2fus/request%s' % (name, args.requests, per_request, overhead))
+        return per_request
+
+    def run(handler, clients):
+        with Timer() as total:
+            for i in range(args.requests):
+                handler(requests[i % clients])
+        return total.elapsed
+
+    unthrottled = (lambda request: response)
+    baseline = report('no middleware', run(unthrottled, 1))
+
+    rate = (args.requests * 10, 60)
+    throttler = throttling.Throttler(throttling.LocalBackend(args.clients), ip_rate=rate, signup_rate=rate,
+                                     activation_rate=rate)
+    with patch.object(throttling, '_throttler', throttler):
+        middleware = throttling.ThrottleMiddleware(unthrottled)
+        report('middleware, 1 client', run(middleware, 1))
+        report(f'middleware, {args.clients} clients', run(middleware, args.clients))
+
+        emails = [f'throttle-{i}@bar.com' for i in range(args.clients)]
+        baseline = None
+        with Timer() as total:
+            for i in range(args.requests):
+                throttler.check_signup(emails[i % args.clients])
+        report('check_signup', total.elapsed)
+        with Timer() as total:
+            for i in range(args.requests):
+                throttler.check_activation(emails[i % args.clients])
+        report('check_activation', total.elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Helpers shared by the benchmark scripts.
+
+The benchmarks talk to the database configured by the DB_DEFAULT_* environment
+variables, the same one `manage.py runserver` uses, so run them from the web
+container (or with the same .env) after `python manage.py migrate`.
+"""
+import os
+import time
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
+    import django
+    django.setup()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(name, latencies, elapsed, extra=None):
+    """Print one line with throughput and latency percentiles (in ms)"""
+    line = '%-28s n=%-6d %8.1f req/s  p50=%7.2fms  p95=%7.2fms  p99=%7.2fms' % (
+        name, len(latencies), len(latencies) / elapsed if elapsed else 0.0,
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+        percentile(latencies, 99) * 1000)
+    if extra:
+        line += '  ' + '  '.join('%s=%s' % item for item in extra.items())
+    print(line)
+
+
+class Timer(object):
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,127 @@
+"""Concurrent sign-up load against a running server.
+
+Opens `--concurrency` keep-alive HTTP connections and sends `--requests`
+sign-ups with distinct emails over them, then prints the throughput and the
+latency percentiles. Compare the WSGI deployment with the ASGI one, which
+serves the async views (see requirements.txt of this directory):
+
+    gunicorn src.wsgi -w 1 --threads 32 -b 127.0.0.1:8001
+    uvicorn src.asgi:application --workers 1 --port 8002
+
+    python -m benchmarks.load_signup --url http://127.0.0.1:8001 --concurrency 500
+    python -m benchmarks.load_signup --url http://127.0.0.1:8002 --concurrency 500
+
+The users created are deleted at the end.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+
+from benchmarks.common import setup_django, summarize
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response, returns (status, body)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by the server')
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    body = await reader.readexactly(length) if length else b''
+    return status, body
+
+
+class Client(object):
+    """One keep-alive connection, reopened when the server closes it"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, payload, headers=None):
+        body = json.dumps(payload).encode()
+        extra = ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+        data = (f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n'
+                f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                f'{extra}\r\n').encode() + body
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self.writer.write(data)
+                await self.writer.drain()
+                return await read_response(self.reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def run(url, requests, concurrency, prefix):
+    parts = urlsplit(url)
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+    latencies, statuses = [], Counter()
+
+    async def worker():
+        client = Client(parts.hostname, parts.port or 80)
+        try:
+            while not queue.empty():
+                i = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    status, _ = await client.request('POST', '/api/v1/sign_up/', {
+                        'email': f'{prefix}-{i}@example.com', 'password': 'baz'})
+                except (OSError, asyncio.IncompleteReadError) as ex:
+                    status = type(ex).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] += 1
+        finally:
+            client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, time.perf_counter() - start, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+
+    prefix = 'bench-load-%s' % uuid.uuid4().hex[:8]
+    latencies, elapsed, statuses = asyncio.run(
+        run(args.url, args.requests, args.concurrency, prefix))
+    summarize(f'{args.url} c={args.concurrency}', latencies, elapsed,
+              {'statuses': dict(statuses)})
+
+    setup_django()
+    from src.api.utils import execute_insert_update_statement
+    execute_insert_update_statement(
+        "with deleted as (delete from api_apiuser where email like %s returning email) "
+        "delete from api_outboxemail where recipient in (select email from deleted)",
+        [prefix + '%'])
+
+
+if __name__ == '__main__':
+    main()
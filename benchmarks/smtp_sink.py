@@ -0,0 +1,84 @@
+"""Minimal SMTP server accepting and discarding every message.
+
+Stands in for mailhog or a relay in the benchmarks. `latency` delays every
+reply, to simulate a remote relay.
+
+    python -m benchmarks.smtp_sink --port 1025 --latency 0.002
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, *lines):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(b''.join(line.encode() + b'\r\n' for line in lines))
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply('220 smtp-sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.reply('250-smtp-sink', '250 8BITMIME')
+            elif command.startswith('DATA'):
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply('250 OK')
+            elif command.startswith('QUIT'):
+                self.reply('221 bye')
+                return
+            else:
+                # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0):
+        socketserver.ThreadingTCPServer.__init__(self, address, SMTPHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.connections = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serve from a daemon thread, returns the server"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = SMTPSink((args.host, args.port), latency=args.latency)
+    print('SMTP sink listening on %s:%s' % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('%s messages received over %s connections' % (server.messages, server.connections))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.admin.sites import NotRegistered
 from django.contrib.auth.models import Group, User
 
-from src.api.models import ApiUser
+from src.api.models import ApiUser, OutboxEmail
 
 # Register your models here.
 
@@ -23,4 +23,13 @@ class OfferAdmin(admin.ModelAdmin):
     list_filter = ('email',)
     list_display = ('email', 'password', 'activated', 'created_at')
     search_fields = ('email',)
-    ordering = ('email',)
\ No newline at end of file
+    ordering = ('email',)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    model = OutboxEmail
+    list_filter = ('status',)
+    list_display = ('recipient', 'subject', 'status', 'attempts', 'last_error', 'created_at', 'sent_at')
+    search_fields = ('recipient',)
+    ordering = ('-created_at',)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class UserRegistrationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'src.api'
+
+    def ready(self):
+        from django.core.signals import request_started
+        from src.api.outbox import ensure_workers_started
+        from src.api.reaper import ensure_reaper_started
+
+        request_started.connect(ensure_workers_started, dispatch_uid='outbox_workers')
+        request_started.connect(ensure_reaper_started, dispatch_uid='user_reaper')
@@ -0,0 +1,141 @@
+"""Bulk sign-up, behind BulkSignupView.
+
+The users are signed up `BULK_SIGNUP_CHUNK_SIZE` at a time: the passwords of
+a chunk are hashed on all the workers of the Hasher, the users saved and
+their activation emails queued by a single statement, and the results of the
+chunk are yielded before the next one is read.
+"""
+import itertools
+import logging
+
+from django.conf import settings
+
+from src.api import serializers
+from src.api.exceptions import HttpError, Http429Error
+from src.api.hashing import make_passwords
+from src.api.throttling import get_throttler
+from src.api.utils import bulk_signup_api_users, get_random_string
+
+
+logger = logging.getLogger(__name__)
+
+# the max_length of ApiUser.email
+EMAIL_MAX_LENGTH = 50
+
+
+def _readable(items, failures):
+    """The items, until one can't be read (e.g. Http413Error from
+    src/api/streaming.py), its error being appended to `failures`"""
+    try:
+        yield from items
+    except HttpError as ex:
+        failures.append(ex)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _check(item, seen):
+    """The error of `item`, None if it can be signed up"""
+    if isinstance(item, serializers.DecodeError):
+        return 'invalid', 'The line is not valid JSON.'
+    email = item.get('email') if isinstance(item, dict) else None
+    password = item.get('password') if isinstance(item, dict) else None
+    if not (email and password and isinstance(email, str) and isinstance(password, str)):
+        return 'invalid', 'Email, and password should be sent.'
+    # either would fail the statement of the whole chunk
+    if len(email) > EMAIL_MAX_LENGTH or '\x00' in email:
+        return 'invalid', f'The email should be at most {EMAIL_MAX_LENGTH} characters, without NUL.'
+    if email.lower() in seen:
+        return 'duplicate', f'{email} is already in the request.'
+    return None
+
+
+def sign_up(items, chunk_size=None, max_items=None, ip=None):
+    """Sign up the users of `items`, dicts with an email and a password.
+
+    Yields one result per item, in order: its `index`, `email`, and `status`,
+    `created` or `exists` with the activation `token`, or `invalid`,
+    `duplicate`, `throttled` and `error` with the `errors`. After
+    `max_items` items a last `invalid` result is yielded and the others are
+    ignored, and when the items can't be read anymore a last `error` one.
+
+    Each item counts for the bulk rate of the client `ip`, and a valid one as
+    a sign-up of its email, see src/api/throttling.py: the
+    items of a throttled email are `throttled`, and once the client is
+    throttled a last `throttled` result is yielded.
+    """
+    chunk_size = chunk_size or settings.BULK_SIGNUP_CHUNK_SIZE
+    max_items = max_items or settings.BULK_SIGNUP_MAX_ITEMS
+    throttler = get_throttler()
+    seen, failures, index, stopped = set(), [], -1, False
+    counts = dict.fromkeys(('created', 'exists', 'invalid', 'duplicate', 'throttled', 'error'), 0)
+
+    for chunk in _chunks(enumerate(_readable(items, failures)), chunk_size):
+        results, valid = [], []
+        for index, item in chunk:
+            if index >= max_items:
+                results.append({'index': index, 'status': 'invalid',
+                                'errors': f'At most {max_items} users can be signed up at once.'})
+                stopped = True
+                break
+            if ip is not None:
+                try:
+                    throttler.check_bulk(ip)
+                except Http429Error as ex:
+                    results.append({'index': index, 'status': 'throttled', 'errors': ex.response['errors'],
+                                    'retry_after': int(ex.headers['Retry-After'])})
+                    stopped = True
+                    break
+            result = {'index': index, 'email': item.get('email') if isinstance(item, dict) else None}
+            error = _check(item, seen)
+            if error is None:
+                try:
+                    throttler.check_signup(item['email'])
+                except Http429Error as ex:
+                    error = 'throttled', ex.response['errors']
+            if error is not None:
+                result['status'], result['errors'] = error
+            else:
+                seen.add(item['email'].lower())
+                valid.append((result, item['email'], item['password']))
+            results.append(result)
+
+        if valid:
+            try:
+                hashed_passwords = make_passwords([password for _, _, password in valid])
+                users = [(email, hashed_password, get_random_string())
+                         for (_, email, _), hashed_password in zip(valid, hashed_passwords)]
+                created = bulk_signup_api_users(users)
+            except HttpError as ex:
+                logger.error('Bulk sign-up of %s users failed: %s', len(valid), ex.response['errors'])
+                for result, _, _ in valid:
+                    result.update(status='error', errors=ex.response['errors'])
+            else:
+                for (result, _, _), (email, _, token) in zip(valid, users):
+                    result.update(status='created' if created.get(email.lower()) else 'exists',
+                                  token=token)
+
+        for result in results:
+            counts[result['status']] += 1
+        yield from results
+        if stopped:
+            break
+
+    if failures:
+        counts['error'] += 1
+        yield {'index': index + 1, 'status': 'error', 'errors': failures[0].response['errors']}
+
+    logger.info('Bulk sign-up: %(created)s users created, %(exists)s existing, %(invalid)s invalid, '
+                '%(duplicate)s duplicates, %(throttled)s throttled, %(error)s errors.', counts)
+
+
+def encode(results):
+    """The NDJSON lines of the `results` of sign_up"""
+    return (serializers.dumps(result) + b'\n' for result in results)
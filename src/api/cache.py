@@ -0,0 +1,355 @@
+"""In-process caches of the API.
+
+CredentialCache remembers the outcome of the last password check of an email
+for a short while, so a client retrying the activation with the same Basic
+credentials doesn't pay for a PBKDF2 run per retry. The password itself is
+never stored: entries are keyed by a digest of it, keyed with SECRET_KEY, and
+are only used while the stored password hash is the one checked.
+
+ReadThroughCache is in front of get_api_user, in the process (LocalBackend)
+or in a Django cache (DjangoCacheBackend), and loads a missing entry once for
+all the concurrent requests asking for it. The writes to a user invalidate
+its entry; with the local backend the other processes may serve the old one
+until it expires, after API_USER_CACHE_TTL seconds. The coroutines call a
+Django cache from a thread, its calls are network round trips with memcached
+or redis.
+"""
+import asyncio
+import hashlib
+import hmac
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from src.api.hashing import check_password, acheck_password
+
+
+class LRUCache(object):
+    """Thread safe mapping of at most `max_size` entries, each one expiring
+    `ttl` seconds after it was set. The least recently used entry is evicted
+    when it's full."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('evictions', 'expirations'), 0)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._stats['expirations'] += 1
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(size=len(self._data), max_size=self.max_size)
+        return stats
+
+
+_missing = object()
+# result of a load cancelled, its readers load the key again
+_cancelled = object()
+
+
+class LocalBackend(LRUCache):
+    """ReadThroughCache backend keeping the entries in the process"""
+    blocking = False
+
+
+class DjangoCacheBackend(object):
+    """ReadThroughCache backend keeping the entries in the Django cache
+    `alias`, e.g. a file based or memcached one shared by the processes"""
+    blocking = True
+
+    def __init__(self, alias, ttl, prefix):
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        return self.cache.get(self.prefix + key, default)
+
+    def set(self, key, value):
+        self.cache.set(self.prefix + key, value, self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(self.prefix + key)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return {}
+
+
+class _Load(object):
+    """A load in progress, waited for by the other readers of the key, on
+    `done` or on `future` for the coroutines"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.future = None
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class ReadThroughCache(object):
+    """Cache of the values returned by a loader, loading each missing key
+    once however many threads (or coroutines) ask for it at the same time.
+
+    A value loaded while its key was invalidated is returned to the readers
+    waiting for it but not cached, since it may predate the write. Neither is
+    a value for which `cacheable(value)` is false.
+    """
+
+    def __init__(self, backend, cacheable=None):
+        self.backend = backend
+        self.cacheable = cacheable
+        self._lock = threading.Lock()
+        self._loads = {}
+        self._async_loads = weakref.WeakKeyDictionary()
+        self._counters = dict.fromkeys(('hits', 'misses', 'coalesced'), 0)
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _cacheable(self, value):
+        return self.cacheable is None or self.cacheable(value)
+
+    async def _abackend(self, method, *args):
+        """method(*args) of the backend, in a thread when it blocks"""
+        if self.backend.blocking:
+            return await sync_to_async(method, thread_sensitive=False)(*args)
+        return method(*args)
+
+    def get(self, key, load):
+        """The value of `key`, from the cache or returned by `load()`"""
+        value = self.backend.get(key, _missing)
+        if value is not _missing:
+            self._count('hits')
+            return value
+
+        with self._lock:
+            current = self._loads.get(key)
+            if current is None:
+                current = self._loads[key] = _Load()
+                self._counters['misses'] += 1
+                leader = True
+            else:
+                self._counters['coalesced'] += 1
+                leader = False
+        if not leader:
+            current.done.wait()
+            if current.error is not None:
+                raise current.error
+            return current.value
+
+        try:
+            current.value = load()
+            with self._lock:
+                if not current.stale and self._cacheable(current.value):
+                    self.backend.set(key, current.value)
+            return current.value
+        except Exception as ex:
+            current.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._loads[key]
+            current.done.set()
+
+    async def aget(self, key, load):
+        """`get` for the coroutines, `load` being a coroutine function. The
+        loads are shared by the coroutines of the same event loop; when the
+        one loading a key is cancelled, the others load it again."""
+        value = await self._abackend(self.backend.get, key, _missing)
+        if value is not _missing:
+            self._count('hits')
+            return value
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loads = self._async_loads.setdefault(loop, {})
+        current = loads.get(key)
+        if current is not None:
+            self._count('coalesced')
+            value = await asyncio.shield(current.future)
+            if value is _cancelled:
+                return await self.aget(key, load)
+            return value
+
+        self._count('misses')
+        current = loads[key] = _Load()
+        current.future = loop.create_future()
+        try:
+            value = await load()
+        except asyncio.CancelledError:
+            current.future.set_result(_cancelled)
+            raise
+        except Exception as ex:
+            current.future.set_exception(ex)
+            # retrieved, or asyncio logs it when there's no other reader
+            current.future.exception()
+            raise
+        else:
+            if not current.stale and self._cacheable(value):
+                await self._abackend(self.backend.set, key, value)
+                if current.stale:
+                    # invalidated while it was being set
+                    await self._abackend(self.backend.delete, key)
+            current.future.set_result(value)
+            return value
+        finally:
+            del loads[key]
+
+    def _mark_stale(self, key):
+        with self._lock:
+            if key in self._loads:
+                self._loads[key].stale = True
+            for loads in list(self._async_loads.values()):
+                if key in loads:
+                    loads[key].stale = True
+
+    def invalidate(self, key):
+        self._mark_stale(key)
+        self.backend.delete(key)
+
+    async def ainvalidate(self, key):
+        self._mark_stale(key)
+        await self._abackend(self.backend.delete, key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        stats = self.backend.stats()
+        with self._lock:
+            stats.update(self._counters)
+        return stats
+
+
+class CredentialCache(object):
+    """Outcome of the last password check of each email, see the module
+    docstring.
+
+    :param max_size:    Number of emails remembered
+    :param ttl:         Seconds an outcome is reused
+    """
+
+    def __init__(self, max_size, ttl):
+        self._cache = LRUCache(max_size, ttl)
+        self._key = settings.SECRET_KEY.encode()
+        self._counters_lock = threading.Lock()
+        self._counters = dict.fromkeys(('hits', 'misses'), 0)
+
+    def _digest(self, password):
+        return hmac.new(self._key, password.encode(), hashlib.sha256).digest()
+
+    def _lookup(self, email, password, encoded):
+        digest = self._digest(password)
+        entry = self._cache.get(email.lower())
+        hit = entry is not None and entry[0] == digest and entry[1] == encoded
+        with self._counters_lock:
+            self._counters['hits' if hit else 'misses'] += 1
+        return digest, entry[2] if hit else None
+
+    def verify(self, email, password, encoded):
+        """Whether `password` matches the password hash `encoded` of the user
+        `email`, hashing it only when the outcome isn't cached"""
+        digest, result = self._lookup(email, password, encoded)
+        if result is None:
+            result = check_password(password, encoded)
+            self._cache.set(email.lower(), (digest, encoded, result))
+        return result
+
+    async def averify(self, email, password, encoded):
+        digest, result = self._lookup(email, password, encoded)
+        if result is None:
+            result = await acheck_password(password, encoded)
+            self._cache.set(email.lower(), (digest, encoded, result))
+        return result
+
+    def invalidate(self, email):
+        self._cache.delete(email.lower())
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        stats = self._cache.stats()
+        with self._counters_lock:
+            stats.update(self._counters)
+        return stats
+
+
+_caches_lock = threading.Lock()
+_credential_cache = None
+_user_cache = None
+
+
+def get_credential_cache():
+    global _credential_cache
+    if _credential_cache is None:
+        with _caches_lock:
+            if _credential_cache is None:
+                _credential_cache = CredentialCache(
+                    max_size=settings.CREDENTIAL_CACHE_SIZE,
+                    ttl=settings.CREDENTIAL_CACHE_TTL,
+                )
+    return _credential_cache
+
+
+def get_user_cache():
+    """Return the process wide cache of get_api_user, with the backend set by
+    API_USER_CACHE_BACKEND: `local`, the alias of a Django cache, or None
+    when disabled"""
+    global _user_cache
+    if _user_cache is None and settings.API_USER_CACHE_BACKEND:
+        with _caches_lock:
+            if _user_cache is None:
+                if settings.API_USER_CACHE_BACKEND == 'local':
+                    backend = LocalBackend(settings.API_USER_CACHE_SIZE, settings.API_USER_CACHE_TTL)
+                else:
+                    backend = DjangoCacheBackend(settings.API_USER_CACHE_BACKEND,
+                                                 settings.API_USER_CACHE_TTL, 'api_user:')
+                # a user missing here may be signing up through another process
+                _user_cache = ReadThroughCache(backend, cacheable=bool)
+    return _user_cache
@@ -1,16 +1,68 @@
-import json
+import asyncio
 import logging
-import traceback
 
-from functools import wraps
-from django.http.response import HttpResponse
-
-from .exceptions import HttpError, Http415Error, Http405Error
+from functools import lru_cache, wraps
+from django.core.exceptions import RequestDataTooBig
+from django.conf import settings
+from django.http import HttpRequest
+from django.http.response import HttpResponse, HttpResponseBase
+
+from .exceptions import HttpError, Http400Error, Http413Error, Http415Error, Http405Error
+from src.api import serializers
+from src.api.streaming import check_content_length
+from src.api.errors import report_error
+from src.api.metrics import span
+from src.api.profiling import profile
 from src.api.utils import ApiResponse
 
 
 logger = logging.getLogger(__name__)
 
+INTERNAL_ERROR = {"errors": ["Internal server error"]}
+
+
+@lru_cache(maxsize=None)
+def _encoded_error(error_class):
+    """Body of the errors raised with their default message (405, 415, ...),
+    encoded once"""
+    if error_class is None:
+        return serializers.dumps(INTERNAL_ERROR)
+    return serializers.dumps({'errors': error_class.default_message})
+
+
+def _json_response(raw_response, status_code=200, headers=None, body=None):
+    if body is None:
+        with span('json'):
+            body = serializers.dumps(raw_response) if raw_response is not None else b''
+    response = HttpResponse(status=status_code, content=body)
+    response['Content-Type'] = 'application/json'
+    for header, value in (headers or {}).items():
+        response[header] = value
+
+    return response
+
+
+def _view_response(result):
+    if isinstance(result, HttpResponseBase):
+        # e.g. a StreamingHttpResponse, already encoded by the view
+        return result
+    api_response = ApiResponse.from_object(result)
+    return _json_response(api_response.content, api_response.status, api_response.headers)
+
+
+def _error_response(err, args=()):
+    """Must be called while handling `err`, raised by the view called with
+    `args`"""
+    request = args[0] if args and isinstance(args[0], HttpRequest) else None
+    report_error(err, request)
+    if isinstance(err, HttpError):
+        body = None
+        if err.response['errors'] is getattr(err, 'default_message', None):
+            body = _encoded_error(type(err))
+        return _json_response(err.response, err.status_code, err.headers, body)
+
+    return _json_response(INTERNAL_ERROR, 500, body=_encoded_error(None))
+
 
 def jsonify(view):
     """Transforms the dictionary returned by the view into a
@@ -18,32 +70,27 @@ def jsonify(view):
 
     The view can also return an ApiResponse, which will have extra information,
     regarding the status code and the extra headers to be added to the response
+
+    Works with both regular and coroutine (async) views.
     """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                result = await view(*args, **kwargs)
+            except Exception as err:
+                return _error_response(err, args)
+            return _view_response(result)
+
+        return async_wrapper
+
     @wraps(view)
     def wrapper(*args, **kwargs):
-        headers = {}
         try:
-            api_response = ApiResponse.from_object(view(*args, **kwargs))
-            raw_response = api_response.content
-            status_code = api_response.status
-            headers.update(api_response.headers)
-        except HttpError as err:
-            raw_response = err.response
-            status_code = err.status_code
-            headers.update(err.headers)
-        except Exception as e:
-            raw_response = {"errors": ["Internal server error"]}
-            status_code = 500
-            traceback.print_exc()
-
-        response_body = (json.dumps(raw_response)
-                         if raw_response is not None else '')
-        response = HttpResponse(status=status_code, content=response_body)
-        response['Content-Type'] = 'application/json'
-        for header, value in headers.items():
-            response[header] = value
-
-        return response
+            result = view(*args, **kwargs)
+        except Exception as err:
+            return _error_response(err, args)
+        return _view_response(result)
 
     return wrapper
 
@@ -52,17 +99,53 @@ class restrict_contenttype(object):
     """On requests that have a body, restrict the allowed Content Type
 
     http://www.w3.org/Protocols/rfc2616/rfc2616-sec7.html#sec7.2.1
+
+    `ctype` can also be a tuple of the allowed types. For application/json
+    the body is parsed here, once, and the views read it from `request.json`
+    (None without a body). The other bodies are left unread, for the views
+    to stream them.
+
+    The bodies read here are at most API_MAX_BODY_SIZE bytes, larger ones
+    are rejected with a 413 from their Content-Length.
     """
     def __init__(self, ctype):
-        self.ctype = ctype
+        self.ctypes = (ctype,) if isinstance(ctype, str) else tuple(ctype)
+
+    @staticmethod
+    def body(request):
+        check_content_length(request, settings.API_MAX_BODY_SIZE)
+        try:
+            return request.body
+        except RequestDataTooBig:
+            raise Http413Error(
+                message=f'The request body should be at most {settings.API_MAX_BODY_SIZE} bytes.')
+
+    def check(self, request):
+        content_type = request.META.get('CONTENT_TYPE', '')
+        if (not any(ctype in content_type for ctype in self.ctypes) and
+                self.body(request)):
+            raise Http415Error()
+        request.json = None
+        if 'application/json' in self.ctypes and 'application/json' in content_type:
+            body = self.body(request)
+            if body:
+                try:
+                    with span('json'):
+                        request.json = serializers.loads(body)
+                except serializers.DecodeError:
+                    raise Http400Error(message='The request body is not valid JSON.')
 
     def __call__(self, view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                self.check(request)
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
         @wraps(view)
         def wrapper(request, *args, **kwargs):
-            if (self.ctype not in request.META.get('CONTENT_TYPE', []) and
-                    request.body):
-                raise Http415Error()
-
+            self.check(request)
             return view(request, *args, **kwargs)
         return wrapper
 
@@ -75,6 +158,15 @@ def require_http_methods(http_methods):
     :return:
     """
     def mediator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in http_methods:
+                    raise Http405Error(allowed_methods=http_methods)
+                return await func(request, *args, **kwargs)
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(request, *args, **kwargs):
             if request.method not in http_methods:
@@ -86,21 +178,57 @@ def require_http_methods(http_methods):
     return mediator
 
 
-def user_api(httpmethods):
-    """Decorator - wrapper around @jsonify, @require_http_method,
-     and @restrict_contenttype
+def user_api(httpmethods, ctype='application/json'):
+    """Decorator of the API views - does what @jsonify, @require_http_methods
+    and @restrict_contenttype stacked in that order do, in a single wrapper,
+    and profiles a sample of the calls, see src/api/profiling.py
 
-    The order matters
+    What doesn't depend on the request is computed once, when the view is
+    decorated: the set of the allowed methods, the content type check, and
+    the error and the body of the 405 responses, whose `Allow` header is
+    built once too. The view is csrf exempt, the API clients authenticate
+    with Basic credentials, not a session cookie.
     """
+    methods = frozenset(httpmethods)
+    not_allowed = Http405Error(allowed_methods=httpmethods)
+    check = restrict_contenttype(ctype).check
 
     def mediator(func):
-        @wraps(func)
-        @jsonify
-        @require_http_methods(httpmethods)
-        @restrict_contenttype('application/json')
-        def wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
+        not_allowed_body = _encoded_error(Http405Error)
+
+        def method_not_allowed(request):
+            report_error(not_allowed, request)
+            return _json_response(not_allowed.response, 405, not_allowed.headers, not_allowed_body)
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_dispatch(request, *args, **kwargs):
+                with profile(request, func):
+                    if request.method not in methods:
+                        return method_not_allowed(request)
+                    try:
+                        check(request)
+                        result = await func(request, *args, **kwargs)
+                    except Exception as err:
+                        return _error_response(err, (request,))
+                    return _view_response(result)
+
+            async_dispatch.csrf_exempt = True
+            return async_dispatch
 
-        return wrapper
+        @wraps(func)
+        def dispatch(request, *args, **kwargs):
+            with profile(request, func):
+                if request.method not in methods:
+                    return method_not_allowed(request)
+                try:
+                    check(request)
+                    result = func(request, *args, **kwargs)
+                except Exception as err:
+                    return _error_response(err, (request,))
+                return _view_response(result)
+
+        dispatch.csrf_exempt = True
+        return dispatch
 
     return mediator
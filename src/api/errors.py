@@ -0,0 +1,91 @@
+"""Reporting of the errors returned by the API.
+
+A client error (4xx) is logged as one compact line, the status code, the
+request and the reason, and with ERROR_REPORT_SAMPLE_RATE < 1 only a sample
+of them. A server error (5xx, or any unexpected exception) is logged with its
+traceback, at most ERROR_TRACEBACKS_PER_MINUTE times a minute: above that as
+a compact line, the number of tracebacks skipped being logged with the next
+one.
+"""
+import logging
+import random
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+from src.api.exceptions import HttpError
+from src.api.ratelimit import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorReporter(object):
+    """
+    :param tracebacks_per_minute:   Server errors logged with their traceback
+                                    per minute, in bursts of as many
+    :param sample_rate:             Fraction of the client errors logged
+    """
+
+    def __init__(self, tracebacks_per_minute, sample_rate):
+        self.tracebacks = TokenBucket(rate=tracebacks_per_minute / 60.0,
+                                      capacity=tracebacks_per_minute)
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._skipped = 0
+
+    def report(self, err, request=None):
+        """Report `err`, the exception being handled"""
+        status = err.status_code if isinstance(err, HttpError) else 500
+        with self._lock:
+            self._counts[status] += 1
+
+        if status < 500:
+            if (logger.isEnabledFor(logging.INFO) and
+                    (self.sample_rate >= 1 or random.random() < self.sample_rate)):
+                logger.info('%s %s: %s', status, _describe(request), err.response['errors'])
+            return
+
+        reason = (err.response['errors'] if isinstance(err, HttpError)
+                  else f'{type(err).__name__}: {err}')
+        if self.tracebacks.consume():
+            with self._lock:
+                skipped, self._skipped = self._skipped, 0
+            logger.error('%s %s: %s%s', status, _describe(request), reason,
+                         f' ({skipped} tracebacks skipped)' if skipped else '', exc_info=err)
+        else:
+            with self._lock:
+                self._skipped += 1
+            logger.error('%s %s: %s (traceback skipped)', status, _describe(request), reason)
+
+    def stats(self):
+        """Number of errors reported by status code, and of tracebacks
+        skipped since the last one logged"""
+        with self._lock:
+            return {'errors': dict(self._counts), 'tracebacks_skipped': self._skipped}
+
+
+def _describe(request):
+    return f'{request.method} {request.path}' if request is not None else '-'
+
+
+_reporter = None
+_reporter_lock = threading.Lock()
+
+
+def get_reporter():
+    global _reporter
+    if _reporter is None:
+        with _reporter_lock:
+            if _reporter is None:
+                _reporter = ErrorReporter(
+                    tracebacks_per_minute=settings.ERROR_TRACEBACKS_PER_MINUTE,
+                    sample_rate=settings.ERROR_REPORT_SAMPLE_RATE,
+                )
+    return _reporter
+
+
+def report_error(err, request=None):
+    get_reporter().report(err, request)
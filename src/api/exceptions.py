@@ -1,6 +1,3 @@
-import traceback
-
-
 class HttpError(Exception):
     """Base class for the API 4xx and 5xx status codes for the responses.
     ..because Django doesn't have  good exceptions other than Http404
@@ -35,7 +32,6 @@ class HttpError(Exception):
         self.response = {'errors': message}
         self.headers = headers
         super(HttpError, self).__init__(*args, **kwargs)
-        traceback.print_exc()
 
 class Http400Error(HttpError):
     """Bad Request
@@ -80,6 +76,14 @@ class Http405Error(HttpError):
                                            extra_headers, *args, **kwargs)
 
 
+class Http413Error(HttpError):
+    """Request entity too large
+    """
+    status_code = 413
+    default_message = 'Request body too large'
+    headers = {}
+
+
 class Http415Error(HttpError):
     """Unsupported media type
     """
@@ -88,6 +92,14 @@ class Http415Error(HttpError):
     headers = {}
 
 
+class Http429Error(HttpError):
+    """Too many requests, the client should retry after `Retry-After` seconds
+    """
+    status_code = 429
+    default_message = 'Too many requests'
+    headers = {'Retry-After': '1'}
+
+
 class Http500Error(HttpError):
     """Internal server error"""
     status_code = 500
@@ -95,3 +107,10 @@ class Http500Error(HttpError):
                        'for the inconvenience.')
     headers = {}
 
+
+class Http503Error(HttpError):
+    """Service unavailable, the client should retry after `Retry-After` seconds
+    """
+    status_code = 503
+    default_message = 'Service unavailable'
+    headers = {'Retry-After': '1'}
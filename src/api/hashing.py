@@ -0,0 +1,250 @@
+"""Password hashing off the request threads.
+
+make_password and check_password run PBKDF2 on purpose slowly, a few hundred
+milliseconds of CPU per call. Run on the request thread they hold the GIL, so
+a process can't hash more than one password at a time whatever its number of
+threads. The Hasher runs them in a pool of PASSWORD_HASHING_WORKERS processes
+instead, one per core by default.
+
+At most PASSWORD_HASHING_MAX_PENDING hashes are queued or running: above that
+the request fails right away with a 503, instead of waiting for a hash that
+would come after its client gave up.
+
+A worker killed, by the OOM killer say, breaks the whole pool: its workers
+are started again and the hash retried once, a 503 if they die again.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from src.api.exceptions import Http503Error
+from src.api.metrics import span
+
+
+logger = logging.getLogger(__name__)
+
+
+def _setup_worker():
+    # the workers are spawned, not forked from the threads of the server
+    import django
+    django.setup()
+
+def _make_password(password):
+    started = time.perf_counter()
+    return hashers.make_password(password), time.perf_counter() - started
+
+def _check_password(password, encoded):
+    started = time.perf_counter()
+    return hashers.check_password(password, encoded), time.perf_counter() - started
+
+
+class Hasher(object):
+    """Runs make_password and check_password in a pool of `workers` processes,
+    or inline when `workers` is 0.
+
+    :param workers:     Number of worker processes
+    :param max_pending: Number of hashes queued or running, above which the
+                        new ones are rejected with Http503Error
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = dict.fromkeys(('hashes', 'rejected', 'failed', 'restarts'), 0)
+        self._stats.update(max_pending_seen=0, hash_time=0.0, wait_time=0.0)
+        self._executor = self._new_executor() if workers else None
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_setup_worker,
+        )
+
+    def _restart(self, broken):
+        """Replace the executor `broken` by the death of a worker, once"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = self._new_executor()
+            self._stats['restarts'] += 1
+        logger.error('A password hashing worker died, %s workers started again', self.workers)
+        broken.shutdown(wait=False)
+
+    def _retried(self, call):
+        """call(executor), once more on new workers if one of them died"""
+        executor = self._executor
+        try:
+            return call(executor)
+        except BrokenProcessPool:
+            self._restart(executor)
+        try:
+            return call(self._executor)
+        except BrokenProcessPool:
+            self._restart(self._executor)
+            raise Http503Error(message='The password hashing workers died, retry later.')
+
+    async def _aretried(self, call):
+        executor = self._executor
+        try:
+            return await call(executor)
+        except BrokenProcessPool:
+            self._restart(executor)
+        try:
+            return await call(self._executor)
+        except BrokenProcessPool:
+            self._restart(self._executor)
+            raise Http503Error(message='The password hashing workers died, retry later.')
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise Http503Error(message='Too many requests are being processed, retry later.')
+            self._pending += 1
+            self._stats['max_pending_seen'] = max(self._stats['max_pending_seen'], self._pending)
+
+    def _release(self, elapsed, hash_time, count=1):
+        with self._lock:
+            self._pending -= 1
+            if hash_time is None:
+                self._stats['failed'] += count
+            else:
+                self._stats['hashes'] += count
+                self._stats['hash_time'] += hash_time
+                self._stats['wait_time'] += max(elapsed - hash_time, 0.0)
+
+    def _run(self, func, *args):
+        self._acquire()
+        started = time.perf_counter()
+        hash_time = None
+        try:
+            with span('hashing'):
+                if self._executor is None:
+                    result, hash_time = func(*args)
+                else:
+                    result, hash_time = self._retried(lambda executor: executor.submit(func, *args).result())
+            return result
+        finally:
+            self._release(time.perf_counter() - started, hash_time)
+
+    async def _arun(self, func, *args):
+        self._acquire()
+        started = time.perf_counter()
+        hash_time = None
+        try:
+            with span('hashing'):
+                if self._executor is None:
+                    # inline, in a thread so the event loop isn't blocked
+                    result, hash_time = await asyncio.get_running_loop().run_in_executor(None, func, *args)
+                else:
+                    result, hash_time = await self._aretried(
+                        lambda executor: asyncio.wrap_future(executor.submit(func, *args)))
+            return result
+        finally:
+            self._release(time.perf_counter() - started, hash_time)
+
+    def make_password(self, password):
+        return self._run(_make_password, password)
+
+    def check_password(self, password, encoded):
+        return self._run(_check_password, password, encoded)
+
+    def make_passwords(self, passwords):
+        """make_password for each one of `passwords`, on all the workers.
+
+        They are hashed `workers` at a time, so the hashes of the other
+        requests don't wait for the whole batch, which counts as one pending
+        hash for the backpressure.
+        """
+        self._acquire()
+        started = time.perf_counter()
+        hashed, hash_time = [], 0.0
+        try:
+            step = max(self.workers, 1)
+            for i in range(0, len(passwords), step):
+                wave = passwords[i:i + step]
+                with span('hashing'):
+                    if self._executor is None:
+                        results = [_make_password(password) for password in wave]
+                    else:
+                        results = self._retried(lambda executor: list(executor.map(_make_password, wave)))
+                for encoded, elapsed in results:
+                    hashed.append(encoded)
+                    hash_time += elapsed
+            return hashed
+        finally:
+            done = len(hashed) == len(passwords)
+            self._release(time.perf_counter() - started, hash_time if done else None,
+                          count=len(passwords))
+
+    async def amake_password(self, password):
+        return await self._arun(_make_password, password)
+
+    async def acheck_password(self, password, encoded):
+        return await self._arun(_check_password, password, encoded)
+
+    def stats(self):
+        """Counters of the hashes, with `pending` the current queue depth and
+        the average seconds spent hashing and waiting for a worker"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(pending=self._pending, workers=self.workers, max_pending=self.max_pending)
+        hashes = stats['hashes'] or 1
+        stats.update(avg_hash_time=stats['hash_time'] / hashes,
+                     avg_wait_time=stats['wait_time'] / hashes)
+        return stats
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    """Return the process wide Hasher, created again in a forked child since
+    the worker processes belong to the parent."""
+    global _hasher
+    hasher = _hasher
+    if hasher is None or hasher.pid != os.getpid():
+        with _hasher_lock:
+            if _hasher is None or _hasher.pid != os.getpid():
+                workers = settings.PASSWORD_HASHING_WORKERS
+                _hasher = Hasher(
+                    workers=workers,
+                    max_pending=settings.PASSWORD_HASHING_MAX_PENDING or 4 * max(workers, 1),
+                )
+                logger.debug('Password hasher with %s workers created for pid %s',
+                             workers, _hasher.pid)
+            hasher = _hasher
+    return hasher
+
+
+def make_password(password):
+    return get_hasher().make_password(password)
+
+def check_password(password, encoded):
+    return get_hasher().check_password(password, encoded)
+
+def make_passwords(passwords):
+    return get_hasher().make_passwords(passwords)
+
+async def amake_password(password):
+    return await get_hasher().amake_password(password)
+
+async def acheck_password(password, encoded):
+    return await get_hasher().acheck_password(password, encoded)
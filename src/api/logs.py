@@ -0,0 +1,109 @@
+"""Logging handler and formatter used by the LOGGING setting.
+
+QueueHandler only puts the records in a bounded queue: a QueueListener
+thread formats and writes them, so a request never waits on the log output.
+When the queue is full the records are dropped and counted rather than
+blocking the request.
+
+JsonFormatter writes one JSON object per line.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+from datetime import datetime, timezone
+from logging import handlers
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats the records as JSON lines, with the `extra` fields included"""
+
+    # attributes of every LogRecord, the other ones come from `extra`
+    reserved = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.reserved and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class QueueListener(handlers.QueueListener):
+
+    def enqueue_sentinel(self):
+        # waits for room in the queue, unlike the records
+        self.queue.put(self._sentinel)
+
+
+class QueueHandler(handlers.QueueHandler):
+    """Hands the records to a thread writing them to `stream` (stderr by
+    default), through a queue of `maxsize` records. The formatter set on this
+    handler is the one of the thread.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super(QueueHandler, self).__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream)
+        self.dropped = 0
+        self.listener = None
+        self._start()
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start(self):
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def _after_fork(self):
+        # the thread doesn't survive a fork, and may have left the queue locked
+        self.queue = queue.Queue(self.queue.maxsize)
+        self._start()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # only the message is built in the calling thread, while its
+        # arguments can't change anymore; the listener formats the rest
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Write the records left in the queue and stop the thread"""
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+    def close(self):
+        self.stop()
+        self.target.close()
+        super(QueueHandler, self).close()
+
+
+def parse_levels(value):
+    """The per logger levels of LOG_LEVELS, `name=LEVEL` comma separated,
+    as the `loggers` of the LOGGING setting"""
+    loggers = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, level = item.partition('=')
+        loggers[name.strip()] = {'level': level.strip().upper()}
+    return loggers
@@ -0,0 +1,48 @@
+import glob
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from src.api.profiling import COLLAPSED_RE, leaves, merge
+
+
+class Command(BaseCommand):
+    help = ('Merge the stacks sampled by the processes serving the API into a <view>.collapsed file per view, '
+            'for flamegraph.pl or speedscope.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help='Directory of the stacks of the processes (API_PROFILE_DIR).')
+        parser.add_argument('--output', default=None,
+                            help='Directory of the merged files, the one of the stacks when not set.')
+        parser.add_argument('--view', default=None,
+                            help='Print the merged stacks of that view, instead of the summary.')
+        parser.add_argument('--top', type=int, default=5,
+                            help='Frames sampled the most listed for each view.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete the stacks of the processes once merged.')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.API_PROFILE_DIR
+        profiles = merge(directory, options['output'])
+        if options['clear']:
+            for path in glob.glob(os.path.join(directory, '*.collapsed')):
+                if COLLAPSED_RE.match(os.path.basename(path)):
+                    os.remove(path)
+        if options['view']:
+            for stack, count in profiles.get(options['view'], Counter()).most_common():
+                self.stdout.write(f'{stack} {count}')
+            return
+        self.report(profiles, options['output'] or directory, options['top'])
+
+    def report(self, profiles, output, top):
+        if not profiles:
+            self.stdout.write('No stacks sampled, is API_PROFILE_SAMPLE_RATE set?')
+            return
+        for view, counts in sorted(profiles.items()):
+            total = sum(counts.values())
+            self.stdout.write(f'{view}: {total} samples, {os.path.join(output, view)}.collapsed')
+            for frame, count in leaves(counts, top):
+                self.stdout.write(f'  {count / total:6.1%} {frame}')
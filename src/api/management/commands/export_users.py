@@ -0,0 +1,63 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from src.api.exceptions import HttpError
+from src.api.utils import copy_api_users_to
+
+
+class ProgressFile(object):
+    """Binary file counting the lines written to it, reporting them every
+    `every` lines"""
+
+    def __init__(self, file, every, report):
+        self.file = file
+        self.every = every
+        self.report = report
+        self.lines = 0
+        self.size = 0
+        self._next_report = every
+
+    def write(self, data):
+        self.file.write(data)
+        self.lines += data.count(b'\n')
+        self.size += len(data)
+        if self.lines >= self._next_report:
+            self.report(self)
+            self._next_report = self.lines + self.every
+
+
+class Command(BaseCommand):
+    help = 'Export the users with COPY, as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File the users are written to, - for the standard output.')
+        parser.add_argument('--format', choices=('csv', 'ndjson'), default=None,
+                            help='Format of the file, by default from its extension, csv otherwise.')
+        parser.add_argument('--progress', type=int, default=100000,
+                            help='Number of users between two progress reports.')
+
+    def handle(self, *args, **options):
+        path, fmt = options['path'], options['format']
+        if fmt is None:
+            fmt = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+        # the reports go to stderr when the users are written to stdout
+        log = self.stderr if path == '-' else self.stdout
+        started = time.perf_counter()
+
+        def report(progress):
+            users = progress.lines - (fmt == 'csv')
+            log.write(f'Exported {users} users, {progress.size / 2 ** 20:.1f} MB '
+                      f'in {time.perf_counter() - started:.1f}s.')
+
+        file = sys.stdout.buffer if path == '-' else open(path, 'wb')
+        try:
+            progress = ProgressFile(file, options['progress'], report)
+            copy_api_users_to(progress, fmt)
+        except HttpError as ex:
+            raise CommandError(f"The export failed: {ex.response['errors']}")
+        finally:
+            if file is not sys.stdout.buffer:
+                file.close()
+        report(progress)
@@ -0,0 +1,108 @@
+import csv
+import itertools
+import time
+
+from django.contrib.auth.hashers import get_hashers_by_algorithm
+from django.core.management.base import BaseCommand, CommandError
+
+from src.api import serializers
+from src.api.exceptions import HttpError
+from src.api.hashing import make_passwords
+from src.api.queries import API_USER_COLUMNS
+from src.api.utils import copy_api_users_from
+
+
+def is_hashed(password):
+    """Whether `password` was encoded by one of the PASSWORD_HASHERS, rather
+    than being a plaintext password"""
+    algorithm, sep, _ = password.partition('$')
+    return bool(sep) and algorithm in get_hashers_by_algorithm()
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        if not reader.fieldnames or not {'email', 'password'} <= set(reader.fieldnames):
+            raise CommandError('The CSV file should have a header line with at least email and password.')
+        for user in reader:
+            # the empty values are the NULLs of the export
+            yield {column: value for column, value in user.items() if value != ''}
+
+
+def read_ndjson(path):
+    with open(path, 'rb') as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield serializers.loads(line)
+            except serializers.DecodeError:
+                raise CommandError(f'Line {number} is not valid JSON.')
+
+
+class Command(BaseCommand):
+    help = ('Import users with COPY, from CSV or NDJSON with the columns of export_users. '
+            'The first user of each email is imported, and the plaintext passwords are hashed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File the users are read from.')
+        parser.add_argument('--format', choices=('csv', 'ndjson'), default=None,
+                            help='Format of the file, by default from its extension, csv otherwise.')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Number of users read, hashed and copied at once.')
+        parser.add_argument('--replace', action='store_true',
+                            help='Replace the existing users instead of leaving them unchanged.')
+
+    def handle(self, *args, **options):
+        path, fmt = options['path'], options['format']
+        if fmt is None:
+            fmt = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+        users = read_ndjson(path) if fmt == 'ndjson' else read_csv(path)
+        self.started = time.perf_counter()
+        self.counts = dict.fromkeys(('read', 'invalid', 'hashed'), 0)
+
+        try:
+            result = copy_api_users_from(self.chunks(users, options['chunk_size']),
+                                         replace=options['replace'])
+        except HttpError as ex:
+            raise CommandError(f"The import failed: {ex.response['errors']}")
+
+        counts = dict(self.counts, **result)
+        counts.update(duplicates=result['copied'] - result['unique'],
+                      skipped=result['unique'] - result['created'] - result['replaced'])
+        self.stdout.write(
+            'Imported {read} users in {elapsed:.1f}s: {created} created, {replaced} replaced, {skipped} '
+            'existing left unchanged, {duplicates} duplicates, {invalid} invalid, '
+            '{hashed} plaintext passwords hashed.'.format(elapsed=time.perf_counter() - self.started, **counts))
+
+    def chunks(self, users, size):
+        """Lists of `size` rows for copy_api_users_from, with the plaintext
+        passwords hashed on the workers of the Hasher"""
+        users = iter(users)
+        while True:
+            chunk = list(itertools.islice(users, size))
+            if not chunk:
+                return
+            rows, plaintext = [], []
+            for user in chunk:
+                self.counts['read'] += 1
+                if not self.is_valid(user):
+                    self.counts['invalid'] += 1
+                    continue
+                row = [user.get(column) for column in API_USER_COLUMNS]
+                if not is_hashed(row[1]):
+                    plaintext.append(row)
+                rows.append(row)
+            if plaintext:
+                for row, hashed_password in zip(plaintext, make_passwords([row[1] for row in plaintext])):
+                    row[1] = hashed_password
+                self.counts['hashed'] += len(plaintext)
+            self.stdout.write(f"Read {self.counts['read']} users in {time.perf_counter() - self.started:.1f}s.")
+            yield rows
+
+    def is_valid(self, user):
+        if not isinstance(user, dict):
+            return False
+        email, password = user.get('email'), user.get('password')
+        return (isinstance(email, str) and isinstance(password, str) and
+                0 < len(email) <= 50 and password != '')
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from src.api import partitions
+
+
+class Command(BaseCommand):
+    help = ('Convert the users table to the partitioned layout of API_USER_PARTITIONS, or back, '
+            'and create its next partitions.')
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--convert', action='store_true',
+                           help='Convert the table to partitions, locking it while the users are copied.')
+        group.add_argument('--revert', action='store_true',
+                           help='Convert the partitioned table back to a single table.')
+        parser.add_argument('--granularity', choices=partitions.GRANULARITIES, default=None,
+                            help='Period of a partition (API_USER_PARTITIONS).')
+        parser.add_argument('--ahead', type=int, default=None,
+                            help='Partitions created in advance (API_USER_PARTITIONS_AHEAD).')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the former table as api_apiuser_unpartitioned after --convert.')
+
+    def handle(self, *args, **options):
+        granularity = options['granularity'] or settings.API_USER_PARTITIONS
+        if options['revert']:
+            partitions.revert()
+            self.stdout.write('The users table is not partitioned anymore, unset API_USER_PARTITIONS.')
+            return
+        if not granularity:
+            raise CommandError('Set API_USER_PARTITIONS or --granularity.')
+
+        try:
+            if options['convert']:
+                created = partitions.convert(granularity, options['ahead'], keep=options['keep'])
+            else:
+                created = partitions.create_partitions(ahead=options['ahead'], granularity=granularity)
+        except ValueError as ex:
+            raise CommandError(str(ex))
+        self.stdout.write(f"{len(created)} partitions created: {', '.join(created) or '-'}.")
+        for name, start, end in partitions.list_partitions():
+            self.stdout.write(f'{name}: {start:%Y-%m-%d} to {end:%Y-%m-%d}')
@@ -0,0 +1,43 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from src.api.reaper import Reaper, ReaperThread
+
+
+class Command(BaseCommand):
+    help = 'Delete the users not activated whose activation token expired.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Delete the expired users and exit, instead of running periodically.')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Seconds between two runs (USER_REAPER_INTERVAL, 60 when not set).')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of users deleted at once (USER_REAPER_BATCH_SIZE).')
+        parser.add_argument('--retention', type=float, default=None,
+                            help='Seconds after the token was sent before the user is deleted '
+                                 '(USER_REAPER_RETENTION).')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            reaper = Reaper(batch_size=options['batch_size'], retention=options['retention'])
+            reaper.reap()
+            self.report(reaper)
+            return
+
+        thread = ReaperThread(interval=options['interval'] or settings.USER_REAPER_INTERVAL or 60,
+                              batch_size=options['batch_size'], retention=options['retention'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: thread.stop())
+        self.stdout.write(f'Deleting the expired users every {thread.interval:g}s, CTRL-C to stop.')
+        thread.start()
+        while thread.is_alive():
+            thread.join(1)
+        self.report(thread.reaper)
+
+    def report(self, reaper):
+        stats = reaper.stats
+        self.stdout.write(f"Deleted {stats['deleted']} users not activated in {stats['batches']} batches, "
+                          f"{reaper.throughput():.1f} users/s.")
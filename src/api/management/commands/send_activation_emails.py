@@ -0,0 +1,43 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from src.api.outbox import Dispatcher, OutboxWorker
+
+
+class Command(BaseCommand):
+    help = 'Send the activation emails queued in the outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Send the emails due now and exit, instead of polling the outbox.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of emails claimed at once (EMAIL_OUTBOX_BATCH_SIZE).')
+        parser.add_argument('--flush-interval', type=float, default=None,
+                            help='Seconds between two partial batches (EMAIL_OUTBOX_FLUSH_INTERVAL).')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            dispatcher = Dispatcher(batch_size=options['batch_size'])
+            try:
+                while dispatcher.deliver_pending()['claimed'] == dispatcher.batch_size:
+                    pass
+            finally:
+                dispatcher.close()
+            self.report(dispatcher)
+            return
+
+        worker = OutboxWorker(flush_interval=options['flush_interval'],
+                              batch_size=options['batch_size'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+        self.stdout.write('Sending the queued emails, CTRL-C to stop.')
+        worker.start()
+        while worker.is_alive():
+            worker.join(1)
+        self.report(worker.dispatcher)
+
+    def report(self, dispatcher):
+        stats = dispatcher.stats
+        self.stdout.write(f"Sent {stats['sent']} emails, {stats['failed']} failed, "
+                          f"{dispatcher.throughput():.1f} emails/s over {stats['connects']} SMTP connections.")
@@ -0,0 +1,214 @@
+"""Timing of the requests and of their parts, the spans.
+
+With API_METRICS set, the code below records the duration of its spans:
+
+- `db`: a round trip to the database, checkout of a pooled connection included;
+- `db_connect`: the opening of a connection by a pool;
+- `hashing`: a password hashed or checked, waiting for a worker included;
+- `smtp`: an email sent;
+- `json`: a request body decoded, or a response body encoded.
+
+Each one is added to the histogram of its name, and to the spans of the
+current request, started by MetricsMiddleware, which also adds the duration
+of the whole request to the histogram of its view. The histograms of the
+process are served by metrics_view, at /metrics, in the Prometheus text
+format; with several worker processes each one serves its own. With
+API_SERVER_TIMING the durations of the spans of a request are sent back in
+its `Server-Timing` header.
+
+Disabled, a span costs a settings lookup.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+
+# upper bounds of the buckets of the histograms, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# {span name: [count, seconds]} of the current request
+_spans = contextvars.ContextVar('api_spans', default=None)
+
+
+class Histogram(object):
+    """Thread safe counts of the observed values in `buckets`, cumulated
+    when exported"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        """(cumulated counts of the buckets, +Inf last, sum)"""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulated, count = [], 0
+        for value in counts:
+            count += value
+            cumulated.append(count)
+        return cumulated, total
+
+
+class Registry(object):
+    """Histograms of the spans and of the requests, by name"""
+
+    def __init__(self):
+        self.spans = {}
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe_span(self, name, seconds):
+        self._histogram(self.spans, name).observe(seconds)
+
+    def observe_request(self, view, status, seconds):
+        self._histogram(self.requests, (view, status)).observe(seconds)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self.requests.clear()
+
+    def export(self):
+        """The histograms in the Prometheus text format"""
+        lines = []
+        for metric, description, histograms, labels in (
+                ('api_span_duration_seconds', 'Duration of the parts of the requests.',
+                 self.spans, lambda name: f'span="{name}"'),
+                ('api_request_duration_seconds', 'Duration of the requests, by view and status.',
+                 self.requests, lambda key: f'view="{key[0]}",status="{key[1]}"')):
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} histogram')
+            for key, histogram in sorted(histograms.items()):
+                label = labels(key)
+                cumulated, total = histogram.snapshot()
+                for bound, count in zip(histogram.buckets + ('+Inf',), cumulated):
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{metric}_sum{{{label}}} {total}')
+                lines.append(f'{metric}_count{{{label}}} {cumulated[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class _Span(object):
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        registry.observe_span(self.name, elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            entry = spans.get(self.name)
+            if entry is None:
+                spans[self.name] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+        return False
+
+
+class _NoSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_span = _NoSpan()
+
+
+def span(name):
+    """Context manager timing the span `name`"""
+    if not settings.API_METRICS:
+        return _no_span
+    return _Span(name)
+
+
+def server_timing(spans, total):
+    """`Server-Timing` header of the `spans` of a request, in milliseconds"""
+    parts = [f'{name};dur={seconds * 1000:.2f}' for name, (count, seconds) in spans.items()]
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+class MetricsMiddleware(object):
+    """Records the spans of the requests and their durations, by view"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.API_METRICS:
+            return self.get_response(request)
+        token = _spans.set({})
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            return self.record(request, response, started)
+        finally:
+            _spans.reset(token)
+
+    async def __acall__(self, request):
+        if not settings.API_METRICS:
+            return await self.get_response(request)
+        token = _spans.set({})
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            return self.record(request, response, started)
+        finally:
+            _spans.reset(token)
+
+    def record(self, request, response, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match is not None else 'unmatched'
+        registry.observe_request(view, response.status_code, elapsed)
+        if settings.API_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(_spans.get(), elapsed)
+        return response
+
+
+def metrics_view(request):
+    """The histograms of the process, for Prometheus"""
+    if not settings.API_METRICS:
+        raise Http404()
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
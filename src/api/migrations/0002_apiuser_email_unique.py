@@ -0,0 +1,67 @@
+from django.db import migrations
+
+
+INDEX = 'api_apiuser_email_lower_uniq'
+
+
+def index_valid(cursor):
+    """Whether INDEX is valid, None when it doesn't exist"""
+    cursor.execute("select indisvalid from pg_index where indexrelid = to_regclass(%s)", [INDEX])
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def drop_invalid_index(apps, schema_editor):
+    """An interrupted or failed concurrent build leaves an invalid index,
+    which `if not exists` would keep"""
+    with schema_editor.connection.cursor() as cursor:
+        if index_valid(cursor) is False:
+            cursor.execute(f'drop index concurrently {INDEX}')
+
+
+def check_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if not index_valid(cursor):
+            raise RuntimeError(f'The index {INDEX} is invalid, drop it and migrate again')
+
+
+class Migration(migrations.Migration):
+    """Case insensitive unique index on ApiUser.email.
+
+    The duplicates left by the concurrent sign-ups are removed first, keeping
+    per email the activated row, if any, otherwise the most recent one. The
+    index is built concurrently, so it doesn't lock the table for writes; an
+invalid one left by a former build is dropped first.
+    """
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+                delete from api_apiuser
+                where id in (
+                    select id from (
+                        select id, row_number() over (
+                            partition by lower(email)
+                            order by activated desc, created_at desc, id desc
+                        ) as position
+                        from api_apiuser
+                        where email is not null
+                    ) ranked
+                    where position > 1
+                );
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(drop_invalid_index, migrations.RunPython.noop),
+        migrations.RunSQL(
+            sql=f"create unique index concurrently if not exists {INDEX} on api_apiuser (lower(email));",
+            reverse_sql=f"drop index concurrently if exists {INDEX};",
+        ),
+        migrations.RunPython(check_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Index of the users not activated, by token_sent_at, scanned by the
+    reaper of src/api/reaper.py. Built concurrently, like the one of 0002."""
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0003_outboxemail'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="create index concurrently if not exists api_apiuser_unactivated_idx "
+                "on api_apiuser (token_sent_at) where not activated;",
+            reverse_sql="drop index concurrently if exists api_apiuser_unactivated_idx;",
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 
 
 class ApiUser(models.Model):
+    # unique case insensitive, with the index on lower(email) of migration 0002
     email = models.CharField(max_length=50,  null=True)
     password = models.CharField(max_length=1024, null=True)
     token = models.CharField(max_length=4, null=True)
@@ -13,3 +14,31 @@ class ApiUser(models.Model):
         return self.email
 
     objects = models.Manager()
+
+
+class OutboxEmail(models.Model):
+    """Email waiting to be sent by the outbox workers, see src/api/outbox.py"""
+    PENDING = 'pending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUSES = [(PENDING, 'Pending'), (SENT, 'Sent'), (DEAD, 'Dead')]
+
+    recipient = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='api_outbox_pending_idx',
+                         condition=models.Q(status='pending')),
+            models.Index(fields=['recipient'], name='api_outbox_recipient_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipient}: {self.subject}'
@@ -0,0 +1,219 @@
+"""Delivery of the emails queued in the api_outboxemail table.
+
+The sign-up only queues the activation email, in the same statement that saves
+the token, and returns. The emails are sent in batches by workers, either the
+`send_activation_emails` management command or, with EMAIL_OUTBOX_WORKERS > 0,
+threads of the web process, each one keeping its SMTP connection open.
+
+A failed email is retried with an exponential backoff, and after
+EMAIL_OUTBOX_MAX_ATTEMPTS attempts it's left in the `dead` status, like the
+ones not sent within EMAIL_OUTBOX_MAX_AGE seconds.
+"""
+import logging
+import os
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from src.api import queries
+from src.api.metrics import span
+from src.api.utils import execute_prepared_statement
+
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt, after `attempts` failed ones"""
+    delay = settings.EMAIL_OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return min(delay, settings.EMAIL_OUTBOX_MAX_RETRY_DELAY)
+
+
+def claim_pending(limit):
+    """Claim up to `limit` emails due for sending, as
+    (id, recipient, subject, body, attempts) tuples"""
+    return execute_prepared_statement(queries.CLAIM_OUTBOX_EMAILS, params={
+        'limit': limit,
+        'lease': settings.EMAIL_OUTBOX_LEASE,
+    })
+
+def mark_sent(email_ids):
+    execute_prepared_statement(queries.MARK_OUTBOX_EMAILS_SENT, params={'ids': list(email_ids)})
+
+def mark_failed(email_id, attempts, error):
+    dead = attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+    execute_prepared_statement(queries.MARK_OUTBOX_EMAIL_FAILED, params={
+        'id': email_id,
+        'error': error,
+        'retry_in': retry_delay(attempts),
+        'dead': dead,
+    })
+    return dead
+
+def expire_pending():
+    execute_prepared_statement(queries.EXPIRE_OUTBOX_EMAILS, params={
+        'max_age': settings.EMAIL_OUTBOX_MAX_AGE,
+    })
+
+
+# errors after which the SMTP connection is opened again before retrying
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+class Dispatcher(object):
+    """Sends the claimed emails in batches, over one SMTP connection kept
+    open between the batches.
+
+    When the connection breaks it's opened again and the email is retried
+    once before being marked as failed. The connection is closed after
+    EMAIL_SMTP_KEEPALIVE seconds without emails to send.
+    """
+
+    def __init__(self, batch_size=None, keepalive=None):
+        self.batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+        self.keepalive = settings.EMAIL_SMTP_KEEPALIVE if keepalive is None else keepalive
+        self.connection = None
+        self.last_used = None
+        self.stats = dict.fromkeys(('batches', 'sent', 'failed', 'connects'), 0)
+        self.sending_time = 0.0
+
+    def open(self):
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+            self.stats['connects'] += 1
+            self.last_used = time.monotonic()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            try:
+                connection.close()
+            except Exception as ex:
+                logger.debug('Failed to close the SMTP connection: %s', ex)
+
+    def close_if_idle(self):
+        if (self.connection is not None and
+                time.monotonic() - self.last_used >= self.keepalive):
+            self.close()
+
+    def send(self, message):
+        with span('smtp'):
+            try:
+                self.open().send_messages([message])
+            except CONNECTION_ERRORS as ex:
+                logger.info('SMTP connection lost (%s), reconnecting.', ex)
+                self.close()
+                self.open().send_messages([message])
+
+    def deliver_pending(self, limit=None):
+        """Send one batch of the emails due for sending. Returns the number
+        of emails claimed, sent and failed, as a dict"""
+        expire_pending()
+        claimed = claim_pending(limit or self.batch_size)
+        result = {'claimed': len(claimed), 'sent': 0, 'failed': 0}
+        if not claimed:
+            return result
+
+        started = time.monotonic()
+        sent_ids = []
+        for email_id, recipient, subject, body, attempts in claimed:
+            message = EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [recipient])
+            try:
+                self.send(message)
+            except Exception as ex:
+                result['failed'] += 1
+                if mark_failed(email_id, attempts, str(ex)):
+                    logger.error('Giving up on the email %s to %s after %s attempts: %s',
+                                 email_id, recipient, attempts, ex)
+                else:
+                    logger.warning('Failed to send the email %s to %s: %s', email_id, recipient, ex)
+            else:
+                result['sent'] += 1
+                sent_ids.append(email_id)
+        if sent_ids:
+            mark_sent(sent_ids)
+
+        self.last_used = time.monotonic()
+        self.sending_time += self.last_used - started
+        self.stats['batches'] += 1
+        self.stats['sent'] += result['sent']
+        self.stats['failed'] += result['failed']
+        return result
+
+    def throughput(self):
+        """Emails sent per second of sending, SMTP and database time included"""
+        return self.stats['sent'] / self.sending_time if self.sending_time else 0.0
+
+
+def deliver_pending(limit=None):
+    """Send one batch of the emails due for sending, over a new connection"""
+    dispatcher = Dispatcher(batch_size=limit)
+    try:
+        return dispatcher.deliver_pending()
+    finally:
+        dispatcher.close()
+
+
+class OutboxWorker(threading.Thread):
+    """Thread sending the emails in batches until stopped. A partial batch
+    means the outbox is drained, the next one is sent after `flush_interval`
+    seconds. The throughput is logged every EMAIL_OUTBOX_REPORT_INTERVAL
+    seconds."""
+
+    def __init__(self, flush_interval=None, batch_size=None, **kwargs):
+        kwargs.setdefault('daemon', True)
+        super(OutboxWorker, self).__init__(**kwargs)
+        self.flush_interval = flush_interval or settings.EMAIL_OUTBOX_FLUSH_INTERVAL
+        self.dispatcher = Dispatcher(batch_size=batch_size)
+        self.stopped = threading.Event()
+
+    def report(self):
+        stats = self.dispatcher.stats
+        logger.info('%s: %s emails sent, %s failed, %.1f emails/s', self.name,
+                    stats['sent'], stats['failed'], self.dispatcher.throughput())
+
+    def run(self):
+        next_report = time.monotonic() + settings.EMAIL_OUTBOX_REPORT_INTERVAL
+        while not self.stopped.is_set():
+            try:
+                result = self.dispatcher.deliver_pending()
+            except Exception as ex:
+                logger.error('Outbox delivery failed: %s', ex)
+                result = {'claimed': 0}
+            if time.monotonic() >= next_report:
+                self.report()
+                next_report = time.monotonic() + settings.EMAIL_OUTBOX_REPORT_INTERVAL
+            if result['claimed'] < self.dispatcher.batch_size:
+                self.dispatcher.close_if_idle()
+                self.stopped.wait(self.flush_interval)
+        self.dispatcher.close()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_workers = []
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+
+def ensure_workers_started(**kwargs):
+    """Start EMAIL_OUTBOX_WORKERS worker threads in the current process, if
+    not started yet. Connected to the `request_started` signal, so the
+    workers only run in the processes serving requests."""
+    global _workers_pid
+    if not settings.EMAIL_OUTBOX_WORKERS or _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers[:] = [OutboxWorker(name=f'outbox-worker-{i}')
+                       for i in range(settings.EMAIL_OUTBOX_WORKERS)]
+        for worker in _workers:
+            worker.start()
+        _workers_pid = os.getpid()
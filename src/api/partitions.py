@@ -0,0 +1,544 @@
+"""Optional partitioned layout of the api_apiuser table.
+
+With API_USER_PARTITIONS set to `day`, `week` or `month`, api_apiuser is
+range partitioned on created_at, one partition per period, each one list
+partitioned on `activated` into a `_pending` and an `_active` table. The users
+not activated are in the `_pending` tables, so once the last one of a period
+expired, the whole table is dropped by the reaper instead of deleting its
+rows one by one. In this layout the created_at of the users not activated is
+the time of their last sign-up, like the `auto_now` of the model.
+
+A unique index has to include the partition keys, so the emails are unique
+through the api_apiuser_email table instead: the lowercased email of each
+user with its id and partition keys, kept up to date by a trigger. The
+lookups by email go through it, which lets postgres prune all the partitions
+but the one of the user. The sign-ups lock their emails with advisory locks
+first, since they can't rely on `on conflict (lower(email))` anymore.
+
+The table is converted with `manage.py partition_users --convert`, and back
+with `--revert`; API_USER_PARTITIONS has to be set along with it. The
+partitions of the next API_USER_PARTITIONS_AHEAD periods are created by the
+conversion, the reaper of src/api/reaper.py and `partition_users`, one of
+them has to run before they are all used.
+"""
+import logging
+from datetime import datetime, timedelta
+
+import pytz
+from django.conf import settings
+from psycopg2 import sql
+
+from src.api import queries
+from src.api.pool import get_pool
+from src.api.queries import Statement
+
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('day', 'week', 'month')
+
+# first key of the advisory locks taken on the emails, and stripes of the
+# second key: a sign-up locks hashtext(lower(email)) & EMAIL_LOCK_STRIPES - 1
+EMAIL_LOCK_NAMESPACE = 7431
+EMAIL_LOCK_STRIPES = 256
+# second key of the lock serializing the creation of the partitions
+MAINTENANCE_LOCK = -1
+
+
+def period_start(moment, granularity):
+    """Start of the period of `moment`, in UTC"""
+    moment = moment.astimezone(pytz.UTC) if moment.tzinfo else pytz.UTC.localize(moment)
+    start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'week':
+        start -= timedelta(days=start.weekday())
+    elif granularity == 'month':
+        start = start.replace(day=1)
+    return start
+
+
+def utc_day(expression):
+    """SQL of the UTC day of the timestamptz `expression`, a timestamp
+    period_start takes as UTC whatever the TimeZone of the session"""
+    return f"date_trunc('day', ({expression}) at time zone 'UTC')"
+
+
+def next_period(start, granularity):
+    if granularity == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=7 if granularity == 'week' else 1)
+
+
+def partition_name(start):
+    return f'api_apiuser_p{start:%Y%m%d}'
+
+
+def _check_granularity(granularity):
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'The granularity should be one of {", ".join(GRANULARITIES)}, not {granularity!r}.')
+    return granularity
+
+
+def _create_partition(cur, start, granularity):
+    """Create the partition of the period starting at `start` and its
+    `_pending` and `_active` tables, unless they exist. Returns whether
+    something was created"""
+    name = partition_name(start)
+    cur.execute("select to_regclass(%s), to_regclass(%s), to_regclass(%s)",
+                [name, name + '_pending', name + '_active'])
+    partition, pending, active = cur.fetchone()
+    if partition is None:
+        cur.execute(sql.SQL(
+            "create table {} partition of api_apiuser for values from (%s) to (%s) partition by list (activated)"
+        ).format(sql.Identifier(name)), [start, next_period(start, granularity)])
+    if pending is None:
+        cur.execute(sql.SQL("create table {} partition of {} for values in (false)").format(
+            sql.Identifier(name + '_pending'), sql.Identifier(name)))
+    if active is None:
+        cur.execute(sql.SQL("create table {} partition of {} for values in (true)").format(
+            sql.Identifier(name + '_active'), sql.Identifier(name)))
+    return None in (partition, pending, active)
+
+
+def _create_partitions(cur, starts, granularity):
+    cur.execute("select pg_advisory_xact_lock(%s, %s)", [EMAIL_LOCK_NAMESPACE, MAINTENANCE_LOCK])
+    return [partition_name(start) for start in sorted(set(starts))
+            if _create_partition(cur, start, granularity)]
+
+
+def _commit_partitions(conn, starts, granularity):
+    """_create_partitions in a transaction of `conn`, left in autocommit"""
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            created = _create_partitions(cur, starts, granularity)
+        conn.commit()
+    finally:
+        # a no-op once committed
+        conn.rollback()
+        conn.autocommit = True
+    return created
+
+
+def create_partitions(moments=(), ahead=None, granularity=None, conn=None):
+    """Create the missing partitions of the current period, of the next
+    `ahead` ones (API_USER_PARTITIONS_AHEAD) and of the periods of
+    `moments`, on `conn`, a connection of the pool already held by the
+    caller, or on one of its own. Returns the names of the partitions
+    created"""
+    granularity = _check_granularity(granularity or settings.API_USER_PARTITIONS)
+    ahead = settings.API_USER_PARTITIONS_AHEAD if ahead is None else ahead
+    starts = [period_start(datetime.utcnow(), granularity)]
+    for _ in range(ahead):
+        starts.append(next_period(starts[-1], granularity))
+    starts.extend(period_start(moment, granularity) for moment in moments)
+
+    if conn is None:
+        with get_pool().connection() as conn:
+            created = _commit_partitions(conn, starts, granularity)
+    else:
+        created = _commit_partitions(conn, starts, granularity)
+    if created:
+        logger.info('Partitions %s of api_apiuser created.', ', '.join(created))
+    return created
+
+
+# the partitions of api_apiuser as (name, start, end)
+LIST_PARTITIONS_SQL = r"""
+    select c.relname,
+        (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \(''([^'']+)''\)'))[1]::timestamptz,
+        (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \(''([^'']+)''\)'))[1]::timestamptz
+    from pg_inherits i join pg_class c on c.oid = i.inhrelid
+    where i.inhparent = 'api_apiuser'::regclass
+    order by 2
+"""
+
+
+def list_partitions():
+    """The partitions of api_apiuser, as (name, start, end) tuples"""
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(LIST_PARTITIONS_SQL)
+            return cur.fetchall()
+
+
+def drop_expired_partitions(retention):
+    """Drop the `_pending` tables of the periods which ended more than
+    `retention` seconds ago. Returns their names.
+
+    Their rows in api_apiuser_email are left behind: they are ignored by the
+    lookups and deleted afterwards by the reaper, with PURGE_ORPHAN_EMAILS.
+    """
+    deadline = pytz.UTC.localize(datetime.utcnow() - timedelta(seconds=retention))
+    dropped = []
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(LIST_PARTITIONS_SQL)
+            for name, _, end in cur.fetchall():
+                if end > deadline:
+                    break
+                cur.execute("select to_regclass(%s)", [name + '_pending'])
+                if cur.fetchone()[0] is not None:
+                    cur.execute(sql.SQL("drop table {}").format(sql.Identifier(name + '_pending')))
+                    dropped.append(name + '_pending')
+    if dropped:
+        logger.info('Partitions %s of api_apiuser dropped.', ', '.join(dropped))
+    return dropped
+
+
+# Keeps api_apiuser_email up to date. A row moved to another partition, by
+# an update of created_at or activated, is deleted and inserted again. The
+# email of a user of a dropped partition is taken over, another one is a
+# duplicate.
+SYNC_FUNCTION_SQL = """
+    create or replace function api_apiuser_email_sync() returns trigger as $$
+    begin
+        if tg_op in ('DELETE', 'UPDATE') and old.email is not null then
+            if tg_op = 'UPDATE' and new.email is not null then
+                update api_apiuser_email
+                set email=lower(new.email), id=new.id, created_at=new.created_at, activated=new.activated
+                where email=lower(old.email) and id=old.id;
+                if found then
+                    return null;
+                end if;
+            end if;
+            delete from api_apiuser_email where email=lower(old.email) and id=old.id;
+        end if;
+        if tg_op in ('INSERT', 'UPDATE') and new.email is not null then
+            insert into api_apiuser_email (email, id, created_at, activated)
+            values (lower(new.email), new.id, new.created_at, new.activated)
+            on conflict (email) do update
+            set id=excluded.id, created_at=excluded.created_at, activated=excluded.activated
+            where api_apiuser_email.id = excluded.id or not exists (
+                select 1 from api_apiuser u
+                where u.id = api_apiuser_email.id and u.created_at = api_apiuser_email.created_at
+                and u.activated = api_apiuser_email.activated
+            );
+            if not found then
+                raise unique_violation using
+                    message = format('The email %s is already used.', new.email),
+                    constraint = 'api_apiuser_email_pkey';
+            end if;
+        end if;
+        return null;
+    end;
+    $$ language plpgsql
+"""
+
+CONVERT_SQL = """
+    lock table api_apiuser in access exclusive mode;
+    alter table api_apiuser rename to api_apiuser_unpartitioned;
+    alter index api_apiuser_pkey rename to api_apiuser_unpartitioned_pkey;
+    alter index api_apiuser_email_lower_uniq rename to api_apiuser_unpartitioned_email_lower_uniq;
+    alter index if exists api_apiuser_unactivated_idx rename to api_apiuser_unpartitioned_unactivated_idx;
+
+    create table api_apiuser (like api_apiuser_unpartitioned including defaults)
+    partition by range (created_at);
+    alter table api_apiuser add constraint api_apiuser_pkey primary key (id, created_at, activated);
+    create index api_apiuser_unactivated_idx on api_apiuser (token_sent_at) where not activated;
+    alter sequence api_apiuser_id_seq owned by api_apiuser.id;
+
+    create table api_apiuser_email (
+        email varchar(50) not null constraint api_apiuser_email_pkey primary key,
+        id bigint not null,
+        created_at timestamptz not null,
+        activated boolean not null
+    );
+    create index api_apiuser_email_unactivated_idx on api_apiuser_email (created_at) where not activated;
+"""
+
+# The created_at of a user not activated, in the partitioned layout: the
+# unpartitioned one leaves it unchanged on a new sign-up, which only sets
+# token_sent_at. Copied as is, a user who signed up again would land in the
+# `_pending` table of the first sign-up and be dropped with it while the
+# token is still valid.
+PENDING_CREATED_AT = """
+    case when activated then created_at else greatest(created_at, coalesce(token_sent_at, created_at)) end
+"""
+
+CONVERT_DATA_SQL = f"""
+    insert into api_apiuser (id, email, password, token, activated, token_sent_at, created_at)
+    select id, email, password, token, activated, token_sent_at, {PENDING_CREATED_AT}
+    from api_apiuser_unpartitioned;
+    insert into api_apiuser_email (email, id, created_at, activated)
+    select lower(email), id, created_at, activated from api_apiuser where email is not null;
+    create trigger api_apiuser_email_sync after insert or update or delete on api_apiuser
+    for each row execute function api_apiuser_email_sync();
+"""
+
+REVERT_SQL = """
+    lock table api_apiuser in access exclusive mode;
+    create table api_apiuser_unpartitioned (like api_apiuser including defaults);
+    insert into api_apiuser_unpartitioned select * from api_apiuser;
+    alter sequence api_apiuser_id_seq owned by api_apiuser_unpartitioned.id;
+    drop table api_apiuser, api_apiuser_email;
+    drop function api_apiuser_email_sync();
+    alter table api_apiuser_unpartitioned rename to api_apiuser;
+    alter table api_apiuser add constraint api_apiuser_pkey primary key (id);
+    create unique index api_apiuser_email_lower_uniq on api_apiuser (lower(email));
+    create index api_apiuser_unactivated_idx on api_apiuser (token_sent_at) where not activated;
+"""
+
+
+def is_partitioned(cur):
+    cur.execute("select relkind = 'p' from pg_class where oid = 'api_apiuser'::regclass")
+    return cur.fetchone()[0]
+
+
+def convert(granularity=None, ahead=None, keep=False):
+    """Convert api_apiuser to the partitioned layout, in a transaction
+    locking it until the users are copied. The former table is kept as
+    api_apiuser_unpartitioned with `keep`. Returns the partitions created"""
+    granularity = _check_granularity(granularity or settings.API_USER_PARTITIONS)
+    ahead = settings.API_USER_PARTITIONS_AHEAD if ahead is None else ahead
+    with get_pool().connection() as conn:
+        conn.autocommit = False
+        with conn.cursor() as cur:
+            if is_partitioned(cur):
+                raise ValueError('The api_apiuser table is already partitioned.')
+            cur.execute(CONVERT_SQL)
+            cur.execute(f"select distinct {utc_day(PENDING_CREATED_AT)} from api_apiuser_unpartitioned")
+            starts = [period_start(day, granularity) for day, in cur.fetchall()]
+            starts.append(period_start(datetime.utcnow(), granularity))
+            for _ in range(ahead):
+                starts.append(next_period(max(starts), granularity))
+            created = _create_partitions(cur, starts, granularity)
+            cur.execute(SYNC_FUNCTION_SQL)
+            cur.execute(CONVERT_DATA_SQL)
+            if not keep:
+                cur.execute("drop table api_apiuser_unpartitioned")
+        conn.commit()
+    return created
+
+
+def revert():
+    """Convert api_apiuser back to a single table"""
+    with get_pool().connection() as conn:
+        conn.autocommit = False
+        with conn.cursor() as cur:
+            if not is_partitioned(cur):
+                raise ValueError('The api_apiuser table is not partitioned.')
+            cur.execute(REVERT_SQL)
+        conn.commit()
+
+
+# Variants of the statements of src.api.queries for the partitioned layout,
+# see STATEMENTS. The user of an email is found through api_apiuser_email,
+# with the keys of its partition.
+
+LOCK_EMAIL = Statement(
+    'lock_api_user_email',
+    [('email', 'varchar')],
+    f"select pg_advisory_xact_lock({EMAIL_LOCK_NAMESPACE}, hashtext(lower($1)) & {EMAIL_LOCK_STRIPES - 1})"
+)
+
+# in the order of the keys, so two bulk sign-ups don't deadlock
+LOCK_EMAILS = Statement(
+    'lock_api_user_emails',
+    [('emails', 'varchar[]')],
+    f"""
+    select pg_advisory_xact_lock({EMAIL_LOCK_NAMESPACE}, key) from (
+        select distinct hashtext(lower(email)) & {EMAIL_LOCK_STRIPES - 1} as key
+        from unnest($1) email
+        order by key
+    ) keys
+    """
+)
+
+LOCK_ALL_EMAILS_SQL = f"""
+    select pg_advisory_xact_lock({EMAIL_LOCK_NAMESPACE}, key)
+    from generate_series(0, {EMAIL_LOCK_STRIPES - 1}) key
+"""
+
+_FIND_USER = """
+    select u.* from api_apiuser_email d
+    join api_apiuser u on u.id = d.id and u.created_at = d.created_at and u.activated = d.activated
+    where d.email = lower($1)
+"""
+
+GET_API_USER = Statement('get_api_user_partitioned', [('email', 'varchar')], _FIND_USER)
+
+SAVE_TOKEN = Statement(
+    'save_token_partitioned',
+    [('email', 'varchar'), ('token', 'varchar'), ('token_sent_at', 'timestamptz')],
+    """
+    update api_apiuser u
+    set token=$2, token_sent_at=$3, created_at=case when u.activated then u.created_at else $3 end
+    from api_apiuser_email d
+    where d.email = lower($1) and u.id = d.id and u.created_at = d.created_at and u.activated = d.activated
+    """
+)
+
+ACTIVATE_USER = Statement(
+    'activate_user_partitioned',
+    [('id', 'bigint'), ('created_at', 'timestamptz')],
+    "update api_apiuser set activated=true where id=$1 and created_at=$2 returning email"
+)
+
+DELETE_API_USER = Statement(
+    'delete_api_user_partitioned',
+    [('email', 'varchar')],
+    """
+    with deleted as (
+        delete from api_apiuser u using api_apiuser_email d
+        where d.email = lower($1) and u.id = d.id and u.created_at = d.created_at and u.activated = d.activated
+        returning u.email
+    )
+    delete from api_outboxemail
+    where status='pending' and recipient in (select email from deleted)
+    """
+)
+
+# runs after LOCK_EMAIL, in the same transaction: no other sign-up of the
+# email can run until it commits
+SIGNUP = Statement(
+    'signup_partitioned',
+    [('email', 'varchar'), ('password', 'varchar'), ('token', 'varchar'), ('now', 'timestamptz'),
+     ('subject', 'varchar'), ('body', 'text')],
+    f"""
+    with found as ({_FIND_USER}), inserted as (
+        insert into api_apiuser (email, password, token, activated, token_sent_at, created_at)
+        select $1, $2, $3, false, $4, $4 where not exists (select 1 from found)
+        returning id, email, true as created
+    ), updated as (
+        update api_apiuser u
+        set token=$3, token_sent_at=$4, created_at=case when u.activated then u.created_at else $4 end
+        from found f
+        where u.id = f.id and u.created_at = f.created_at and u.activated = f.activated
+        returning u.id, u.email, false as created
+    ), saved as (
+        select * from inserted union all select * from updated
+    ), queued as (
+        insert into api_outboxemail (recipient, subject, body, status, attempts, next_attempt_at, created_at)
+        select email, $5, $6, 'pending', 0, now(), now() from saved
+    )
+    select id, created from saved
+    """
+)
+
+# SIGNUP for many users, after LOCK_EMAILS: the users are passed as arrays
+BULK_SIGNUP = Statement(
+    'bulk_signup_partitioned',
+    [('emails', 'varchar[]'), ('passwords', 'varchar[]'), ('tokens', 'varchar[]'), ('now', 'timestamptz'),
+     ('subjects', 'varchar[]'), ('bodies', 'text[]')],
+    """
+    with batch as (
+        select * from unnest($1, $2, $3, $5, $6) as b (email, password, token, subject, body)
+    ), found as (
+        select b.email, u.id, u.created_at, u.activated from batch b
+        join api_apiuser_email d on d.email = lower(b.email)
+        join api_apiuser u on u.id = d.id and u.created_at = d.created_at and u.activated = d.activated
+    ), inserted as (
+        insert into api_apiuser (email, password, token, activated, token_sent_at, created_at)
+        select email, password, token, false, $4, $4 from batch b
+        where not exists (select 1 from found f where f.email = b.email)
+        returning email, true as created
+    ), updated as (
+        update api_apiuser u
+        set token=b.token, token_sent_at=$4, created_at=case when u.activated then u.created_at else $4 end
+        from found f join batch b on b.email = f.email
+        where u.id = f.id and u.created_at = f.created_at and u.activated = f.activated
+        returning u.email, false as created
+    ), saved as (
+        select * from inserted union all select * from updated
+    ), queued as (
+        insert into api_outboxemail (recipient, subject, body, status, attempts, next_attempt_at, created_at)
+        select saved.email, batch.subject, batch.body, 'pending', 0, now(), now()
+        from saved join batch on lower(batch.email) = lower(saved.email)
+    )
+    select email, created from saved
+    """
+)
+
+PURGE_UNACTIVATED_USERS = Statement(
+    'purge_unactivated_users_partitioned',
+    [('limit', 'int'), ('retention', 'float8')],
+    """
+    delete from api_apiuser
+    where not activated and (id, created_at) in (
+        select id, created_at from api_apiuser
+        where not activated and token_sent_at < now() - make_interval(secs => $2)
+        limit $1
+        for update skip locked
+    )
+    returning email
+    """
+)
+
+# the emails of the users whose partition was dropped, created before `before`
+PURGE_ORPHAN_EMAILS = Statement(
+    'purge_orphan_emails',
+    [('limit', 'int'), ('before', 'timestamptz')],
+    """
+    delete from api_apiuser_email
+    where email in (
+        select d.email from api_apiuser_email d
+        where not d.activated and d.created_at < $2 and not exists (
+            select 1 from api_apiuser u
+            where u.id = d.id and u.created_at = d.created_at and not u.activated
+        )
+        limit $1
+        for update skip locked
+    )
+    returning email
+    """
+)
+
+# created_at of the imported users, see PENDING_CREATED_AT
+IMPORT_CREATED_AT = """
+    case when coalesce(activated, false) then coalesce(created_at, now())
+    else greatest(coalesce(created_at, now()), coalesce(token_sent_at, created_at, now())) end
+"""
+
+# The variants of the import statements of src.api.queries, run after
+# LOCK_ALL_EMAILS_SQL
+_IMPORT_API_USERS = """
+    with batch as (
+        select distinct on (lower(email))
+            email, password, token, coalesce(activated, false) as activated, token_sent_at,
+            """ + IMPORT_CREATED_AT + """ as created_at
+        from api_apiuser_import
+        order by lower(email), line
+    ), found as (
+        select b.email, u.id, u.created_at, u.activated from batch b
+        join api_apiuser_email d on d.email = lower(b.email)
+        join api_apiuser u on u.id = d.id and u.created_at = d.created_at and u.activated = d.activated
+    ), inserted as (
+        insert into api_apiuser (email, password, token, activated, token_sent_at, created_at)
+        select email, password, token, activated, token_sent_at, created_at from batch b
+        where not exists (select 1 from found f where f.email = b.email)
+        returning id
+    ), replaced as (
+        {}
+    )
+    select (select count(*) from batch), (select count(*) from inserted), (select count(*) from replaced)
+"""
+
+IMPORT_API_USERS = _IMPORT_API_USERS.format('select 1 where false')
+
+IMPORT_API_USERS_REPLACE = _IMPORT_API_USERS.format("""
+        update api_apiuser u
+        set password=b.password, token=b.token, activated=b.activated, token_sent_at=b.token_sent_at,
+            created_at=b.created_at
+        from found f join batch b on b.email = f.email
+        where u.id = f.id and u.created_at = f.created_at and u.activated = f.activated
+        returning u.id
+""")
+
+
+# the variants of the statements of src.api.queries
+STATEMENTS = {
+    queries.GET_API_USER: (GET_API_USER,),
+    queries.SAVE_TOKEN: (SAVE_TOKEN,),
+    queries.ACTIVATE_USER: (ACTIVATE_USER,),
+    queries.DELETE_API_USER: (DELETE_API_USER,),
+    queries.SIGNUP: (LOCK_EMAIL, SIGNUP),
+    queries.PURGE_UNACTIVATED_USERS: (PURGE_UNACTIVATED_USERS,),
+}
+
+
+def statements(statement):
+    """The statements to execute instead of `statement` of src.api.queries,
+    in the same round trip, for the layout set by API_USER_PARTITIONS"""
+    if not settings.API_USER_PARTITIONS:
+        return (statement,)
+    return STATEMENTS.get(statement, (statement,))
@@ -0,0 +1,490 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from django.conf import settings
+
+from src.api.metrics import span
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(PoolError):
+    """No connection became available before the checkout timeout"""
+
+
+class PooledConnection(extensions.connection):
+    """psycopg2 connection keeping track of the statements prepared on it"""
+
+    def __init__(self, *args, **kwargs):
+        super(PooledConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class ConnectionPool(object):
+    """Thread safe pool of persistent psycopg2 connections.
+
+    Connections run in autocommit mode, so every statement is its own
+    transaction and no connection goes back to the pool idle in transaction.
+    `min_size` connections are opened upfront and kept open, more are opened
+    on demand up to `max_size`. Idle connections are checked with a
+    `select 1` before reuse when they were not used for `check_interval`
+    seconds, and the ones above `min_size` are closed once they were idle
+    for longer than `max_idle` seconds.
+    """
+
+    def __init__(self, min_size=1, max_size=10, timeout=5.0, max_idle=300.0,
+                 check_interval=30.0, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('Invalid pool size: min=%s max=%s' % (min_size, max_size))
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.connect_kwargs = dict(connect_kwargs)
+        self.connect_kwargs.setdefault('connection_factory', PooledConnection)
+        self.pid = os.getpid()
+
+        # idle connections as (connection, last_used), the most recently
+        # used one at the end, so the oldest are the first to be reaped
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = dict.fromkeys(
+            ('connects', 'checkouts', 'waits', 'timeouts', 'discarded',
+             'reaped', 'failed_checks'), 0)
+
+        for _ in range(min_size):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        try:
+            with span('db_connect'):
+                conn = psycopg2.connect(**self.connect_kwargs)
+            conn.autocommit = True
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['connects'] += 1
+        return conn
+
+    def _close(self, conn, reason):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats[reason] += 1
+            self._cond.notify()
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('select 1')
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._stats['failed_checks'] += 1
+            return False
+
+    def _pop_expired(self):
+        """Remove from the idle list the connections idle for too long.
+        Must be called with the lock held, returns the removed connections
+        """
+        expired = []
+        deadline = time.monotonic() - self.max_idle
+        while (self._idle and self._idle[0][1] < deadline and
+               self._size - len(expired) > self.min_size):
+            expired.append(self._idle.pop(0)[0])
+        return expired
+
+    def reap(self):
+        """Close the connections above `min_size` idle for longer than
+        `max_idle` seconds. Runs on every checkin, but can be called explicitly
+        """
+        with self._cond:
+            expired = self._pop_expired()
+        for conn in expired:
+            self._close(conn, 'reaped')
+        return len(expired)
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolError('The connection pool is closed')
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            'No connection available after %ss' % self.timeout)
+                    if not waited:
+                        self._stats['waits'] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+
+                self._stats['checkouts'] += 1
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    conn, last_used = None, None
+                    self._size += 1
+
+            if conn is None:
+                return self._connect()
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._close(conn, 'discarded')
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if not conn.autocommit:
+                    conn.autocommit = True
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed or self._closed:
+            self._close(conn, 'discarded')
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            expired = self._pop_expired()
+            self._cond.notify()
+        for expired_conn in expired:
+            self._close(expired_conn, 'reaped')
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the `with` block"""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                min_size=self.min_size,
+                max_size=self.max_size,
+            )
+        return stats
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn, 'discarded')
+
+
+async def wait(conn):
+    """Wait until the asynchronous connection `conn` is done connecting or
+    executing, see "Asynchronous support" in the psycopg2 documentation"""
+    loop = asyncio.get_event_loop()
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        if state == extensions.POLL_READ:
+            add, remove = loop.add_reader, loop.remove_reader
+        elif state == extensions.POLL_WRITE:
+            add, remove = loop.add_writer, loop.remove_writer
+        else:
+            raise psycopg2.OperationalError('Unexpected poll state: %s' % state)
+
+        ready = loop.create_future()
+        fd = conn.fileno()
+        add(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove(fd)
+
+
+class AsyncConnectionPool(object):
+    """asyncio flavour of ConnectionPool, with psycopg2 asynchronous
+    connections, which are always in autocommit mode.
+
+    A pool must only be used from the event loop it was created in. The
+    connections are opened on demand, and `min_size` of them are kept open.
+    """
+
+    def __init__(self, min_size=1, max_size=10, timeout=5.0, max_idle=300.0,
+                 check_interval=30.0, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('Invalid pool size: min=%s max=%s' % (min_size, max_size))
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.connect_kwargs = dict(connect_kwargs, async_=True)
+        self.connect_kwargs.setdefault('connection_factory', PooledConnection)
+
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._slots = asyncio.Semaphore(max_size)
+        self._stats = dict.fromkeys(
+            ('connects', 'checkouts', 'waits', 'timeouts', 'discarded',
+             'reaped', 'failed_checks'), 0)
+
+    async def _connect(self):
+        with span('db_connect'):
+            conn = psycopg2.connect(**self.connect_kwargs)
+            try:
+                await wait(conn)
+            except BaseException:
+                conn.close()
+                raise
+        self._size += 1
+        self._stats['connects'] += 1
+        return conn
+
+    def _close(self, conn, reason):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._size -= 1
+        self._stats[reason] += 1
+
+    async def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_interval:
+            return True
+        try:
+            conn.cursor().execute('select 1')
+            await wait(conn)
+            return True
+        except psycopg2.Error:
+            self._stats['failed_checks'] += 1
+            return False
+
+    def reap(self):
+        deadline = time.monotonic() - self.max_idle
+        reaped = 0
+        while self._idle and self._idle[0][1] < deadline and self._size > self.min_size:
+            self._close(self._idle.pop(0)[0], 'reaped')
+            reaped += 1
+        return reaped
+
+    async def getconn(self):
+        if self._closed:
+            raise PoolError('The connection pool is closed')
+        if not self._slots.locked():
+            # doesn't yield to the event loop
+            await self._slots.acquire()
+        else:
+            self._stats['waits'] += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self._stats['timeouts'] += 1
+                raise PoolTimeout('No connection available after %ss' % self.timeout)
+
+        try:
+            self._stats['checkouts'] += 1
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if await self._is_healthy(conn, last_used):
+                    return conn
+                self._close(conn, 'discarded')
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard=False):
+        # a connection still executing was interrupted, by a cancellation or
+        # a timeout: its state is unknown
+        if discard or conn.closed or conn.isexecuting() or self._closed:
+            self._close(conn, 'discarded')
+        else:
+            self._idle.append((conn, time.monotonic()))
+            self.reap()
+        self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        """Check out a connection for the duration of the `async with` block"""
+        conn = await self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update(
+            size=self._size,
+            idle=len(self._idle),
+            in_use=self._size - len(self._idle),
+            min_size=self.min_size,
+            max_size=self.max_size,
+        )
+        return stats
+
+    def close(self):
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn, 'discarded')
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process wide pool for the DB_DEFAULT_* database.
+
+    The pool is created on first use, and created again in a forked child,
+    since connections can't be shared between processes.
+    """
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool(
+                    min_size=settings.DB_POOL_MIN_SIZE,
+                    max_size=settings.DB_POOL_MAX_SIZE,
+                    timeout=settings.DB_POOL_TIMEOUT,
+                    max_idle=settings.DB_POOL_MAX_IDLE,
+                    check_interval=settings.DB_POOL_CHECK_INTERVAL,
+                    host=settings.DB_DEFAULT_HOST,
+                    database=settings.DB_DEFAULT_NAME,
+                    user=settings.DB_DEFAULT_USER,
+                    password=settings.DB_DEFAULT_PASSWORD
+                )
+                logger.debug('Connection pool created for pid %s', _pool.pid)
+            pool = _pool
+    return pool
+
+
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_pool():
+    """Return the pool for the DB_DEFAULT_* database of the running event loop"""
+    loop = asyncio.get_event_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        pool = _async_pools[loop] = AsyncConnectionPool(
+            min_size=settings.DB_POOL_MIN_SIZE,
+            max_size=settings.DB_POOL_MAX_SIZE,
+            timeout=settings.DB_POOL_TIMEOUT,
+            max_idle=settings.DB_POOL_MAX_IDLE,
+            check_interval=settings.DB_POOL_CHECK_INTERVAL,
+            host=settings.DB_DEFAULT_HOST,
+            database=settings.DB_DEFAULT_NAME,
+            user=settings.DB_DEFAULT_USER,
+            password=settings.DB_DEFAULT_PASSWORD
+        )
+    return pool
+
+
+def _replica_connect_kwargs():
+    return dict(host=settings.DB_REPLICA_HOST, database=settings.DB_REPLICA_NAME,
+                user=settings.DB_REPLICA_USER, password=settings.DB_REPLICA_PASSWORD)
+
+
+def _same_target(pool, connect_kwargs):
+    return all(pool.connect_kwargs.get(key) == value for key, value in connect_kwargs.items())
+
+
+_replica_pool = None
+
+
+def get_replica_pool():
+    """Return the process wide pool for the DB_REPLICA_* read replica, None
+    when DB_REPLICA_HOST isn't set.
+
+    Its connections are opened on demand, so a replica which is down fails
+    the reads sent to it rather than the creation of the pool.
+    """
+    global _replica_pool
+    if not settings.DB_REPLICA_HOST:
+        return None
+    connect_kwargs = _replica_connect_kwargs()
+    pool = _replica_pool
+    if pool is None or pool.pid != os.getpid() or not _same_target(pool, connect_kwargs):
+        with _pool_lock:
+            if _replica_pool is None or _replica_pool.pid != os.getpid():
+                _replica_pool = None
+            elif not _same_target(_replica_pool, connect_kwargs):
+                _replica_pool.close()
+                _replica_pool = None
+            if _replica_pool is None:
+                _replica_pool = ConnectionPool(
+                    min_size=0,
+                    max_size=settings.DB_POOL_MAX_SIZE,
+                    timeout=settings.DB_POOL_TIMEOUT,
+                    max_idle=settings.DB_POOL_MAX_IDLE,
+                    check_interval=settings.DB_POOL_CHECK_INTERVAL,
+                    **connect_kwargs
+                )
+                logger.debug('Replica connection pool created for pid %s', _replica_pool.pid)
+            pool = _replica_pool
+    return pool
+
+
+_async_replica_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_replica_pool():
+    """Return the pool for the DB_REPLICA_* read replica of the running event
+    loop, None when DB_REPLICA_HOST isn't set"""
+    if not settings.DB_REPLICA_HOST:
+        return None
+    connect_kwargs = _replica_connect_kwargs()
+    loop = asyncio.get_event_loop()
+    pool = _async_replica_pools.get(loop)
+    if pool is None or not _same_target(pool, connect_kwargs):
+        if pool is not None:
+            pool.close()
+        pool = _async_replica_pools[loop] = AsyncConnectionPool(
+            min_size=0,
+            max_size=settings.DB_POOL_MAX_SIZE,
+            timeout=settings.DB_POOL_TIMEOUT,
+            max_idle=settings.DB_POOL_MAX_IDLE,
+            check_interval=settings.DB_POOL_CHECK_INTERVAL,
+            **connect_kwargs
+        )
+    return pool
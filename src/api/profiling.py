@@ -0,0 +1,289 @@
+"""Sampling profiler of the API requests.
+
+With API_PROFILE_SAMPLE_RATE > 0, that fraction of the requests of the
+user_api views is profiled: a thread of the process records the stack of the
+thread serving each profiled request every API_PROFILE_INTERVAL seconds,
+counted by view. The requests of the async views share the thread of the
+event loop, a stack is counted for a request only while its frame is on it.
+
+The stacks are written in the collapsed format of flamegraph.pl and
+speedscope, a `frame;frame;frame count` line per stack, to
+API_PROFILE_DIR/<view>.<pid>.collapsed every API_PROFILE_FLUSH_INTERVAL
+seconds, and on demand by the staff only `profiles` view. The
+`dump_profiles` command merges the files of all the processes into a
+<view>.collapsed file per view.
+
+With a sample rate of 0 a request only pays a settings lookup.
+"""
+import contextvars
+import glob
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse
+
+
+logger = logging.getLogger(__name__)
+
+MAX_DEPTH = 128
+COLLAPSED_RE = re.compile(r'^(?P<view>.+)\.(?P<pid>\d+)\.collapsed$')
+
+# the key in Sampler._profiled of the request profiled in the context
+_profile_key = contextvars.ContextVar('profile_key', default=None)
+
+
+def frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def running_view(frame, views):
+    """The view of the innermost frame of `views`, {frame: view}, on the
+    stack of `frame`, None if there is none"""
+    while frame is not None:
+        view = views.get(frame)
+        if view is not None:
+            return view
+        frame = frame.f_back
+    return None
+
+
+def collapse(frame, names):
+    """The stack of `frame` in the collapsed format, outermost frame first;
+    `names` caches the names of the code objects"""
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        code = frame.f_code
+        name = names.get(code)
+        if name is None:
+            name = names[code] = frame_name(code)
+        stack.append(name)
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class Sampler(threading.Thread):
+    """Thread sampling the stacks of the threads of the profiled requests
+    every `interval` seconds, idle while there are none"""
+
+    def __init__(self, interval=None, directory=None, flush_interval=None, **kwargs):
+        kwargs.setdefault('daemon', True)
+        kwargs.setdefault('name', 'profile-sampler')
+        super(Sampler, self).__init__(**kwargs)
+        self.interval = interval or settings.API_PROFILE_INTERVAL
+        self.directory = directory or settings.API_PROFILE_DIR
+        self.flush_interval = flush_interval or settings.API_PROFILE_FLUSH_INTERVAL
+        self.pid = os.getpid()
+        self.stopped = threading.Event()
+        self._profiled = {}
+        self._stacks = defaultdict(Counter)
+        self._names = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._dirty = False
+
+    def start_profile(self, view, frame=None):
+        """Profile the request of the current context, for `view`, until
+        end_profile: the stacks of its thread with `frame`, the one of the
+        caller by default, on them. Returns the token of end_profile"""
+        key = object()
+        with self._lock:
+            self._profiled[key] = (threading.get_ident(), frame or sys._getframe(1), view)
+            self._wakeup.notify()
+        return _profile_key.set(key)
+
+    def end_profile(self, token):
+        key = _profile_key.get()
+        _profile_key.reset(token)
+        with self._lock:
+            self._profiled.pop(key, None)
+
+    def sample(self):
+        """Count the current stacks of the profiled requests"""
+        with self._lock:
+            profiled = list(self._profiled.values())
+        if not profiled:
+            return
+        views = defaultdict(dict)
+        for thread_id, frame, view in profiled:
+            views[thread_id][frame] = view
+        frames = sys._current_frames()
+        stacks = []
+        for thread_id, thread_views in views.items():
+            frame = frames.get(thread_id)
+            view = running_view(frame, thread_views)
+            if view is not None:
+                stacks.append((view, collapse(frame, self._names)))
+        with self._lock:
+            for view, stack in stacks:
+                self._stacks[view][stack] += 1
+            self._dirty = bool(stacks) or self._dirty
+
+    def stacks(self):
+        """{view: Counter of the collapsed stacks} sampled so far"""
+        with self._lock:
+            return {view: Counter(stacks) for view, stacks in self._stacks.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._dirty = True
+
+    def flush(self):
+        """Write the stacks of each view to `directory`, returns the paths"""
+        with self._lock:
+            self._dirty = False
+        stacks = self.stacks()
+        if not stacks:
+            return []
+        os.makedirs(self.directory, exist_ok=True)
+        paths = []
+        for view, counts in stacks.items():
+            path = os.path.join(self.directory, f'{view}.{self.pid}.collapsed')
+            with open(path + '.tmp', 'w') as file:
+                file.writelines(f'{stack} {count}\n' for stack, count in counts.most_common())
+            os.replace(path + '.tmp', path)
+            paths.append(path)
+        return paths
+
+    def run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self.stopped.is_set():
+            with self._lock:
+                if not self._profiled:
+                    self._wakeup.wait(self.flush_interval)
+            self.sample()
+            if time.monotonic() >= next_flush:
+                if self._dirty:
+                    try:
+                        self.flush()
+                    except OSError as ex:
+                        logger.error('Failed to write the profiles to %s: %s', self.directory, ex)
+                next_flush = time.monotonic() + self.flush_interval
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        with self._lock:
+            self._wakeup.notify()
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """Return the Sampler of the process, started on first use"""
+    global _sampler
+    sampler = _sampler
+    if sampler is None or sampler.pid != os.getpid():
+        with _sampler_lock:
+            if _sampler is None or _sampler.pid != os.getpid():
+                _sampler = Sampler()
+                _sampler.start()
+            sampler = _sampler
+    return sampler
+
+
+def view_name(request, view):
+    match = getattr(request, 'resolver_match', None)
+    if match is not None and match.url_name:
+        return match.url_name
+    return getattr(view, '__qualname__', None) or getattr(view, '__name__', 'view')
+
+
+class _Profile(object):
+    __slots__ = ('view', 'sampler', 'token')
+
+    def __init__(self, view):
+        self.view = view
+
+    def __enter__(self):
+        self.sampler = get_sampler()
+        # the frame of the `with` block, on the stack while the request runs
+        self.token = self.sampler.start_profile(self.view, sys._getframe(1))
+        return self
+
+    def __exit__(self, *exc):
+        self.sampler.end_profile(self.token)
+        return False
+
+
+class _NoProfile(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_profile = _NoProfile()
+
+
+def profile(request, view):
+    """Context manager profiling API_PROFILE_SAMPLE_RATE of the calls of
+    the view"""
+    rate = settings.API_PROFILE_SAMPLE_RATE
+    if not rate or random.random() >= rate:
+        return _no_profile
+    return _Profile(view_name(request, view))
+
+
+def load(directory):
+    """{view: Counter of the collapsed stacks} of the <view>.<pid>.collapsed
+    files of `directory`, summed over the processes"""
+    merged = defaultdict(Counter)
+    for path in glob.glob(os.path.join(directory, '*.collapsed')):
+        match = COLLAPSED_RE.match(os.path.basename(path))
+        if match is None:
+            continue
+        with open(path) as file:
+            for line in file:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    merged[match.group('view')][stack] += int(count)
+    return dict(merged)
+
+
+def merge(directory, output=None):
+    """Merge the <view>.<pid>.collapsed files of `directory` into a
+    <view>.collapsed file per view in `output`, returns {view: Counter}"""
+    merged = load(directory)
+    output = output or directory
+    os.makedirs(output, exist_ok=True)
+    for view, counts in merged.items():
+        with open(os.path.join(output, f'{view}.collapsed'), 'w') as file:
+            file.writelines(f'{stack} {count}\n' for stack, count in counts.most_common())
+    return merged
+
+
+def leaves(counts, limit=10):
+    """The `limit` innermost frames sampled the most, as (frame, count)"""
+    totals = Counter()
+    for stack, count in counts.items():
+        totals[stack.rpartition(';')[2]] += count
+    return totals.most_common(limit)
+
+
+def profiles_view(request):
+    """The stacks sampled by all the processes, in the collapsed format; of
+    the `view` parameter only, or of all the views under their names.
+    Served to the staff only, by src/urls.py"""
+    if _sampler is not None and _sampler.pid == os.getpid():
+        _sampler.flush()
+    profiles = load(settings.API_PROFILE_DIR)
+    view = request.GET.get('view')
+    if view:
+        lines = [f'{stack} {count}\n' for stack, count in profiles.get(view, Counter()).most_common()]
+    else:
+        lines = [f'{name};{stack} {count}\n' for name, counts in sorted(profiles.items())
+                 for stack, count in counts.most_common()]
+    return HttpResponse(''.join(lines), content_type='text/plain; charset=utf-8')
@@ -0,0 +1,318 @@
+"""Named, parameterized statements used by the raw SQL helpers.
+
+Every statement is prepared server side (PREPARE) the first time it runs on a
+pooled connection and executed by name afterwards, so postgres parses and
+plans it once per connection instead of once per query. The values are always
+sent as parameters, never formatted into the SQL.
+"""
+import psycopg2
+
+from src.api.pool import wait
+
+
+class Statement(object):
+    """A statement prepared as `name`.
+
+    :param name:    The name of the prepared statement
+    :param params:  Sequence of (parameter name, postgres type); the n-th one
+                    is referenced as $n in `sql`
+    :param sql:     The statement
+    """
+
+    def __init__(self, name, params, sql):
+        self.name = name
+        self.params = tuple(params)
+        self.sql = ' '.join(sql.split())
+
+        types = ', '.join(param_type for _, param_type in self.params)
+        self.prepare_sql = f"prepare {name} ({types}) as {self.sql}" if types \
+            else f"prepare {name} as {self.sql}"
+        args = ', '.join(f'%({param})s' for param, _ in self.params)
+        self.execute_sql = f"execute {name} ({args})" if args else f"execute {name}"
+
+    def __repr__(self):
+        return f'<Statement {self.name}>'
+
+
+# the emails are compared case insensitive, with the unique index on
+# lower(email) created by the 0002 migration
+GET_API_USER = Statement(
+    'get_api_user',
+    [('email', 'varchar')],
+    "select * from api_apiuser where lower(email)=lower($1)"
+)
+
+INSERT_API_USER = Statement(
+    'insert_api_user',
+    [('email', 'varchar'), ('password', 'varchar'), ('now', 'timestamptz')],
+    "insert into api_apiuser (email, password, token, activated, token_sent_at, created_at) "
+    "values ($1, $2, null, false, $3, $3)"
+)
+
+SAVE_TOKEN = Statement(
+    'save_token',
+    [('email', 'varchar'), ('token', 'varchar'), ('token_sent_at', 'timestamptz')],
+    "update api_apiuser set token=$2, token_sent_at=$3 where lower(email)=lower($1)"
+)
+
+ACTIVATE_USER = Statement(
+    'activate_user',
+    [('id', 'bigint')],
+    "update api_apiuser set activated=true where id=$1 returning email"
+)
+
+# the pending emails of the user are deleted along with it
+DELETE_API_USER = Statement(
+    'delete_api_user',
+    [('email', 'varchar')],
+    """
+    with deleted as (
+        delete from api_apiuser where lower(email)=lower($1)
+        returning email
+    )
+    delete from api_outboxemail
+    where status='pending' and recipient in (select email from deleted)
+    """
+)
+
+# `xmax = 0` only for the rows inserted by the statement, not for the
+# updated ones. Concurrent sign-ups of the same email wait on the unique
+# index, and the second one updates the row inserted by the first one.
+# The activation email is queued in the outbox by the same statement.
+SIGNUP = Statement(
+    'signup',
+    [('email', 'varchar'), ('password', 'varchar'), ('token', 'varchar'), ('now', 'timestamptz'),
+     ('subject', 'varchar'), ('body', 'text')],
+    """
+    with saved as (
+        insert into api_apiuser (email, password, token, activated, token_sent_at, created_at)
+        values ($1, $2, $3, false, $4, $4)
+        on conflict (lower(email)) do update
+        set token=excluded.token, token_sent_at=excluded.token_sent_at
+        returning id, email, (xmax = 0) as created
+    ), queued as (
+        insert into api_outboxemail (recipient, subject, body, status, attempts, next_attempt_at, created_at)
+        select email, $5, $6, 'pending', 0, now(), now() from saved
+    )
+    select id, created from saved
+    """
+)
+
+# SIGNUP for many users, run with psycopg2.extras.execute_values: the %s
+# is replaced by the (email, password, token, now, subject, body) rows. The
+# emails must be distinct, case insensitive, since a statement can't update
+# a row twice.
+BULK_SIGNUP_SQL = """
+    with batch (email, password, token, now, subject, body) as (
+        values %s
+    ), saved as (
+        insert into api_apiuser (email, password, token, activated, token_sent_at, created_at)
+        select email, password, token, false, now::timestamptz, now::timestamptz from batch
+        on conflict (lower(email)) do update
+        set token=excluded.token, token_sent_at=excluded.token_sent_at
+        returning id, email, (xmax = 0) as created
+    ), queued as (
+        insert into api_outboxemail (recipient, subject, body, status, attempts, next_attempt_at, created_at)
+        select saved.email, batch.subject, batch.body, 'pending', 0, now(), now()
+        from saved join batch on lower(batch.email) = lower(saved.email)
+    )
+    select email, created from saved
+"""
+
+
+# The users never activated whose last token expired, `limit` at a time,
+# skipping the ones locked by a concurrent sign-up instead of waiting
+PURGE_UNACTIVATED_USERS = Statement(
+    'purge_unactivated_users',
+    [('limit', 'int'), ('retention', 'float8')],
+    """
+    delete from api_apiuser
+    where id in (
+        select id from api_apiuser
+        where not activated and token_sent_at < now() - make_interval(secs => $2)
+        limit $1
+        for update skip locked
+    )
+    returning email
+    """
+)
+
+
+# COPY statements of the export_users and import_users commands, see
+# copy_api_users_to and copy_api_users_from in src/api/utils.py
+API_USER_COLUMNS = ('email', 'password', 'token', 'activated', 'token_sent_at', 'created_at')
+
+EXPORT_API_USERS_CSV = f"""
+    copy (select {', '.join(API_USER_COLUMNS)} from api_apiuser order by id)
+    to stdout with (format csv, header)
+"""
+
+# One row_to_json per line, written as is: the csv format only quotes the
+# values containing its quote or delimiter characters, here control
+# characters which are always escaped in JSON, while the text format would
+# double the backslashes of the JSON escapes.
+EXPORT_API_USERS_NDJSON = f"""
+    copy (
+        select row_to_json(u) from (
+            select {', '.join(API_USER_COLUMNS)} from api_apiuser order by id
+        ) u
+    )
+    to stdout with (format csv, quote e'\\x01', delimiter e'\\x02')
+"""
+
+# the imported users are copied to this table first, `line` keeping their
+# order in the file
+CREATE_IMPORT_TABLE = """
+    drop table if exists api_apiuser_import;
+    create temporary table api_apiuser_import (
+        line bigserial,
+        email varchar(50),
+        password varchar(1024),
+        token varchar(4),
+        activated boolean,
+        token_sent_at timestamptz,
+        created_at timestamptz
+    )
+"""
+
+COPY_IMPORT = f"""
+    copy api_apiuser_import ({', '.join(API_USER_COLUMNS)}) from stdin with (format csv)
+"""
+
+DROP_IMPORT_TABLE = "drop table if exists api_apiuser_import"
+
+# The first user of each email in the file, case insensitive, is saved. The
+# existing users are left unchanged, or replaced with IMPORT_API_USERS_REPLACE.
+_IMPORT_API_USERS = """
+    with merged as (
+        insert into api_apiuser (email, password, token, activated, token_sent_at, created_at)
+        select distinct on (lower(email))
+            email, password, token, coalesce(activated, false), token_sent_at, coalesce(created_at, now())
+        from api_apiuser_import
+        order by lower(email), line
+        on conflict (lower(email)) {}
+        returning (xmax = 0) as created
+    )
+    select
+        (select count(distinct lower(email)) from api_apiuser_import),
+        count(*) filter (where created),
+        count(*) filter (where not created)
+    from merged
+"""
+
+IMPORT_API_USERS = _IMPORT_API_USERS.format('do nothing')
+
+IMPORT_API_USERS_REPLACE = _IMPORT_API_USERS.format("""
+    do update set password=excluded.password, token=excluded.token, activated=excluded.activated,
+    token_sent_at=excluded.token_sent_at, created_at=excluded.created_at
+""")
+
+
+# The outbox emails are claimed by pushing their next attempt `lease`
+# seconds ahead: if the worker dies before marking them as sent or failed
+# they are claimed again after that.
+CLAIM_OUTBOX_EMAILS = Statement(
+    'claim_outbox_emails',
+    [('limit', 'int'), ('lease', 'float8')],
+    """
+    update api_outboxemail
+    set attempts=attempts + 1, next_attempt_at=now() + make_interval(secs => $2)
+    where id in (
+        select id from api_outboxemail
+        where status='pending' and next_attempt_at <= now()
+        order by next_attempt_at
+        limit $1
+        for update skip locked
+    )
+    returning id, recipient, subject, body, attempts
+    """
+)
+
+MARK_OUTBOX_EMAILS_SENT = Statement(
+    'mark_outbox_emails_sent',
+    [('ids', 'bigint[]')],
+    "update api_outboxemail set status='sent', sent_at=now(), last_error=null where id=any($1)"
+)
+
+MARK_OUTBOX_EMAIL_FAILED = Statement(
+    'mark_outbox_email_failed',
+    [('id', 'bigint'), ('error', 'text'), ('retry_in', 'float8'), ('dead', 'boolean')],
+    """
+    update api_outboxemail
+    set last_error=$2,
+        next_attempt_at=now() + make_interval(secs => $3),
+        status=case when $4 then 'dead' else status end
+    where id=$1
+    """
+)
+
+# the activation tokens are only valid for a short while, there's no point
+# in sending them late
+EXPIRE_OUTBOX_EMAILS = Statement(
+    'expire_outbox_emails',
+    [('max_age', 'float8')],
+    """
+    update api_outboxemail set status='dead', last_error='Expired before it could be sent.'
+    where status='pending' and created_at < now() - make_interval(secs => $1)
+    """
+)
+
+
+def _round_trip(conn, statements):
+    """The SQL executing the statements on the connection, preparing the ones
+    not yet prepared on it, and the list of the latter"""
+    to_prepare = [stmt for stmt in statements if stmt.name not in conn.prepared]
+    query = '; '.join([stmt.prepare_sql for stmt in to_prepare] +
+                      [stmt.execute_sql for stmt in statements])
+    return query, to_prepare
+
+
+def _forget_prepared(conn):
+    # prepared statements outlive a failed transaction, so whether the
+    # PREPAREs ran is unknown: start over on this connection
+    conn.prepared.clear()
+    if not conn.closed and not conn.async_:
+        try:
+            conn.cursor().execute('deallocate all')
+        except psycopg2.Error:
+            pass
+
+
+def execute(conn, statements, params):
+    """Execute the statements on a pooled connection, in a single round trip.
+
+    The statements not yet prepared on the connection are prepared in the
+    same round trip. Returns the cursor, positioned on the result of the
+    last statement.
+    """
+    query, to_prepare = _round_trip(conn, statements)
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+    except psycopg2.Error:
+        if to_prepare:
+            _forget_prepared(conn)
+        raise
+    conn.prepared.update(stmt.name for stmt in to_prepare)
+    return cur
+
+
+async def aexecute(conn, statements, params):
+    """`execute` for the asynchronous connections of AsyncConnectionPool"""
+    query, to_prepare = _round_trip(conn, statements)
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        await wait(conn)
+    except psycopg2.Error:
+        if to_prepare:
+            if not conn.closed:
+                try:
+                    conn.cursor().execute('deallocate all')
+                    await wait(conn)
+                except psycopg2.Error:
+                    pass
+            _forget_prepared(conn)
+        raise
+    conn.prepared.update(stmt.name for stmt in to_prepare)
+    return cur
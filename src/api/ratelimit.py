@@ -0,0 +1,93 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Thread safe token bucket: holds at most `capacity` tokens, refilled at
+    `rate` tokens per second.
+
+    :param rate:        Tokens added per second
+    :param capacity:    Tokens the bucket holds, the size of the allowed bursts
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def consume(self, tokens=1):
+        """Take `tokens` from the bucket, returns False if there are not enough"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def delay(self, tokens=1):
+        """Seconds until the bucket holds `tokens`, 0 if it does"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+
+def window_delay(limit, window, previous, current, elapsed):
+    """Seconds until less than `limit` events are counted in a sliding window
+    of `window` seconds, from the counts of the `previous` and the `current`
+    fixed windows, `elapsed` being the fraction of the current one elapsed"""
+    if previous * (1 - elapsed) + current < limit:
+        return 0.0
+    if current >= limit:
+        # the current window is weighted as the previous one once it ends
+        delay = (1 - elapsed + 1 - limit / current) * window
+    else:
+        delay = (1 - (limit - current) / previous - elapsed) * window
+    # `limit` events are counted until right after it
+    return max(delay, 0.001)
+
+
+class SlidingWindow(object):
+    """Thread safe count of the events of the last `window` seconds.
+
+    The count is approximated from the counts of the current fixed window
+    and of the previous one, weighted by its part still in the sliding
+    window, so it takes two counters whatever the number of events.
+
+    :param limit:   Events allowed in a window
+    :param window:  Seconds of the window
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._index = 0
+        self._previous = 0
+        self._current = 0
+        self._lock = threading.Lock()
+
+    def _elapsed(self, now):
+        """Move to the fixed window of `now`, returns the fraction of it elapsed"""
+        index = int(now // self.window)
+        if index != self._index:
+            self._previous = self._current if index == self._index + 1 else 0
+            self._current = 0
+            self._index = index
+        return now / self.window - index
+
+    def hit(self):
+        """Count an event"""
+        with self._lock:
+            self._elapsed(time.monotonic())
+            self._current += 1
+
+    def delay(self):
+        """Seconds until the window counts less than `limit` events, 0 if it does"""
+        with self._lock:
+            elapsed = self._elapsed(time.monotonic())
+            return window_delay(self.limit, self.window, self._previous, self._current, elapsed)
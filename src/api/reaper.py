@@ -0,0 +1,136 @@
+"""Purge of the users never activated.
+
+An activation token is only valid for a minute, so the users still not
+activated USER_REAPER_RETENTION seconds after their last token was sent are
+deleted, by the `reap_users` management command or, with
+USER_REAPER_INTERVAL > 0, by a thread of each web process.
+
+They are deleted USER_REAPER_BATCH_SIZE at a time, each batch being its own
+short transaction, and the rows locked by a concurrent sign-up are skipped
+rather than waited for, so several reapers can run at once.
+
+In the partitioned layout of src/api/partitions.py, the reaper also creates
+the next partitions and drops the ones of the users not activated once they
+all expired, before deleting the remaining expired users.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from django.conf import settings
+
+from src.api import partitions, queries
+from src.api.utils import execute_prepared_statement, invalidate_api_user
+
+
+logger = logging.getLogger(__name__)
+
+
+def purge_batch(limit, retention):
+    """Delete up to `limit` users not activated and whose token was sent
+    more than `retention` seconds ago. Returns their emails"""
+    rows = execute_prepared_statement(*partitions.statements(queries.PURGE_UNACTIVATED_USERS), params={
+        'limit': limit,
+        'retention': retention,
+    })
+    emails = [email for email, in rows or ()]
+    for email in emails:
+        invalidate_api_user(email)
+    return emails
+
+def purge_orphan_emails(limit, retention):
+    """Delete up to `limit` emails of the users of the partitions dropped by
+    partitions.drop_expired_partitions. Returns them"""
+    rows = execute_prepared_statement(partitions.PURGE_ORPHAN_EMAILS, params={
+        'limit': limit,
+        'before': pytz.UTC.localize(datetime.utcnow() - timedelta(seconds=retention)),
+    })
+    emails = [email for email, in rows or ()]
+    for email in emails:
+        invalidate_api_user(email)
+    return emails
+
+
+class Reaper(object):
+    """Deletes the expired users in batches of `batch_size`, counting them"""
+
+    def __init__(self, batch_size=None, retention=None):
+        self.batch_size = batch_size or settings.USER_REAPER_BATCH_SIZE
+        self.retention = settings.USER_REAPER_RETENTION if retention is None else retention
+        self.stats = dict.fromkeys(('runs', 'batches', 'deleted', 'partitions_dropped'), 0)
+        self.reaping_time = 0.0
+
+    def reap(self):
+        """Delete all the expired users, a batch at a time. Returns the
+        number of users deleted"""
+        started = time.monotonic()
+        deleted = 0
+        if settings.API_USER_PARTITIONS:
+            partitions.create_partitions()
+            self.stats['partitions_dropped'] += len(partitions.drop_expired_partitions(self.retention))
+            while len(purge_orphan_emails(self.batch_size, self.retention)) == self.batch_size:
+                pass
+        while True:
+            count = len(purge_batch(self.batch_size, self.retention))
+            deleted += count
+            self.stats['batches'] += 1
+            if count < self.batch_size:
+                break
+        self.reaping_time += time.monotonic() - started
+        self.stats['runs'] += 1
+        self.stats['deleted'] += deleted
+        return deleted
+
+    def throughput(self):
+        """Users deleted per second of reaping"""
+        return self.stats['deleted'] / self.reaping_time if self.reaping_time else 0.0
+
+
+class ReaperThread(threading.Thread):
+    """Thread running the Reaper every `interval` seconds until stopped"""
+
+    def __init__(self, interval=None, batch_size=None, retention=None, **kwargs):
+        kwargs.setdefault('daemon', True)
+        kwargs.setdefault('name', 'user-reaper')
+        super(ReaperThread, self).__init__(**kwargs)
+        self.interval = interval or settings.USER_REAPER_INTERVAL
+        self.reaper = Reaper(batch_size=batch_size, retention=retention)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                deleted = self.reaper.reap()
+            except Exception as ex:
+                logger.error('Purge of the users not activated failed: %s', ex)
+            else:
+                if deleted:
+                    logger.info('%s: %s users not activated deleted, %.1f users/s', self.name,
+                                deleted, self.reaper.throughput())
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+_reaper = None
+_reaper_pid = None
+_reaper_lock = threading.Lock()
+
+
+def ensure_reaper_started(**kwargs):
+    """Start the ReaperThread in the current process if USER_REAPER_INTERVAL
+    is set and it's not started yet. Connected to the `request_started`
+    signal, like the outbox workers."""
+    global _reaper, _reaper_pid
+    if not settings.USER_REAPER_INTERVAL or _reaper_pid == os.getpid():
+        return
+    with _reaper_lock:
+        if _reaper_pid == os.getpid():
+            return
+        _reaper = ReaperThread()
+        _reaper.start()
+        _reaper_pid = os.getpid()
@@ -0,0 +1,168 @@
+"""Routing of the lookups of the users to a read replica.
+
+With DB_REPLICA_HOST set, get_api_user and aget_api_user read the users from
+the DB_REPLICA_* database, while the writes and every other statement go to
+the primary, DB_DEFAULT_*. The replica lags behind the primary, so the reads
+go to the primary instead:
+
+- for the rest of a request which wrote, and for DB_READ_STICKINESS seconds
+  for its client, which sends back the DB_READ_PIN_COOKIE cookie set by
+  ReadYourWritesMiddleware;
+- for DB_READ_STICKINESS seconds after a write to the user, in the process
+  which wrote it;
+- when the replica doesn't have the user, or has another activation token
+  than the one sent to activate it: a sign-up it didn't replay yet;
+- for DB_REPLICA_RETRY_INTERVAL seconds after the replica failed, a
+  connection error or a timeout of its pool.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+
+from src.api.cache import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+
+
+class _Pinning(object):
+    """Why the reads of a request go to the primary, `reason`: None,
+    'client' for a client which wrote recently, 'write' once it wrote.
+    Shared with the threads and the tasks the request runs code in."""
+    __slots__ = ('reason',)
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+# the _Pinning of the current request, None outside of pinning()
+_pinned = contextvars.ContextVar('db_read_pinned', default=None)
+
+
+@contextmanager
+def pinning(reason=None):
+    """Scope of the pinning of the reads to the primary, a request"""
+    token = _pinned.set(_Pinning(reason))
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def wrote():
+    """Whether the current request wrote"""
+    current = _pinned.get()
+    return current is not None and current.reason == 'write'
+
+
+class ReadRouter(object):
+    """Decides which reads go to the replica.
+
+    :param stickiness:      Seconds the reads of a user go to the primary
+                            after this process wrote to it
+    :param retry_interval:  Seconds the replica is skipped after it failed
+    :param max_size:        Users whose last write is remembered
+    """
+
+    def __init__(self, stickiness, retry_interval, max_size=10000):
+        self.recent_writes = LRUCache(max_size, stickiness)
+        self.retry_interval = retry_interval
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('replica', 'sticky', 'skipped', 'misses', 'failures'), 0)
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def record_write(self, key=None):
+        """Send the next reads of the request, and of `key`, to the primary.
+        Outside of a request, e.g. in the generator of a streamed response,
+        only the ones of `key`"""
+        current = _pinned.get()
+        if current is not None:
+            current.reason = 'write'
+        if key is not None:
+            self.recent_writes.set(key, True)
+
+    def use_replica(self, key=None):
+        """Whether the read of `key` can go to the replica"""
+        current = _pinned.get()
+        if (current is not None and current.reason is not None) or (
+                key is not None and self.recent_writes.get(key)):
+            self.count('sticky')
+            return False
+        if time.monotonic() < self._down_until:
+            self.count('skipped')
+            return False
+        self.count('replica')
+        return True
+
+    def replica_failed(self, ex):
+        """Skip the replica for `retry_interval` seconds after the error `ex`"""
+        with self._lock:
+            self._down_until = time.monotonic() + self.retry_interval
+            self._stats['failures'] += 1
+        logger.warning('The read replica failed, reading from the primary for %ss: %s',
+                       self.retry_interval, str(ex).strip())
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, down=time.monotonic() < self._down_until)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Return the process wide ReadRouter"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ReadRouter(settings.DB_READ_STICKINESS, settings.DB_REPLICA_RETRY_INTERVAL)
+    return _router
+
+
+class ReadYourWritesMiddleware(object):
+    """Pins the reads of the requests of a client which wrote in the last
+    DB_READ_STICKINESS seconds to the primary, with the DB_READ_PIN_COOKIE
+    cookie set on the responses of the requests which wrote"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with pinning(self.pinned(request)):
+            response = self.get_response(request)
+            return self.process_response(response)
+
+    async def __acall__(self, request):
+        with pinning(self.pinned(request)):
+            response = await self.get_response(request)
+            return self.process_response(response)
+
+    def pinned(self, request):
+        if settings.DB_REPLICA_HOST and settings.DB_READ_PIN_COOKIE in request.COOKIES:
+            return 'client'
+        return None
+
+    def process_response(self, response):
+        if settings.DB_REPLICA_HOST and settings.DB_READ_STICKINESS > 0 and wrote():
+            response.set_cookie(settings.DB_READ_PIN_COOKIE, '1', max_age=int(settings.DB_READ_STICKINESS) or 1,
+                                httponly=True, samesite='Lax')
+        return response
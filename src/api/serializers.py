@@ -0,0 +1,68 @@
+"""JSON encoding of the responses and decoding of the request bodies.
+
+orjson is used when it's installed, it encodes straight to bytes and parses
+bytes without decoding them to a str first, otherwise the stdlib json module.
+JSON_SERIALIZER picks one explicitly. Both produce the same compact output.
+"""
+import json
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonSerializer(object):
+    """The stdlib json module"""
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonSerializer(object):
+    name = 'orjson'
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+# raised by the loads() of both serializers on invalid JSON
+DecodeError = ValueError
+
+
+_serializer = None
+
+
+def get_serializer():
+    """Return the serializer set by JSON_SERIALIZER: `auto` for orjson when
+    it's installed, `json`, `orjson` or the import path of a class"""
+    global _serializer
+    if _serializer is None:
+        choice = settings.JSON_SERIALIZER
+        if choice == 'auto':
+            choice = 'orjson' if orjson is not None else 'json'
+        if choice == 'json':
+            _serializer = JsonSerializer()
+        elif choice == 'orjson':
+            _serializer = OrjsonSerializer()
+        else:
+            _serializer = import_string(choice)()
+    return _serializer
+
+
+def dumps(obj):
+    """`obj` encoded as JSON, in bytes"""
+    return get_serializer().dumps(obj)
+
+def loads(data):
+    return get_serializer().loads(data)
@@ -0,0 +1,60 @@
+"""Incremental reading of the request bodies.
+
+The NDJSON bodies are read from the request stream in chunks and parsed a
+line at a time, as they arrive: only the current chunk and the partial line
+at its end are in memory, never the whole body. A body longer than the
+allowed size is rejected with a 413, from its Content-Length before reading
+anything when it has one.
+"""
+from django.conf import settings
+
+from src.api import serializers
+from src.api.exceptions import Http413Error
+
+
+def check_content_length(request, max_size):
+    """Raise Http413Error if the Content-Length of `request` is above
+    `max_size` bytes"""
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > max_size:
+        raise Http413Error(message=f'The request body should be at most {max_size} bytes.')
+
+
+def _parse(line):
+    try:
+        return serializers.loads(line)
+    except serializers.DecodeError as ex:
+        return ex
+
+
+def iter_ndjson(stream, max_size=None, max_line_size=None, chunk_size=64 * 1024):
+    """The objects of the NDJSON lines read from `stream`, or the DecodeError
+    of the invalid ones, blank lines skipped.
+
+    Raises Http413Error once more than `max_size` bytes were read
+    (API_MAX_STREAM_SIZE), or on a line longer than `max_line_size` bytes
+    (API_MAX_LINE_SIZE).
+    """
+    max_size = max_size or settings.API_MAX_STREAM_SIZE
+    max_line_size = max_line_size or settings.API_MAX_LINE_SIZE
+    size, partial = 0, b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise Http413Error(message=f'The request body should be at most {max_size} bytes.')
+        lines = (partial + chunk).split(b'\n')
+        partial = lines.pop()
+        for line in lines + [partial]:
+            if len(line) > max_line_size:
+                raise Http413Error(message=f'The lines should be at most {max_line_size} bytes.')
+        for line in lines:
+            if line.strip():
+                yield _parse(line)
+    if partial.strip():
+        yield _parse(partial)
@@ -0,0 +1,272 @@
+"""Throttling of the API clients.
+
+Four throttles, each one disabled by an empty rate, `<number>/<period>`:
+
+- API_THROTTLE_IP_RATE, the requests of a client IP to the API, checked by
+  ThrottleMiddleware before the request is read: a token bucket of
+  `<number>` tokens refilled over `<period>`;
+- API_THROTTLE_BULK_RATE, the users of the bulk sign-ups of a client IP,
+  whose requests count once for API_THROTTLE_IP_RATE: a token bucket too;
+- API_THROTTLE_SIGNUP_RATE, the sign-ups of an email, each one hashing a
+  password and sending an email: a token bucket as well;
+- API_THROTTLE_ACTIVATION_RATE, the failed activations of an email, wrong
+  credentials or token, a sliding window keeping the 4 characters tokens
+  from being brute forced.
+
+A throttled request fails with a 429 and a `Retry-After` header. The
+counters are kept in the process (LocalBackend), at most API_THROTTLE_SIZE of
+them, or in a Django cache shared by the processes (DjangoCacheBackend),
+where the token buckets are approximated by sliding windows of `<number>`
+requests per `<period>`.
+"""
+import asyncio
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from src.api import serializers
+from src.api.errors import report_error
+from src.api.exceptions import Http429Error
+from src.api.ratelimit import SlidingWindow, TokenBucket, window_delay
+
+
+API_PREFIX = '/api/'
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([smhd])\s*$')
+
+
+def parse_rate(rate):
+    """(number, seconds) of a `<number>/<period>` rate, e.g. `10/5m`, None
+    for an empty one"""
+    if not rate:
+        return None
+    match = RATE_RE.match(rate)
+    if match is None:
+        raise ValueError(f'Invalid rate {rate!r}, expected e.g. 10/m or 10/5m')
+    number, multiplier, unit = match.groups()
+    return int(number), int(multiplier or 1) * PERIODS[unit]
+
+
+class LocalBackend(object):
+    """Counters of the throttles kept in the process, the least recently used
+    ones dropped above `max_size`"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _counter(self, key, factory):
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = factory()
+                if len(self._counters) > self.max_size:
+                    self._counters.popitem(last=False)
+            else:
+                self._counters.move_to_end(key)
+            return counter
+
+    def consume(self, key, number, period):
+        """Take a token from the bucket `key`, returns 0, or the seconds until
+        there is one"""
+        bucket = self._counter(key, lambda: TokenBucket(rate=number / period, capacity=number))
+        if bucket.consume():
+            return 0
+        return bucket.delay()
+
+    def delay(self, key, number, period):
+        """Seconds until the window `key` counts less than `number` hits, 0 if
+        it does"""
+        return self._counter(key, lambda: SlidingWindow(number, period)).delay()
+
+    def hit(self, key, number, period):
+        self._counter(key, lambda: SlidingWindow(number, period)).hit()
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class DjangoCacheBackend(object):
+    """Counters of the throttles kept in the Django cache `alias`, shared by
+    the processes, as the counts of the fixed windows of the sliding ones"""
+
+    def __init__(self, alias, prefix='throttle:'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _keys(self, key, period):
+        now = time.time()
+        index = int(now // period)
+        return (f'{self.prefix}{key}:{index - 1}', f'{self.prefix}{key}:{index}',
+                now / period - index)
+
+    def consume(self, key, number, period):
+        delay = self.delay(key, number, period)
+        if not delay:
+            self.hit(key, number, period)
+        return delay
+
+    def delay(self, key, number, period):
+        previous, current, elapsed = self._keys(key, period)
+        counts = self.cache.get_many([previous, current])
+        return window_delay(number, period, counts.get(previous, 0), counts.get(current, 0), elapsed)
+
+    def hit(self, key, number, period):
+        _, current, _ = self._keys(key, period)
+        # kept while it's the current or the previous window
+        self.cache.add(current, 0, timeout=2 * period + 1)
+        try:
+            self.cache.incr(current)
+        except ValueError:
+            # expired in between
+            self.cache.add(current, 1, timeout=2 * period + 1)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class Throttler(object):
+    """
+    :param backend:         LocalBackend or DjangoCacheBackend
+    :param ip_rate:         (requests, seconds) of a client IP, None to disable
+    :param bulk_rate:       (users of the bulk sign-ups, seconds) of a client IP
+    :param signup_rate:     (sign-ups, seconds) of an email
+    :param activation_rate: (failed activations, seconds) of an email
+    """
+
+    def __init__(self, backend, ip_rate=None, signup_rate=None, activation_rate=None, bulk_rate=None):
+        self.backend = backend
+        self.ip_rate = ip_rate
+        self.bulk_rate = bulk_rate
+        self.signup_rate = signup_rate
+        self.activation_rate = activation_rate
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('ip', 'bulk', 'signup', 'activation'), 0)
+
+    def _throttled(self, scope, delay):
+        with self._lock:
+            self._stats[scope] += 1
+        raise Http429Error(extra_headers={'Retry-After': str(math.ceil(delay))})
+
+    def check_ip(self, ip):
+        """Raise a Http429Error if the client `ip` sent too many requests"""
+        if self.ip_rate is not None:
+            delay = self.backend.consume('ip:' + ip, *self.ip_rate)
+            if delay:
+                self._throttled('ip', delay)
+
+    def check_bulk(self, ip):
+        """Raise a Http429Error if the client `ip` sent too many users to
+        sign up in bulk"""
+        if self.bulk_rate is not None:
+            delay = self.backend.consume('bulk:' + ip, *self.bulk_rate)
+            if delay:
+                self._throttled('bulk', delay)
+
+    def check_signup(self, email):
+        """Raise a Http429Error if `email` signed up too many times"""
+        if self.signup_rate is not None:
+            delay = self.backend.consume('signup:' + email.lower(), *self.signup_rate)
+            if delay:
+                self._throttled('signup', delay)
+
+    def check_activation(self, email):
+        """Raise a Http429Error if the activations of `email` failed too many
+        times"""
+        if self.activation_rate is not None:
+            delay = self.backend.delay('activation:' + email.lower(), *self.activation_rate)
+            if delay:
+                self._throttled('activation', delay)
+
+    def activation_failed(self, email):
+        if self.activation_rate is not None:
+            self.backend.hit('activation:' + email.lower(), *self.activation_rate)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_throttler = None
+_throttler_lock = threading.Lock()
+
+
+def get_throttler():
+    """Return the process wide Throttler, configured by the API_THROTTLE_*
+    settings"""
+    global _throttler
+    if _throttler is None:
+        with _throttler_lock:
+            if _throttler is None:
+                if settings.API_THROTTLE_BACKEND == 'local':
+                    backend = LocalBackend(settings.API_THROTTLE_SIZE)
+                else:
+                    backend = DjangoCacheBackend(settings.API_THROTTLE_BACKEND)
+                _throttler = Throttler(
+                    backend,
+                    ip_rate=parse_rate(settings.API_THROTTLE_IP_RATE),
+                    signup_rate=parse_rate(settings.API_THROTTLE_SIGNUP_RATE),
+                    activation_rate=parse_rate(settings.API_THROTTLE_ACTIVATION_RATE),
+                    bulk_rate=parse_rate(settings.API_THROTTLE_BULK_RATE),
+                )
+    return _throttler
+
+
+def client_ip(request, header='REMOTE_ADDR'):
+    """Address of the client of `request`, the last one of a list such as the
+    X-Forwarded-For one, appended by the proxy in front of the server"""
+    value = request.META.get(header) or request.META.get('REMOTE_ADDR') or ''
+    return value.rsplit(',', 1)[-1].strip()
+
+
+class ThrottleMiddleware(object):
+    """Rejects the requests to the API of the client IPs above
+    API_THROTTLE_IP_RATE with a 429, read from the API_THROTTLE_IP_HEADER
+    variable"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = settings.API_THROTTLE_IP_HEADER
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        response = self.throttle(request)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        response = self.throttle(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+    def throttle(self, request):
+        """The 429 response of a throttled request, None otherwise"""
+        if not request.path.startswith(API_PREFIX):
+            return None
+        try:
+            get_throttler().check_ip(client_ip(request, self.header))
+        except Http429Error as err:
+            report_error(err, request)
+            response = HttpResponse(status=err.status_code, content=serializers.dumps(err.response),
+                                    content_type='application/json')
+            for header, value in err.headers.items():
+                response[header] = value
+            return response
+        return None
@@ -1,6 +1,9 @@
+import csv
+import io
 import random
 import string
 import psycopg2
+from psycopg2.extras import execute_values
 import pytz
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
@@ -8,9 +11,16 @@ import base64
 
 from django.conf import settings
 from django.core.mail import send_mail
-from django.contrib.auth.hashers import make_password
 
+from psycopg2.pool import PoolError
+
+from src.api import partitions, queries
+from src.api.cache import get_credential_cache, get_user_cache
+from src.api.hashing import make_password, amake_password
 from src.api.exceptions import Http500Error, Http400Error
+from src.api.metrics import span
+from src.api.pool import get_async_pool, get_async_replica_pool, get_pool, get_replica_pool
+from src.api.routing import get_router
 
 
 class ApiResponse(object):
@@ -39,73 +49,327 @@ def get_random_string():
     characters = string.ascii_letters + string.digits
     return ''.join(random.choice(characters) for i in range(4))
 
-def get_connection():
-    return psycopg2.connect(
-        host=settings.DB_DEFAULT_HOST,
-        database=settings.DB_DEFAULT_NAME,
-        user=settings.DB_DEFAULT_USER,
-        password=settings.DB_DEFAULT_PASSWORD
-    )
-
-def execute_select_statement(query):
-    result, conn = None, None
+def execute_select_statement(query, params=None):
+    result = None
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
+        with span('db'), get_pool().connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            result = cur.fetchall()
     except (Exception, psycopg2.DatabaseError) as ex:
         raise Http500Error(message=str(ex))
     finally:
-        if conn is not None:
-            conn.close()
         return result
 
-def execute_insert_update_statement(query):
-    result, conn = None, None
+def execute_insert_update_statement(query, params=None):
+    """Execute a write statement and return the rows of its `returning`
+    clause, if it has one"""
+    result = None
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(query)
-        result = conn.commit()
+        with span('db'), get_pool().connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            if cur.description is not None:
+                result = cur.fetchall()
     except (Exception, psycopg2.DatabaseError) as ex:
         raise Http500Error(message=str(ex))
     finally:
-        if conn is not None:
-            conn.close()
         return result
 
+def execute_prepared_statement(*statements, params=None):
+    """Execute the prepared statements from src.api.queries in one round trip
+    and return the rows of the last one, if it returns any"""
+    try:
+        with span('db'), get_pool().connection() as conn:
+            cur = queries.execute(conn, statements, params or {})
+            return cur.fetchall() if cur.description is not None else None
+    except (Exception, psycopg2.DatabaseError) as ex:
+        raise Http500Error(message=str(ex))
+
+async def aexecute_prepared_statement(*statements, params=None):
+    """`execute_prepared_statement` for the async views, on the connection
+    pool of the running event loop"""
+    try:
+        with span('db'):
+            async with get_async_pool().connection() as conn:
+                cur = await queries.aexecute(conn, statements, params or {})
+            return cur.fetchall() if cur.description is not None else None
+    except (Exception, psycopg2.DatabaseError) as ex:
+        raise Http500Error(message=str(ex))
+
+def execute_read_statement(*statements, params=None, key=None):
+    """`execute_prepared_statement` on the read replica, unless the reads of
+    `key` go to the primary (see src.api.routing). The statements are run
+    again on the primary when the replica fails or returns no rows."""
+    router = get_router()
+    pool = get_replica_pool()
+    if pool is not None and router.use_replica(key):
+        try:
+            with span('db'), pool.connection() as conn:
+                rows = queries.execute(conn, statements, params or {}).fetchall()
+            if rows:
+                return rows
+            router.count('misses')
+        except (PoolError, psycopg2.Error) as ex:
+            router.replica_failed(ex)
+    return execute_prepared_statement(*statements, params=params)
+
+async def aexecute_read_statement(*statements, params=None, key=None):
+    """`execute_read_statement` for the async views"""
+    router = get_router()
+    pool = get_async_replica_pool()
+    if pool is not None and router.use_replica(key):
+        try:
+            with span('db'):
+                async with pool.connection() as conn:
+                    rows = (await queries.aexecute(conn, statements, params or {})).fetchall()
+            if rows:
+                return rows
+            router.count('misses')
+        except (PoolError, psycopg2.Error) as ex:
+            router.replica_failed(ex)
+    return await aexecute_prepared_statement(*statements, params=params)
+
+def activation_email(token):
+    """Subject and message of the activation email"""
+    return "Activation code", f"Use {token} to activate your account. The code is valid for one minute."
+
 def send_activation_email(email, token):
-    message = f"Use {token} to activate your account. The code is valid for one minute."
-    send_mail(
-        subject="Activation code",
-        message=message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[email],
-        fail_silently=False
-    )
+    subject, message = activation_email(token)
+    with span('smtp'):
+        send_mail(
+            subject=subject,
+            message=message,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            recipient_list=[email],
+            fail_silently=False
+        )
     return message
 
-def get_api_user(email):
-    query = f"select * from api_apiuser where email='{email}' order by created_at desc limit 1;"
-    return execute_select_statement(query)
+def invalidate_api_user(email):
+    """Drop the cached rows and password checks of the user `email`, after
+    writing to it, and read it from the primary for a while"""
+    user_cache = get_user_cache()
+    if user_cache is not None:
+        user_cache.invalidate(email.lower())
+    get_credential_cache().invalidate(email)
+    get_router().record_write(email.lower())
+
+async def ainvalidate_api_user(email):
+    """`invalidate_api_user` for the coroutines"""
+    user_cache = get_user_cache()
+    if user_cache is not None:
+        await user_cache.ainvalidate(email.lower())
+    get_credential_cache().invalidate(email)
+    get_router().record_write(email.lower())
+
+def stale_api_user(rows, token):
+    """Whether the rows read for an activation with `token` may be stale: the
+    ones of the replica, which didn't replay the sign-up sending it yet, of
+    the cache of this process, before a sign-up through another one, or of
+    any read racing that sign-up"""
+    return token is not None and bool(rows) and rows[0][3] != token
+
+def get_api_user(email, token=None):
+    """The rows of the user `email`, through the cache of get_user_cache()
+    and from the read replica, if any. A user read with another activation
+    token than `token` is read again from the primary."""
+    statements = partitions.statements(queries.GET_API_USER)
+
+    def load():
+        return execute_read_statement(*statements, params={'email': email}, key=email.lower())
+
+    user_cache = get_user_cache()
+    rows = load() if user_cache is None else user_cache.get(email.lower(), load)
+    if stale_api_user(rows, token):
+        if user_cache is not None:
+            user_cache.invalidate(email.lower())
+        rows = execute_prepared_statement(*statements, params={'email': email})
+    return rows
 
 def insert_api_user(email, password):
     now = datetime.utcnow()
     hashed_password = make_password(password)
-    query = f"insert into api_apiuser (email, password, token, activated, token_sent_at, created_at) " \
-            f"values ('{email}','{hashed_password}', null, false, '{now}', '{now}');"
-    return execute_insert_update_statement(query)
+    result = execute_prepared_statement(queries.INSERT_API_USER, params={
+        'email': email,
+        'password': hashed_password,
+        'now': now,
+    })
+    invalidate_api_user(email)
+    return result
 
 def save_token(email, token, pref_date=None):
     now = datetime.utcnow()
     token_activated_at = pref_date or now
-    query = f"update api_apiuser set token='{token}', token_sent_at='{token_activated_at}' where email='{email}';"
-    return execute_insert_update_statement(query)
+    result = execute_prepared_statement(*partitions.statements(queries.SAVE_TOKEN), params={
+        'email': email,
+        'token': token,
+        'token_sent_at': token_activated_at,
+    })
+    invalidate_api_user(email)
+    return result
+
+def signup_api_user(email, password, token):
+    """Save the user if it doesn't exist, set its activation token and queue
+    the activation email, see src/api/outbox.py.
+
+    Returns True if the user was created. The password is hashed even for
+    existing users, whose password is left unchanged, so the statement is
+    the only database round trip of a sign-up.
+    """
+    now = datetime.utcnow()
+    subject, message = activation_email(token)
+    rows = execute_prepared_statement(*partitions.statements(queries.SIGNUP), params={
+        'email': email,
+        'password': make_password(password),
+        'token': token,
+        'now': now,
+        'subject': subject,
+        'body': message,
+    })
+    if not rows:
+        raise Http500Error(message=f"Failed to save the user {email}.")
+    invalidate_api_user(email)
+    return rows[0][1]
+
+def bulk_signup_api_users(users):
+    """signup_api_user for many users, in a single statement.
+
+    :param users:   (email, hashed password, token) tuples, with emails
+                    distinct case insensitive
+    :return:        Whether each user was created, by lowercased email
+    """
+    now = datetime.utcnow()
+    rows = []
+    for email, hashed_password, token in users:
+        subject, message = activation_email(token)
+        rows.append((email, hashed_password, token, now, subject, message))
+    if settings.API_USER_PARTITIONS:
+        emails, passwords, tokens, _, subjects, bodies = zip(*rows)
+        saved = execute_prepared_statement(partitions.LOCK_EMAILS, partitions.BULK_SIGNUP, params={
+            'emails': list(emails),
+            'passwords': list(passwords),
+            'tokens': list(tokens),
+            'now': now,
+            'subjects': list(subjects),
+            'bodies': list(bodies),
+        })
+    else:
+        try:
+            with get_pool().connection() as conn:
+                saved = execute_values(conn.cursor(), queries.BULK_SIGNUP_SQL, rows,
+                                       page_size=len(rows), fetch=True)
+        except (Exception, psycopg2.DatabaseError) as ex:
+            raise Http500Error(message=str(ex))
+    for email, _, _ in users:
+        invalidate_api_user(email)
+    return {email.lower(): created for email, created in saved}
+
+def copy_api_users_to(file, fmt='csv'):
+    """Write all the users to the binary `file` with COPY, as CSV with a
+    header line or as NDJSON. The rows are written as postgres sends them,
+    never held in memory together."""
+    query = queries.EXPORT_API_USERS_NDJSON if fmt == 'ndjson' else queries.EXPORT_API_USERS_CSV
+    try:
+        with get_pool().connection() as conn:
+            conn.cursor().copy_expert(query, file)
+    except (Exception, psycopg2.DatabaseError) as ex:
+        raise Http500Error(message=str(ex))
+
+def copy_api_users_from(chunks, replace=False):
+    """Import users with COPY.
+
+    :param chunks:  Iterable of lists of (email, hashed password, token,
+                    activated, token_sent_at, created_at) tuples, None for
+                    the missing values; each list is copied to a temporary
+                    table as it comes
+    :param replace: Replace the existing users instead of leaving them
+                    unchanged
+    :return:        The number of users `copied`, of `unique` emails among
+                    them, of users `created` and `replaced`
+
+    The users are then saved by a single statement, the first one of each
+    email, case insensitive, and the caches are cleared; the local caches of
+    the other processes expire after API_USER_CACHE_TTL seconds.
+    """
+    copied = 0
+    try:
+        with get_pool().connection() as conn:
+            cur = conn.cursor()
+            cur.execute(queries.CREATE_IMPORT_TABLE)
+            try:
+                for rows in chunks:
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(rows)
+                    buffer.seek(0)
+                    cur.copy_expert(queries.COPY_IMPORT, buffer)
+                    copied += len(rows)
+                if settings.API_USER_PARTITIONS:
+                    cur.execute(f"select distinct {partitions.utc_day(partitions.IMPORT_CREATED_AT)} "
+                                "from api_apiuser_import")
+                    partitions.create_partitions([day for day, in cur.fetchall()], conn=conn)
+                    cur.execute(partitions.LOCK_ALL_EMAILS_SQL + ';' + (
+                        partitions.IMPORT_API_USERS_REPLACE if replace else partitions.IMPORT_API_USERS))
+                else:
+                    cur.execute(queries.IMPORT_API_USERS_REPLACE if replace else queries.IMPORT_API_USERS)
+                unique, created, replaced = cur.fetchone()
+            finally:
+                cur.execute(queries.DROP_IMPORT_TABLE)
+    except (Exception, psycopg2.DatabaseError) as ex:
+        raise Http500Error(message=str(ex))
+    user_cache = get_user_cache()
+    if user_cache is not None:
+        user_cache.clear()
+    get_credential_cache().clear()
+    return {'copied': copied, 'unique': unique, 'created': created, 'replaced': replaced}
+
+async def asignup_api_user(email, password, token):
+    """`signup_api_user` for the async views"""
+    now = datetime.utcnow()
+    subject, message = activation_email(token)
+    hashed_password = await amake_password(password)
+    rows = await aexecute_prepared_statement(*partitions.statements(queries.SIGNUP), params={
+        'email': email,
+        'password': hashed_password,
+        'token': token,
+        'now': now,
+        'subject': subject,
+        'body': message,
+    })
+    if not rows:
+        raise Http500Error(message=f"Failed to save the user {email}.")
+    await ainvalidate_api_user(email)
+    return rows[0][1]
+
+async def aget_api_user(email, token=None):
+    statements = partitions.statements(queries.GET_API_USER)
+
+    async def load():
+        return await aexecute_read_statement(*statements, params={'email': email}, key=email.lower())
+
+    user_cache = get_user_cache()
+    rows = await load() if user_cache is None else await user_cache.aget(email.lower(), load)
+    if stale_api_user(rows, token):
+        if user_cache is not None:
+            await user_cache.ainvalidate(email.lower())
+        rows = await aexecute_prepared_statement(*statements, params={'email': email})
+    return rows
+
+def activate_user(api_user_id, created_at=None):
+    """Activate the user `api_user_id`, whose `created_at` is needed to find
+    it in the partitioned layout of src/api/partitions.py"""
+    rows = execute_prepared_statement(*partitions.statements(queries.ACTIVATE_USER),
+                                      params={'id': api_user_id, 'created_at': created_at})
+    for email, in rows or ():
+        invalidate_api_user(email)
+    return rows
 
-def activate_user(api_user_id):
-    query = f"update api_apiuser set activated=True where id='{api_user_id}';"
-    return execute_insert_update_statement(query)
+async def aactivate_user(api_user_id, created_at=None):
+    rows = await aexecute_prepared_statement(*partitions.statements(queries.ACTIVATE_USER),
+                                             params={'id': api_user_id, 'created_at': created_at})
+    for email, in rows or ():
+        await ainvalidate_api_user(email)
+    return rows
 
 def token_not_expired(api_user, token):
     utc = pytz.UTC
@@ -128,5 +392,7 @@ def get_auth_from_request(request):
 
 
 def delete_api_user(email):
-    query = f"""delete from api_apiuser where email='{email}'"""
-    return execute_insert_update_statement(query)
\ No newline at end of file
+    result = execute_prepared_statement(*partitions.statements(queries.DELETE_API_USER),
+                                        params={'email': email})
+    invalidate_api_user(email)
+    return result
\ No newline at end of file
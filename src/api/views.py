@@ -1,136 +1,284 @@
-import json
+import hmac
 import logging
-from django.contrib.auth.hashers import check_password
+from contextlib import contextmanager
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 
-from django.utils.decorators import method_decorator
-from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
+from src.api import bulk, streaming
 from src.api.decorators import user_api
+from src.api.routing import get_router
+from src.api.cache import get_credential_cache
+from src.api.throttling import client_ip, get_throttler
 from src.api.utils import (
     ApiResponse,
     get_api_user,
-    insert_api_user,
-    send_activation_email,
+    aget_api_user,
+    signup_api_user,
+    asignup_api_user,
     get_random_string,
-    save_token,
     activate_user,
+    aactivate_user,
     token_not_expired,
     get_auth_from_request
 )
-from src.api.exceptions import Http500Error, Http400Error, Http404Error, Http401Error
+from src.api.exceptions import HttpError, Http500Error, Http400Error, Http404Error, Http401Error
 
 
 
 logger = logging.getLogger(__name__)
 
 
-class SignupView(View):
-    @method_decorator(csrf_exempt)
-    @method_decorator(user_api(['POST']))
-    def dispatch(self, request, *args, **kwargs):
-        return super(SignupView, self).dispatch(request, *args, **kwargs)
+class ApiView(View):
+    """Base class of the API views, whose `as_view` wraps the view with
+    @user_api for the `http_methods` and the `content_types`, once.
+
+    Decorating `dispatch` with method_decorator instead would decorate it
+    again on every request.
+    """
+    http_methods = []
+    content_types = 'application/json'
+    is_async = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super(ApiView, cls).as_view(**initkwargs)
+        if cls.is_async:
+            # its handlers are coroutine functions, the view returns their coroutines
+            markcoroutinefunction(view)
+        return user_api(cls.http_methods, cls.content_types)(view)
+
+
+def signup_params(request):
+    """The email and the password of a sign-up, once throttled"""
+    content = request.json or {}
+    email = content.get('email')
+    password = content.get('password')
+    if not all([email, password]):
+        raise Http400Error(message='Email, and password should be sent in the request body.')
+    get_throttler().check_signup(email)
+    return email, password
+
+
+@contextmanager
+def failing_with(message):
+    """Raise the unexpected errors of the block as a 500 with `message`"""
+    try:
+        yield
+    except HttpError:
+        raise
+    except Exception as ex:
+        logger.error(str(ex))
+        raise Http500Error(message=f"{message} because {str(ex)}")
+
+
+def signup_response(email, token, created):
+    if created:
+        logger.info("User with %s has been saved().", email)
+    else:
+        logger.info('User with %s already exists.', email)
+
+    logger.info('Activation mail to %s queued.', email)
+
+    return ApiResponse(
+        status=201,
+        content={
+            "message" : f'Activation mail sent to {email}.',
+            'token': token
+        }
+    )
+
+
+class SignupView(ApiView):
+    http_methods = ['POST']
 
     def post(self, request):
-        content = json.loads(request.body)
-        email = content.get('email')
-        password = content.get('password')
-        if not all([email, password]):
-            raise Http400Error(message='Email, and password should be sent in the request body.')
-        try:
-            api_user = get_api_user(email)
-        except Exception as ex:
-            logger.error(str(ex))
-            raise Http500Error(message=f"Failed to fetch data because {ex.message}")
-
-        logger.info("Check if the email already in database.")
-        if api_user:
-            logger.info(f'User with {email} already exists.')
-        else :
-            # save user if not exists
-            logger.info('Save api user to database.')
-            try:
-                insert_api_user(email, password)
-                logger.info(f"User with {email} has been saved().")
-            except Exception as ex:
-                logger.error(str(ex))
-                raise Http500Error(message=f"Failed to save the user because {ex.message}")
-
-        logger.info("Generate activation token and send email with activation link.")
-        try:
-            token = get_random_string()
-            activation_url = send_activation_email(email, token)
-            save_token(
-                token=token,
-                email=email
-            )
-            logger.info(f'Activation mail sent to {email}.')
-        except Exception as ex:
-            logger.error(str(ex))
-            raise Http500Error(message=f'Failed to send email at {email} because {str(ex)}.')
-
-        return ApiResponse(
-            status=201,
-            content={
-                "message" : f'Activation mail sent to {email}.',
-                'token': token
-            }
-        )
-
-
-class ActivateView(View):
-    @method_decorator(csrf_exempt)
-    @method_decorator(user_api(['PATCH']))
-    def dispatch(self, request, *args, **kwargs):
-        return super(ActivateView, self).dispatch(request, *args, **kwargs)
+        email, password = signup_params(request)
+        token = get_random_string()
+        logger.debug('Save api user and activation token to database, queue the activation mail.')
+        with failing_with('Failed to save the user'):
+            created = signup_api_user(email, password, token)
+        return signup_response(email, token, created)
+
+
+def check_bulk_key(request):
+    """Raise unless `request` has the BULK_SIGNUP_API_KEY, a 404 without one"""
+    if not settings.BULK_SIGNUP_API_KEY:
+        raise Http404Error()
+    scheme, _, key = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(key.strip().encode(),
+                                                             settings.BULK_SIGNUP_API_KEY.encode()):
+        raise Http401Error(headers={'WWW-Authenticate': 'Bearer realm="src.api"'})
+
+
+def bulk_items(request):
+    """The users of a bulk sign-up, the NDJSON ones read as they are
+    iterated"""
+    if request.json is not None:
+        if not isinstance(request.json, list):
+            raise Http400Error(message='A JSON array of users should be sent in the request body.')
+        return request.json
+    # read as the results are streamed, never buffered whole
+    streaming.check_content_length(request, settings.API_MAX_STREAM_SIZE)
+    return streaming.iter_ndjson(request)
+
+
+class BulkSignupView(ApiView):
+    """Sign-up of many users, sent as a JSON array or as NDJSON lines of
+    {"email": ..., "password": ...} objects, with the BULK_SIGNUP_API_KEY.
+    The results are streamed as NDJSON lines, one per user, see
+    src/api/bulk.py.
+
+    The NDJSON lines are parsed while they are read, see src/api/streaming.py,
+    so the body can be larger than the API_MAX_BODY_SIZE of a JSON array.
+    """
+    http_methods = ['POST']
+    content_types = ('application/json', 'application/x-ndjson')
+
+    def post(self, request):
+        check_bulk_key(request)
+        # the users are saved by the generator of the response, once it's
+        # returned by the middlewares
+        get_router().record_write()
+        results = bulk.sign_up(bulk_items(request), ip=client_ip(request, settings.API_THROTTLE_IP_HEADER))
+        return StreamingHttpResponse(bulk.encode(results), content_type='application/x-ndjson')
+
+
+def activation_params(request):
+    """The email, the password and the token of an activation, once
+    throttled"""
+    content = request.json or {}
+    token = content.get('token')
+
+    logger.debug('Getting email and password from request')
+    try:
+        email, password = get_auth_from_request(request)
+    except Http400Error as ex:
+        raise Http400Error(message=ex.response['errors'])
+    except Exception as ex:
+        raise Http400Error(message=str(ex))
+
+    if not token:
+        logger.debug('Token should be sent in the request body.')
+        raise Http400Error(message='Token should be sent in the request body.')
+    get_throttler().check_activation(email)
+    return email, password, token
+
+
+@contextmanager
+def fetching_user():
+    logger.debug('Get api user')
+    try:
+        yield
+    except Http500Error as ex:
+        logger.error(str(ex))
+        raise Http500Error(message=f"Failed to fetch data because {ex.response['errors']}")
+
+
+def found_user(email, rows):
+    if not len(rows):
+        raise Http404Error(message=f"User {email} not found.")
+    return rows[0]
+
+
+def check_password(email, verified):
+    if not verified:
+        get_throttler().activation_failed(email)
+        raise Http401Error(message=f"The email or the password provided are wrong.")
+    logger.debug("User and password are matching.")
+
+
+def check_token(email, api_user, token):
+    """Raise unless `token` is the unexpired one of the pending `api_user`"""
+    if api_user[3] != token:
+        get_throttler().activation_failed(email)
+        raise Http400Error(f"Provided token not matching the user token.")
+    logger.debug('Check token validity.')
+    if not token_not_expired(api_user=api_user, token=token):
+        logger.info('The token %s expired. Signup again to receive a new token.', token)
+        raise Http400Error(message=f'The token {token} expired. Signup again to receive a new token.')
+
+
+def activated_response(email):
+    logger.info("User with %s has been activated", email)
+    return ApiResponse(content={
+        'message': f"User {email} has been activated.",
+    })
+
+
+class ActivateView(ApiView):
+    http_methods = ['PATCH']
 
     def patch(self, request):
-        content = json.loads(request.body)
-        token = content.get('token')
-
-        logger.info('Getting email and password from request')
-        try:
-            email, password = get_auth_from_request(request)
-        except Http400Error as ex:
-            raise Http400Error(message=ex.response['errors'])
-        except Exception as ex:
-            raise Http400Error(message=str(ex))
-
-        if not token:
-            logger.info('Token should be sent in the request body.')
-            raise Http400Error(message='Token should be sent in the request body.')
-
-        logger.info('Get api user')
-        try:
-            api_user = get_api_user(email)
-        except Http500Error as ex:
-            logger.error(str(ex))
-            raise Http500Error(message=f"Failed to fetch data because {ex.message}")
-        if not len(api_user):
-            raise Http404Error(message=f"User {email} not found.")
-        api_user = api_user[0]
-        logger.info('Check password')
-        if not check_password(password, api_user[2]):
-            raise Http401Error(message=f"The email or the password provided are wrong.")
-        logger.info("User and password are matching.")
+        email, password, token = activation_params(request)
+        with fetching_user():
+            api_user = found_user(email, get_api_user(email, token=token))
+        logger.debug('Check password')
+        check_password(email, get_credential_cache().verify(email, password, api_user[2]))
+        if api_user[4]:
+            return ApiResponse(content=f"User {email} already active.")
+
+        check_token(email, api_user, token)
+        with failing_with('Activation failed'):
+            activate_user(api_user_id=api_user[0], created_at=api_user[6])
+        return activated_response(email)
+
+
+class AsyncApiView(ApiView):
+    """Base class of the views with coroutine handlers, served natively under
+    ASGI. Django's View doesn't support them, so `as_view` returns a coroutine
+    function, wrapped by @user_api for the `http_methods`.
+    """
+    is_async = True
+
+
+class AsyncSignupView(AsyncApiView):
+    http_methods = ['POST']
+
+    async def post(self, request):
+        email, password = signup_params(request)
+        token = get_random_string()
+        logger.debug('Save api user and activation token to database, queue the activation mail.')
+        with failing_with('Failed to save the user'):
+            created = await asignup_api_user(email, password, token)
+        return signup_response(email, token, created)
 
+
+class AsyncActivateView(AsyncApiView):
+    http_methods = ['PATCH']
+
+    async def patch(self, request):
+        email, password, token = activation_params(request)
+        with fetching_user():
+            api_user = found_user(email, await aget_api_user(email, token=token))
+        logger.debug('Check password')
+        check_password(email, await get_credential_cache().averify(email, password, api_user[2]))
         if api_user[4]:
             return ApiResponse(content=f"User {email} already active.")
 
-        same_token = api_user[3] == token
-        if not same_token:
-            raise Http400Error(f"Provided token not matching the user token.")
-        logger.info('Check token validity.')
-        if token_not_expired(api_user=api_user, token=token):
-            try:
-                activate_user(api_user_id=api_user[0])
-                logger.info(f"User with {email} has been activated")
-            except Exception as ex:
-                raise Http500Error(message=f"Activation failed becvause {str(ex)}")
-        else:
-            logger.info(f'The token {token} expired. Signup again to receive a new token.')
-            raise Http400Error(message=f'The token {token} expired. Signup again to receive a new token.')
-
-        return ApiResponse(content={
-            'message': f"User {email} has been activated.",
-        })
+        check_token(email, api_user, token)
+        with failing_with('Activation failed'):
+            await aactivate_user(api_user_id=api_user[0], created_at=api_user[6])
+        return activated_response(email)
+
+
+class AsyncBulkSignupView(AsyncApiView):
+    """BulkSignupView for the ASGI deployments, whose results are sent once
+    all the users are signed up.
+
+    Django 3.2 iterates the streamed responses on the event loop, and runs
+    the sync code of all the requests, request_started included, in a single
+    thread: the sign-up runs in a thread of its own instead, not to hold
+    them up for its whole run.
+    """
+    http_methods = BulkSignupView.http_methods
+    content_types = BulkSignupView.content_types
+
+    async def post(self, request):
+        check_bulk_key(request)
+        results = bulk.sign_up(bulk_items(request), ip=client_ip(request, settings.API_THROTTLE_IP_HEADER))
+        body = await sync_to_async(lambda: b''.join(bulk.encode(results)), thread_sensitive=False)()
+        return HttpResponse(body, content_type='application/x-ndjson')
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from src.api.logs import parse_levels
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -42,17 +44,40 @@ INSTALLED_APPS = [
 INSTALLED_APPS += ['src.api',]
 
 MIDDLEWARE = [
+    'src.api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'src.api.throttling.ThrottleMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'src.api.routing.ReadYourWritesMiddleware',
 ]
 
 ROOT_URLCONF = 'src.urls'
 
+# serve the API with the async views, the default of the ASGI application
+API_ASYNC_VIEWS = os.environ.get('API_ASYNC_VIEWS', '') in ('1', 'true', 'True')
+
+# timing of the requests and of their database, hashing, SMTP and JSON spans,
+# served at /metrics, see src/api/metrics.py
+API_METRICS = os.environ.get('API_METRICS', '') in ('1', 'true', 'True')
+# send the durations of the spans of a request in its Server-Timing header
+API_SERVER_TIMING = os.environ.get('API_SERVER_TIMING', '') in ('1', 'true', 'True')
+
+# fraction of the requests of the API views profiled, by sampling their stack
+# every API_PROFILE_INTERVAL seconds, see src/api/profiling.py
+API_PROFILE_SAMPLE_RATE = float(os.environ.get('API_PROFILE_SAMPLE_RATE', 0))
+API_PROFILE_INTERVAL = float(os.environ.get('API_PROFILE_INTERVAL', 0.005))
+# where each process writes its stacks, every API_PROFILE_FLUSH_INTERVAL seconds
+API_PROFILE_DIR = os.environ.get('API_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+API_PROFILE_FLUSH_INTERVAL = float(os.environ.get('API_PROFILE_FLUSH_INTERVAL', 60))
+
+# encoder/decoder of the API bodies, see src/api/serializers.py
+JSON_SERIALIZER = os.environ.get('JSON_SERIALIZER', 'auto')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -91,6 +116,81 @@ DATABASES = {
     }
 }
 
+# connection pool used by the raw SQL helpers in src/api/utils.py
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+# seconds to wait for a free connection when all of them are in use
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+# seconds after which the idle connections above DB_POOL_MIN_SIZE are closed
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300))
+# idle connections older than this many seconds are checked before reuse
+DB_POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30))
+
+# read replica the lookups of the users are sent to, see src/api/routing.py,
+# empty to read everything from the DB_DEFAULT_* database
+DB_REPLICA_HOST = os.environ.get('DB_REPLICA_HOST', '')
+DB_REPLICA_NAME = os.environ.get('DB_REPLICA_NAME', DB_DEFAULT_NAME)
+DB_REPLICA_USER = os.environ.get('DB_REPLICA_USER', DB_DEFAULT_USER)
+DB_REPLICA_PASSWORD = os.environ.get('DB_REPLICA_PASSWORD', DB_DEFAULT_PASSWORD)
+# seconds the reads of a client, or of a user, go to the primary after a write
+DB_READ_STICKINESS = float(os.environ.get('DB_READ_STICKINESS', 5))
+DB_READ_PIN_COOKIE = os.environ.get('DB_READ_PIN_COOKIE', 'db_pin')
+# seconds the replica is skipped after it failed
+DB_REPLICA_RETRY_INTERVAL = float(os.environ.get('DB_REPLICA_RETRY_INTERVAL', 5))
+
+
+# processes hashing the passwords, see src/api/hashing.py, 0 to hash them in
+# the request thread
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1))
+# hashes queued or running above which the requests fail with a 503, by
+# default 4 per worker
+PASSWORD_HASHING_MAX_PENDING = int(os.environ.get('PASSWORD_HASHING_MAX_PENDING', 0))
+
+# bytes of the request bodies read in memory (the JSON ones), of the bodies
+# streamed (the NDJSON ones of the bulk sign-up) and of their lines
+API_MAX_BODY_SIZE = int(os.environ.get('API_MAX_BODY_SIZE', 2 * 1024 * 1024))
+API_MAX_STREAM_SIZE = int(os.environ.get('API_MAX_STREAM_SIZE', 100 * 1024 * 1024))
+API_MAX_LINE_SIZE = int(os.environ.get('API_MAX_LINE_SIZE', 64 * 1024))
+DATA_UPLOAD_MAX_MEMORY_SIZE = API_MAX_BODY_SIZE
+
+# users of a bulk sign-up hashed and saved at once, and at most in a request
+BULK_SIGNUP_CHUNK_SIZE = int(os.environ.get('BULK_SIGNUP_CHUNK_SIZE', 500))
+BULK_SIGNUP_MAX_ITEMS = int(os.environ.get('BULK_SIGNUP_MAX_ITEMS', 1000))
+# key the bulk sign-ups are sent with, as `Authorization: Bearer <key>`,
+# empty to disable the endpoint
+BULK_SIGNUP_API_KEY = os.environ.get('BULK_SIGNUP_API_KEY', '')
+
+# outcomes of the password checks reused for the activation retries with the
+# same credentials, 0 to disable
+CREDENTIAL_CACHE_SIZE = int(os.environ.get('CREDENTIAL_CACHE_SIZE', 1024))
+CREDENTIAL_CACHE_TTL = float(os.environ.get('CREDENTIAL_CACHE_TTL', 30))
+
+# throttling of the API clients, see src/api/throttling.py: requests per
+# client IP, sign-ups per email and failed activations per email, as
+# `<number>/<period>` with a period in s, m, h or d (e.g. `10/5m`), empty to
+# disable
+API_THROTTLE_IP_RATE = os.environ.get('API_THROTTLE_IP_RATE', '600/m')
+API_THROTTLE_SIGNUP_RATE = os.environ.get('API_THROTTLE_SIGNUP_RATE', '5/10m')
+API_THROTTLE_ACTIVATION_RATE = os.environ.get('API_THROTTLE_ACTIVATION_RATE', '10/10m')
+# users of the bulk sign-ups per client IP, whose requests count once for
+# API_THROTTLE_IP_RATE: at least BULK_SIGNUP_MAX_ITEMS for a full request
+API_THROTTLE_BULK_RATE = os.environ.get('API_THROTTLE_BULK_RATE', '10000/h')
+# `local` for counters in the process, or the alias of one of the CACHES to
+# share them between the processes
+API_THROTTLE_BACKEND = os.environ.get('API_THROTTLE_BACKEND', 'local')
+# clients counted by the local backend
+API_THROTTLE_SIZE = int(os.environ.get('API_THROTTLE_SIZE', 100000))
+# variable of the client address, e.g. HTTP_X_FORWARDED_FOR behind a proxy
+API_THROTTLE_IP_HEADER = os.environ.get('API_THROTTLE_IP_HEADER', 'REMOTE_ADDR')
+
+# cache of get_api_user: `local` for an in-process LRU, the alias of one of
+# the CACHES to share it between the processes, or empty to disable
+API_USER_CACHE_BACKEND = os.environ.get('API_USER_CACHE_BACKEND', 'local')
+API_USER_CACHE_SIZE = int(os.environ.get('API_USER_CACHE_SIZE', 10000))
+# seconds a user is cached, how long another process may serve it after a write
+# with the local backend
+API_USER_CACHE_TTL = float(os.environ.get('API_USER_CACHE_TTL', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -135,6 +235,57 @@ EMAIL_HOST = os.environ['EMAIL_HOST']
 EMAIL_PORT = os.environ['EMAIL_PORT']
 DEFAULT_FROM_EMAIL = 'example.com'
 
+# outbox of the activation emails, see src/api/outbox.py
+# worker threads started in each web process, 0 to only send the emails with
+# the `send_activation_emails` management command
+EMAIL_OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS', 0))
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 50))
+# the emails are sent in batches of EMAIL_OUTBOX_BATCH_SIZE, or every
+# EMAIL_OUTBOX_FLUSH_INTERVAL seconds when there are less of them
+EMAIL_OUTBOX_FLUSH_INTERVAL = float(os.environ.get('EMAIL_OUTBOX_FLUSH_INTERVAL', 1))
+# seconds the SMTP connection of a worker stays open without emails to send
+EMAIL_SMTP_KEEPALIVE = float(os.environ.get('EMAIL_SMTP_KEEPALIVE', 30))
+# seconds between two throughput reports of a worker
+EMAIL_OUTBOX_REPORT_INTERVAL = float(os.environ.get('EMAIL_OUTBOX_REPORT_INTERVAL', 60))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+# the n-th retry waits EMAIL_OUTBOX_RETRY_BACKOFF * 2 ** (n - 1) seconds, at most
+# EMAIL_OUTBOX_MAX_RETRY_DELAY
+EMAIL_OUTBOX_RETRY_BACKOFF = float(os.environ.get('EMAIL_OUTBOX_RETRY_BACKOFF', 2))
+EMAIL_OUTBOX_MAX_RETRY_DELAY = float(os.environ.get('EMAIL_OUTBOX_MAX_RETRY_DELAY', 30))
+# seconds after which a claimed email is claimed again, if its worker died
+EMAIL_OUTBOX_LEASE = float(os.environ.get('EMAIL_OUTBOX_LEASE', 60))
+# the activation tokens expire after a minute, older emails are not sent
+EMAIL_OUTBOX_MAX_AGE = float(os.environ.get('EMAIL_OUTBOX_MAX_AGE', 60))
+
+
+# partitioned layout of api_apiuser, see src/api/partitions.py: `day`, `week`
+# or `month` partitions, once converted with `partition_users --convert`, and
+# partitions created in advance
+API_USER_PARTITIONS = os.environ.get('API_USER_PARTITIONS', '')
+API_USER_PARTITIONS_AHEAD = int(os.environ.get('API_USER_PARTITIONS_AHEAD', 3))
+
+# purge of the users not activated, see src/api/reaper.py: seconds after
+# their last token was sent, users deleted per batch, and seconds between two
+# purges by a thread of each web process, 0 to only purge them with the
+# `reap_users` management command
+USER_REAPER_RETENTION = float(os.environ.get('USER_REAPER_RETENTION', 60))
+USER_REAPER_BATCH_SIZE = int(os.environ.get('USER_REAPER_BATCH_SIZE', 1000))
+USER_REAPER_INTERVAL = float(os.environ.get('USER_REAPER_INTERVAL', 0))
+
+# error reporting, see src/api/errors.py: server errors logged with their
+# traceback per minute, and fraction of the client errors logged: 1% by
+# default, since a log line per 4xx slows them down (415s at 8.7k req/s
+# logging them all, 13.6k logging 1%); 1 to debug a client, at that cost
+ERROR_TRACEBACKS_PER_MINUTE = int(os.environ.get('ERROR_TRACEBACKS_PER_MINUTE', 10))
+ERROR_REPORT_SAMPLE_RATE = float(os.environ.get('ERROR_REPORT_SAMPLE_RATE', 0.01))
+
+
+# LOG_LEVEL is the level of the root logger, LOG_LEVELS the ones of other
+# loggers, e.g. "src.api.views=DEBUG,django.db.backends=WARNING". The records
+# are written by a thread, as JSON lines with LOG_FORMAT=json.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = parse_levels(os.environ.get('LOG_LEVELS', ''))
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
 
 LOGGING = {
     'version': 1,
@@ -144,6 +295,9 @@ LOGGING = {
             'format': '[%(asctime)s] %(name)s (%(levelname)s) %(message)s',
             'datefmt': '%Y-%m-%d %H:%M:%S'
         },
+        'json': {
+            '()': 'src.api.logs.JsonFormatter',
+        },
     },
     'handlers': {
         'null': {
@@ -152,14 +306,15 @@ LOGGING = {
         },
         'console': {
             'level': 'DEBUG',
-            'formatter': 'console',
-            'class': 'logging.StreamHandler',
+            'formatter': LOG_FORMAT,
+            'class': 'src.api.logs.QueueHandler',
         }
     },
     'root': {
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
         'handlers': ['console'],
-    }
+    },
+    'loggers': LOG_LEVELS,
 }
 
 DEFAULT_URL = 'localhost:8000'
\ No newline at end of file
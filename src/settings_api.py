@@ -0,0 +1,32 @@
+"""
+Settings of the API only deployments, e.g.
+
+    DJANGO_SETTINGS_MODULE=src.settings_api gunicorn src.wsgi:application
+
+The same as src/settings.py, without the admin and the apps and middleware
+it needs, which the JSON endpoints don't use: the sessions, the messages,
+the authentication of the users of the admin, CSRF (the API views are csrf
+exempt) and the static files. The requests skip their middleware, and the
+processes start without loading them.
+
+The admin, and the staff only /profiles, are served by a deployment with
+src.settings, e.g. on an internal host. Run the migrations with it too,
+this one doesn't know the tables of the admin.
+"""
+from src.settings import *  # noqa: F401,F403
+
+
+INSTALLED_APPS = [
+    'src.api',
+]
+
+MIDDLEWARE = [
+    'src.api.metrics.MetricsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'src.api.throttling.ThrottleMiddleware',
+    'src.api.routing.ReadYourWritesMiddleware',
+]
+
+ROOT_URLCONF = 'src.urls_api'
+
+TEMPLATES = []
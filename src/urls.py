@@ -14,11 +14,12 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.urls import path
-from src.api.views import SignupView, ActivateView
+from src.api.profiling import profiles_view
+from src import urls_api
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path(r'api/v1/sign_up/', SignupView.as_view(), name='api.sign_up'),
-    path(r'api/v1/activate/', ActivateView.as_view(), name='api.activate')
-]
+    path('profiles', staff_member_required(profiles_view), name='profiles'),
+] + urls_api.urlpatterns
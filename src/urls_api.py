@@ -0,0 +1,21 @@
+"""URL configuration of the API, the ROOT_URLCONF of the API only
+deployments (see src/settings_api.py), included by src/urls.py"""
+from django.conf import settings
+from django.urls import path
+from src.api.metrics import metrics_view
+from src.api.views import (
+    SignupView, BulkSignupView, ActivateView, AsyncSignupView, AsyncBulkSignupView, AsyncActivateView
+)
+
+if settings.API_ASYNC_VIEWS:
+    signup_view, bulk_view, activate_view = (
+        AsyncSignupView.as_view(), AsyncBulkSignupView.as_view(), AsyncActivateView.as_view())
+else:
+    signup_view, bulk_view, activate_view = SignupView.as_view(), BulkSignupView.as_view(), ActivateView.as_view()
+
+urlpatterns = [
+    path(r'api/v1/sign_up/', signup_view, name='api.sign_up'),
+    path(r'api/v1/sign_up/bulk/', bulk_view, name='api.sign_up_bulk'),
+    path(r'api/v1/activate/', activate_view, name='api.activate'),
+    path('metrics', metrics_view, name='metrics'),
+]
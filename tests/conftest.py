@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def reset_throttles():
+    """The throttles would count the requests of all the tests, sent from the
+    same address and often for the same emails"""
+    from src.api.throttling import get_throttler
+    get_throttler().backend.clear()
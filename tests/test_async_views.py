@@ -0,0 +1,187 @@
+import asyncio
+import base64
+import json
+from unittest.mock import patch
+
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.test import TestCase, AsyncRequestFactory, RequestFactory
+
+from src.api import views
+from src.api.decorators import jsonify
+from src.api.pool import AsyncConnectionPool, PoolTimeout, wait
+from src.api.utils import delete_api_user, aget_api_user
+from src.api.views import ActivateView, AsyncSignupView, AsyncActivateView
+
+
+def make_pool(**kwargs):
+    return AsyncConnectionPool(
+        host=settings.DB_DEFAULT_HOST,
+        database=settings.DB_DEFAULT_NAME,
+        user=settings.DB_DEFAULT_USER,
+        password=settings.DB_DEFAULT_PASSWORD,
+        **kwargs
+    )
+
+
+class TestAsyncViews(TestCase):
+    email = "async@bar.com"
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    def tearDown(self):
+        delete_api_user(email=self.email)
+
+    def test_views_are_coroutine_functions(self):
+        assert asyncio.iscoroutinefunction(AsyncSignupView.as_view())
+        assert asyncio.iscoroutinefunction(AsyncActivateView.as_view())
+        assert AsyncSignupView.as_view().csrf_exempt
+
+    async def test_not_accepted_method(self):
+        response = await AsyncSignupView.as_view()(self.factory.get('/api/v1/sign_up/'))
+        assert response.status_code == 405
+        assert response['Allow'] == 'POST'
+
+    async def test_invalid_content_type(self):
+        request = self.factory.post('/api/v1/sign_up/', data='foo', content_type='text/plain')
+        response = await AsyncSignupView.as_view()(request)
+        assert response.status_code == 415
+
+    async def test_sign_up_and_activate(self):
+        request = self.factory.post(
+            '/api/v1/sign_up/',
+            data={"email": self.email, "password": "baz"},
+            content_type='application/json'
+        )
+        response = await AsyncSignupView.as_view()(request)
+        assert response.status_code == 201
+        token = json.loads(response.content)['token']
+        assert (await aget_api_user(self.email))[0][3] == token
+
+        credentials = base64.b64encode(f'{self.email}:baz'.encode()).decode()
+        request = self.factory.patch(
+            '/api/v1/activate/',
+            data={"token": token},
+            content_type='application/json',
+            authorization=f'Basic {credentials}'
+        )
+        response = await AsyncActivateView.as_view()(request)
+        assert response.status_code == 200
+        assert json.loads(response.content)['message'] == f"User {self.email} has been activated."
+        assert (await aget_api_user(self.email))[0][4] is True
+
+    async def test_wrong_password(self):
+        request = self.factory.post(
+            '/api/v1/sign_up/',
+            data={"email": self.email, "password": "baz"},
+            content_type='application/json'
+        )
+        await AsyncSignupView.as_view()(request)
+        credentials = base64.b64encode(f'{self.email}:spam'.encode()).decode()
+        request = self.factory.patch(
+            '/api/v1/activate/',
+            data={"token": "abcd"},
+            content_type='application/json',
+            authorization=f'Basic {credentials}'
+        )
+        response = await AsyncActivateView.as_view()(request)
+        assert response.status_code == 401
+
+    async def test_same_responses_as_sync_views(self):
+        request = self.factory.post(
+            '/api/v1/sign_up/',
+            data={"email": self.email, "password": "baz"},
+            content_type='application/json'
+        )
+        token = json.loads((await AsyncSignupView.as_view()(request)).content)['token']
+        credentials = base64.b64encode(f'{self.email}:baz'.encode()).decode()
+
+        async def activate(view, token):
+            if view is ActivateView:
+                request = RequestFactory().patch('/api/v1/activate/', data={"token": token},
+                                                 content_type='application/json',
+                                                 HTTP_AUTHORIZATION=f'Basic {credentials}')
+                response = await sync_to_async(view.as_view())(request)
+            else:
+                request = self.factory.patch('/api/v1/activate/', data={"token": token},
+                                             content_type='application/json', authorization=f'Basic {credentials}')
+                response = await view.as_view()(request)
+            return response.status_code, json.loads(response.content)
+
+        sync_response = await activate(ActivateView, 'efgh')
+        assert sync_response[0] == 403
+        assert await activate(AsyncActivateView, 'efgh') == sync_response
+
+        with patch.object(views, 'activate_user', side_effect=Exception('down')), \
+                patch.object(views, 'aactivate_user', side_effect=Exception('down')):
+            sync_response = await activate(ActivateView, token)
+            assert sync_response == (500, {'errors': 'Activation failed because down'})
+            assert await activate(AsyncActivateView, token) == sync_response
+
+    async def test_async_jsonify_errors(self):
+        @jsonify
+        async def raises_exception(*args, **kwargs):
+            raise Exception()
+
+        response = await raises_exception()
+        assert response.status_code == 500
+        assert json.loads(response.content) == {"errors": ["Internal server error"]}
+
+
+class TestAsyncConnectionPool(TestCase):
+
+    async def test_connection_reused(self):
+        pool = make_pool(max_size=2)
+        try:
+            async with pool.connection() as conn:
+                first = conn
+            async with pool.connection() as conn:
+                assert conn is first
+            assert pool.stats()['connects'] == 1
+        finally:
+            pool.close()
+
+    async def test_concurrent_queries(self):
+        pool = make_pool(max_size=5)
+
+        async def query(i):
+            async with pool.connection() as conn:
+                cur = conn.cursor()
+                cur.execute('select %s from pg_sleep(0.05)', [i])
+                await wait(conn)
+                return cur.fetchone()[0]
+
+        try:
+            assert await asyncio.gather(*[query(i) for i in range(10)]) == list(range(10))
+            stats = pool.stats()
+            assert stats['size'] == 5
+            assert stats['waits'] > 0
+        finally:
+            pool.close()
+
+    async def test_timeout_when_exhausted(self):
+        pool = make_pool(max_size=1, timeout=0.05)
+        try:
+            async with pool.connection():
+                with self.assertRaises(PoolTimeout):
+                    await pool.getconn()
+        finally:
+            pool.close()
+
+    async def test_cancelled_query_discards_connection(self):
+        pool = make_pool(max_size=1)
+
+        async def sleep():
+            async with pool.connection() as conn:
+                conn.cursor().execute('select pg_sleep(1)')
+                await wait(conn)
+
+        try:
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(sleep(), 0.05)
+            stats = pool.stats()
+            assert stats['discarded'] == 1
+            assert stats['size'] == 0
+        finally:
+            pool.close()
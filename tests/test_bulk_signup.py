@@ -0,0 +1,166 @@
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password
+from django.urls import reverse
+from django.test import AsyncRequestFactory, TestCase, Client, override_settings
+
+from src.api import bulk
+from src.api.utils import delete_api_user, execute_select_statement, get_api_user, signup_api_user
+from src.api.views import AsyncBulkSignupView, AsyncSignupView
+
+
+@override_settings(BULK_SIGNUP_API_KEY='secret')
+class TestBulkSignUp(TestCase):
+    emails = ['bulk-1@bar.com', 'bulk-2@bar.com', 'bulk-3@bar.com']
+
+    def setUp(self):
+        self.url = reverse('api.sign_up_bulk')
+        self.client = Client(HTTP_AUTHORIZATION='Bearer secret')
+
+    def tearDown(self):
+        for email in self.emails:
+            delete_api_user(email=email)
+
+    def results(self, response):
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/x-ndjson'
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_json_array(self):
+        signup_api_user(self.emails[1], 'baz', 'abcd')
+        response = self.client.post(self.url, content_type='application/json', data=[
+            {'email': self.emails[0], 'password': 'foo'},
+            {'email': self.emails[1].upper(), 'password': 'foo'},
+            {'email': self.emails[0], 'password': 'foo'},
+            {'email': 'bulk-4@bar.com'},
+        ])
+        results = self.results(response)
+        assert [(r['index'], r['status']) for r in results] == [
+            (0, 'created'), (1, 'exists'), (2, 'duplicate'), (3, 'invalid')]
+
+        user = get_api_user(self.emails[0])[0]
+        assert user[3] == results[0]['token']
+        assert check_password('foo', user[2])
+        # the password of an existing user is left unchanged
+        user = get_api_user(self.emails[1])[0]
+        assert user[3] == results[1]['token']
+        assert check_password('baz', user[2])
+
+        emails = execute_select_statement(
+            "select recipient, body from api_outboxemail where recipient = any(%s) and status='pending'",
+            [self.emails])
+        assert sorted(emails) == sorted([
+            (self.emails[0], f"Use {results[0]['token']} to activate your account. The code is valid for one minute."),
+            (self.emails[1], f"Use abcd to activate your account. The code is valid for one minute."),
+            (self.emails[1], f"Use {results[1]['token']} to activate your account. The code is valid for one minute."),
+        ])
+
+    def test_ndjson(self):
+        body = '\n'.join([
+            json.dumps({'email': self.emails[0], 'password': 'foo'}),
+            '{"email": ',
+            '',
+            json.dumps({'email': self.emails[2], 'password': 'foo'}),
+        ])
+        response = self.client.post(self.url, data=body, content_type='application/x-ndjson')
+        results = self.results(response)
+        assert [(r['index'], r['status']) for r in results] == [(0, 'created'), (1, 'invalid'), (2, 'created')]
+        assert results[1]['errors'] == 'The line is not valid JSON.'
+
+    def test_not_an_array(self):
+        response = self.client.post(self.url, data={'email': self.emails[0]}, content_type='application/json')
+        assert response.status_code == 403
+
+    def test_ndjson_too_large(self):
+        body = json.dumps({'email': self.emails[0], 'password': 'foo'}) + '\n'
+        with override_settings(API_MAX_STREAM_SIZE=len(body)):
+            response = self.client.post(self.url, data=body * 2, content_type='application/x-ndjson')
+        assert response.status_code == 413
+
+    def test_invalid_content_type(self):
+        response = self.client.post(self.url, data='foo', content_type='text/plain')
+        assert response.status_code == 415
+
+    def test_chunks_and_max_items(self):
+        items = [{'email': email, 'password': 'foo'} for email in self.emails]
+        results = list(bulk.sign_up(items, chunk_size=2, max_items=2))
+        assert [(r['index'], r['status']) for r in results] == [(0, 'created'), (1, 'created'), (2, 'invalid')]
+        assert get_api_user(self.emails[2]) == []
+
+    def test_emails_not_saved_with_the_others(self):
+        items = [{'email': self.emails[0], 'password': 'foo'},
+                 {'email': 'bulk-' + 'x' * 50 + '@bar.com', 'password': 'foo'},
+                 {'email': 'bulk-\x00@bar.com', 'password': 'foo'},
+                 {'email': self.emails[1], 'password': 'foo'}]
+        results = list(bulk.sign_up(items))
+        assert [r['status'] for r in results] == ['created', 'invalid', 'invalid', 'created']
+        assert get_api_user(self.emails[0])[0][3] == results[0]['token']
+        assert get_api_user(self.emails[1])[0][3] == results[3]['token']
+
+    def test_api_key(self):
+        body = [{'email': self.emails[0], 'password': 'foo'}]
+        response = Client().post(self.url, data=body, content_type='application/json')
+        assert response.status_code == 401
+        assert response['WWW-Authenticate'] == 'Bearer realm="src.api"'
+        response = Client(HTTP_AUTHORIZATION='Bearer guess').post(self.url, data=body,
+                                                                   content_type='application/json')
+        assert response.status_code == 401
+        with override_settings(BULK_SIGNUP_API_KEY=''):
+            response = self.client.post(self.url, data=body, content_type='application/json')
+            assert response.status_code == 404
+        assert get_api_user(self.emails[0]) == []
+
+
+@override_settings(BULK_SIGNUP_API_KEY='secret')
+class TestAsyncBulkSignUp(TestCase):
+    emails = ['async-bulk-1@bar.com', 'async-bulk-2@bar.com']
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    def tearDown(self):
+        for email in self.emails:
+            delete_api_user(email=email)
+
+    def bulk_request(self, items):
+        return self.factory.post('/api/v1/sign_up/bulk/', data=items, content_type='application/json',
+                                 authorization='Bearer secret')
+
+    async def test_sign_up(self):
+        request = self.bulk_request([{'email': self.emails[0], 'password': 'foo'}])
+        response = await AsyncBulkSignupView.as_view()(request)
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/x-ndjson'
+        assert [json.loads(line)['status'] for line in response.content.splitlines()] == ['created']
+
+    async def test_concurrent_sign_up_not_blocked(self):
+        finished = {}
+
+        def slow_sign_up(items, *args, **kwargs):
+            time.sleep(0.5)
+            yield {'index': 0, 'status': 'error', 'errors': 'slow'}
+
+        async def bulk_sign_up():
+            response = await AsyncBulkSignupView.as_view()(self.bulk_request([{}]))
+            finished['bulk'] = time.monotonic()
+            return response
+
+        async def sign_up():
+            await asyncio.sleep(0.05)
+            # like request_started, sent by Django in its thread of the sync code
+            await sync_to_async(lambda: None, thread_sensitive=True)()
+            request = self.factory.post('/api/v1/sign_up/', data={'email': self.emails[1], 'password': 'foo'},
+                                        content_type='application/json')
+            response = await AsyncSignupView.as_view()(request)
+            finished['sign_up'] = time.monotonic()
+            return response
+
+        with patch.object(bulk, 'sign_up', slow_sign_up):
+            bulk_response, response = await asyncio.gather(bulk_sign_up(), sign_up())
+        assert bulk_response.status_code == 200
+        assert response.status_code == 201
+        assert finished['sign_up'] < finished['bulk']
@@ -0,0 +1,270 @@
+import asyncio
+import threading
+import time
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.test import TestCase
+
+from src.api.cache import (
+    CredentialCache,
+    DjangoCacheBackend,
+    LocalBackend,
+    LRUCache,
+    ReadThroughCache,
+    get_credential_cache,
+    get_user_cache
+)
+from src.api.utils import (
+    activate_user,
+    aget_api_user,
+    delete_api_user,
+    execute_insert_update_statement,
+    get_api_user,
+    save_token,
+    signup_api_user
+)
+
+
+class TestLRUCache(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1 and cache.get('c') == 3
+        assert cache.stats()['evictions'] == 1
+
+    def test_entries_expire(self):
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        assert cache.get('a', 'expired') == 'expired'
+        assert len(cache) == 0
+        assert cache.stats()['expirations'] == 1
+
+    def test_disabled(self):
+        cache = LRUCache(max_size=0, ttl=60)
+        cache.set('a', 1)
+        assert cache.get('a') is None
+
+
+class TestReadThroughCache(TestCase):
+
+    def test_single_flight(self):
+        cache = ReadThroughCache(LocalBackend(max_size=10, ttl=60))
+        release, loads, results = threading.Event(), [], []
+
+        def load():
+            loads.append(1)
+            release.wait()
+            return ['row']
+
+        threads = [threading.Thread(target=lambda: results.append(cache.get('a', load)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while cache.stats()['coalesced'] < 7:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert results == [['row']] * 8
+        assert len(loads) == 1
+        assert cache.get('a', load) == ['row']
+        stats = cache.stats()
+        assert (stats['misses'], stats['coalesced'], stats['hits']) == (1, 7, 1)
+
+    def test_async_single_flight(self):
+        cache = ReadThroughCache(LocalBackend(max_size=10, ttl=60))
+        loads = []
+
+        async def load():
+            loads.append(1)
+            await asyncio.sleep(0.01)
+            return ['row']
+
+        async def burst():
+            return await asyncio.gather(*[cache.aget('a', load) for _ in range(8)])
+
+        assert asyncio.run(burst()) == [['row']] * 8
+        assert len(loads) == 1
+
+    def test_async_leader_cancelled(self):
+        cache = ReadThroughCache(LocalBackend(max_size=10, ttl=60))
+        loads = []
+
+        async def load():
+            loads.append(1)
+            await asyncio.sleep(0.05)
+            return ['row']
+
+        async def main():
+            leader = asyncio.ensure_future(cache.aget('a', load))
+            await asyncio.sleep(0)
+            readers = asyncio.gather(*[cache.aget('a', load) for _ in range(3)])
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            # the other readers load it again, once
+            return await readers
+
+        assert asyncio.run(main()) == [['row']] * 3
+        assert len(loads) == 2
+
+    def test_async_django_cache_backend_off_the_loop(self):
+        cache = ReadThroughCache(DjangoCacheBackend('default', ttl=60, prefix='test:'))
+        self.addCleanup(cache.clear)
+        threads = []
+        get = cache.backend.get
+
+        def backend_get(*args):
+            threads.append(threading.get_ident())
+            return get(*args)
+
+        async def load():
+            return ['row']
+
+        async def main():
+            await cache.aget('b', load)
+            await cache.ainvalidate('b')
+            return threading.get_ident()
+
+        with patch.object(cache.backend, 'get', backend_get):
+            loop_thread = asyncio.run(main())
+        assert threads and loop_thread not in threads
+        assert cache.get('b', lambda: ['new row']) == ['new row']
+
+    def test_load_errors_are_not_cached(self):
+        cache = ReadThroughCache(LocalBackend(max_size=10, ttl=60))
+
+        def load():
+            raise ValueError('down')
+
+        with self.assertRaises(ValueError):
+            cache.get('a', load)
+        assert cache.get('a', lambda: ['row']) == ['row']
+
+    def test_invalidated_while_loading(self):
+        cache = ReadThroughCache(LocalBackend(max_size=10, ttl=60))
+
+        def load():
+            cache.invalidate('a')
+            return ['old row']
+
+        assert cache.get('a', load) == ['old row']
+        assert cache.get('a', lambda: ['new row']) == ['new row']
+
+    def test_django_cache_backend(self):
+        cache = ReadThroughCache(DjangoCacheBackend('default', ttl=60, prefix='test:'))
+        assert cache.get('a', lambda: []) == []
+        assert cache.get('a', lambda: ['row']) == []
+        cache.invalidate('a')
+        assert cache.get('a', lambda: ['row']) == ['row']
+
+
+class TestCredentialCache(TestCase):
+    encoded = make_password('baz')
+
+    def test_hits_on_same_credentials(self):
+        cache = CredentialCache(max_size=10, ttl=60)
+        assert cache.verify('Foo@bar.com', 'baz', self.encoded)
+        assert cache.verify('foo@bar.com', 'baz', self.encoded)
+        assert not cache.verify('foo@bar.com', 'qux', self.encoded)
+        assert not asyncio.run(cache.averify('foo@bar.com', 'qux', self.encoded))
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses']) == (2, 2)
+
+    def test_misses_when_password_hash_changed(self):
+        cache = CredentialCache(max_size=10, ttl=60)
+        assert cache.verify('foo@bar.com', 'baz', self.encoded)
+        assert not cache.verify('foo@bar.com', 'baz', make_password('qux'))
+        assert cache.stats()['hits'] == 0
+
+    def test_invalidate(self):
+        cache = CredentialCache(max_size=10, ttl=60)
+        cache.verify('foo@bar.com', 'baz', self.encoded)
+        cache.invalidate('FOO@bar.com')
+        cache.verify('foo@bar.com', 'baz', self.encoded)
+        assert cache.stats()['misses'] == 2
+
+
+class TestCredentialCacheInvalidation(TestCase):
+    email = 'cached@bar.com'
+
+    def setUp(self):
+        signup_api_user(self.email, 'baz', 'abcd')
+        self.api_user = get_api_user(self.email)[0]
+        self.cache = get_credential_cache()
+
+    def tearDown(self):
+        delete_api_user(email=self.email)
+
+    def assert_invalidated_by(self, write):
+        assert self.cache.verify(self.email, 'baz', self.api_user[2])
+        hits = self.cache.stats()['hits']
+        assert self.cache.verify(self.email, 'baz', self.api_user[2])
+        assert self.cache.stats()['hits'] == hits + 1
+        write()
+        misses = self.cache.stats()['misses']
+        assert self.cache.verify(self.email, 'baz', self.api_user[2])
+        assert self.cache.stats()['misses'] == misses + 1
+
+    def test_save_token(self):
+        self.assert_invalidated_by(lambda: save_token(self.email, 'efgh'))
+
+    def test_activate_user(self):
+        self.assert_invalidated_by(lambda: activate_user(api_user_id=self.api_user[0],
+                                                                 created_at=self.api_user[6]))
+
+    def test_delete_api_user(self):
+        self.assert_invalidated_by(lambda: delete_api_user(self.email.upper()))
+
+
+@skipUnless(settings.API_USER_CACHE_BACKEND, 'API_USER_CACHE_BACKEND is disabled')
+class TestUserCacheInvalidation(TestCase):
+    email = 'cached-user@bar.com'
+
+    def tearDown(self):
+        delete_api_user(email=self.email)
+
+    def test_writes_invalidate(self):
+        user_cache = get_user_cache()
+        assert get_api_user(self.email) == []
+        signup_api_user(self.email, 'baz', 'abcd')
+        assert get_api_user(self.email.upper())[0][3] == 'abcd'
+        hits = user_cache.stats()['hits']
+        get_api_user(self.email)
+        assert user_cache.stats()['hits'] == hits + 1
+
+        save_token(self.email, 'efgh')
+        assert get_api_user(self.email)[0][3] == 'efgh'
+        api_user = get_api_user(self.email)[0]
+        activate_user(api_user_id=api_user[0], created_at=api_user[6])
+        assert get_api_user(self.email)[0][4] is True
+        delete_api_user(self.email)
+        assert get_api_user(self.email) == []
+
+    def test_writes_of_other_processes(self):
+        # written by another process, which invalidates its own cache only
+        def other_process(query, params):
+            execute_insert_update_statement(query, params)
+
+        assert get_api_user(self.email) == []
+        other_process("insert into api_apiuser (email, password, token, activated, token_sent_at, created_at) "
+                      "values (%s, 'x', 'abcd', false, now(), now())", [self.email])
+        # the missing users are not cached
+        assert get_api_user(self.email)[0][3] == 'abcd'
+
+        other_process("update api_apiuser set token='efgh' where email=%s", [self.email])
+        assert get_api_user(self.email)[0][3] == 'abcd'
+        # read again for an activation with another token
+        assert get_api_user(self.email, token='efgh')[0][3] == 'efgh'
+        assert get_api_user(self.email)[0][3] == 'efgh'
+        other_process("update api_apiuser set token='ijkl' where email=%s", [self.email])
+        assert asyncio.run(aget_api_user(self.email, token='ijkl'))[0][3] == 'ijkl'
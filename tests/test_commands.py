@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+import os
+import tempfile
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management import call_command
+from django.test import TestCase
+
+from src.api.utils import delete_api_user, get_api_user, signup_api_user
+
+
+class TestExportImportUsers(TestCase):
+    emails = ['copy-1@bar.com', 'copy-2@bar.com', 'copy-3@bar.com', 'copy-4@bar.com']
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        for email in self.emails:
+            delete_api_user(email=email)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def call(self, *args):
+        stdout = io.StringIO()
+        call_command(*args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_export(self):
+        signup_api_user(self.emails[0], 'foo', 'abcd')
+        signup_api_user(self.emails[1], 'bar\\"baz', 'efgh')
+
+        self.call('export_users', self.path('users.csv'))
+        with open(self.path('users.csv'), newline='') as file:
+            users = {user['email']: user for user in csv.DictReader(file)}
+        assert users[self.emails[0]]['token'] == 'abcd'
+        assert users[self.emails[0]]['activated'] == 'f'
+        assert check_password('foo', users[self.emails[0]]['password'])
+
+        output = self.call('export_users', self.path('users.ndjson'))
+        assert output.startswith('Exported ')
+        with open(self.path('users.ndjson')) as file:
+            users = {user['email']: user for user in map(json.loads, file)}
+        assert users[self.emails[1]]['token'] == 'efgh'
+        assert users[self.emails[1]]['activated'] is False
+        assert check_password('bar\\"baz', users[self.emails[1]]['password'])
+
+    def test_import(self):
+        signup_api_user(self.emails[0], 'foo', 'abcd')
+        hashed_password = make_password('bar')
+        with open(self.path('users.ndjson'), 'w') as file:
+            for user in [
+                {'email': self.emails[0].upper(), 'password': 'new'},
+                {'email': self.emails[1], 'password': hashed_password, 'activated': True, 'token': 'efgh'},
+                {'email': self.emails[2], 'password': 'baz'},
+                {'email': self.emails[2].upper(), 'password': 'other'},
+                {'email': self.emails[3]},
+            ]:
+                file.write(json.dumps(user) + '\n')
+
+        output = self.call('import_users', self.path('users.ndjson'), '--chunk-size', '2')
+        assert output.splitlines()[-1].startswith('Imported 5 users in ')
+        assert ('2 created, 0 replaced, 1 existing left unchanged, 1 duplicates, 1 invalid, '
+                '3 plaintext passwords hashed.') in output
+
+        assert check_password('foo', get_api_user(self.emails[0])[0][2])
+        user = get_api_user(self.emails[1])[0]
+        assert user[2] == hashed_password
+        assert user[3:5] == ('efgh', True)
+        user = get_api_user(self.emails[2])[0]
+        assert user[1] == self.emails[2]
+        assert check_password('baz', user[2])
+        assert get_api_user(self.emails[3]) == []
+
+        self.call('import_users', self.path('users.ndjson'), '--replace')
+        assert check_password('new', get_api_user(self.emails[0])[0][2])
+
+    def test_export_import(self):
+        signup_api_user(self.emails[0], 'foo', 'abcd')
+        self.call('export_users', self.path('users.csv'))
+        user = get_api_user(self.emails[0])[0]
+        delete_api_user(self.emails[0])
+
+        output = self.call('import_users', self.path('users.csv'))
+        assert '0 plaintext passwords hashed' in output
+        assert get_api_user(self.emails[0])[0][1:] == user[1:]
@@ -1,8 +1,10 @@
+import asyncio
 import json
 
-from django.test import TestCase
+from django.test import TestCase, RequestFactory
 
-from src.api.decorators import jsonify
+from src.api.decorators import jsonify, user_api
+from src.api.serializers import JsonSerializer, OrjsonSerializer, orjson
 
 
 @jsonify
@@ -53,3 +55,72 @@ class TestJsonify(TestCase):
         self.assertEqual(response.status_code, 500)
         response_dict = json.loads(response.content)
         self.assertEqual(response_dict, {"errors": ["Internal server error"]})
+
+
+class TestRestrictContentType(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_body_parsed_once(self):
+        @user_api(['POST'])
+        def view(request):
+            return {'content': request.json}
+
+        request = self.factory.post('/', data={'email': 'foo'}, content_type='application/json')
+        response = view(request)
+        assert json.loads(response.content) == {'content': {'email': 'foo'}}
+
+    def test_invalid_json(self):
+        @user_api(['POST'])
+        def view(request):
+            return {}
+
+        request = self.factory.post('/', data='{"email', content_type='application/json')
+        response = view(request)
+        assert response.status_code == 403
+        assert json.loads(response.content) == {'errors': 'The request body is not valid JSON.'}
+
+
+class TestSerializers(TestCase):
+
+    def test_same_output(self):
+        content = {'message': 'Activation mail sent to foo@bar.com.', 'token': 'abcd', 'ids': [1, None]}
+        encoded = JsonSerializer().dumps(content)
+        assert encoded == b'{"message":"Activation mail sent to foo@bar.com.","token":"abcd","ids":[1,null]}'
+        if orjson is not None:
+            assert OrjsonSerializer().dumps(content) == encoded
+            assert OrjsonSerializer().loads(encoded) == content
+        assert JsonSerializer().loads(encoded) == content
+
+    def test_default_error_bodies_encoded_once(self):
+        request = RequestFactory().get('/')
+        view = user_api(['POST'])(dummy_view)
+        first, second = view(request), view(request)
+        assert first.status_code == 405
+        assert json.loads(first.content) == {'errors': 'Method not allowed'}
+        assert first.content is second.content
+
+
+class TestUserApi(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_method_not_allowed(self):
+        view = user_api(['POST', 'PATCH'])(dummy_view)
+        response = view(self.factory.get('/'))
+        assert response.status_code == 405
+        assert response['Allow'] == 'POST, PATCH'
+        # the responses are not shared between the requests
+        assert view(self.factory.get('/')) is not response
+
+    def test_class_views(self):
+        from src.api.views import ActivateView, AsyncSignupView, BulkSignupView
+        view = ActivateView.as_view()
+        assert view.csrf_exempt and view.view_class is ActivateView
+        assert asyncio.iscoroutinefunction(AsyncSignupView.as_view())
+        request = self.factory.post('/', data='x', content_type='text/plain')
+        assert BulkSignupView.as_view()(request).status_code == 415
+        request = self.factory.get('/')
+        assert view(request)['Allow'] == 'PATCH'
@@ -0,0 +1,65 @@
+import logging
+
+from django.test import TestCase, RequestFactory
+
+from src.api.errors import ErrorReporter
+from src.api.exceptions import Http404Error, Http500Error
+from src.api.ratelimit import TokenBucket
+
+
+class TestErrorReporter(TestCase):
+    logger = 'src.api.errors'
+
+    def setUp(self):
+        self.request = RequestFactory().patch('/api/v1/activate/')
+
+    def test_client_error_compact(self):
+        reporter = ErrorReporter(tracebacks_per_minute=10, sample_rate=1)
+        with self.assertLogs(logger=self.logger, level='INFO') as lg:
+            try:
+                raise Http404Error(message='User foo@bar.com not found.')
+            except Http404Error as ex:
+                reporter.report(ex, self.request)
+        assert lg.output == ['INFO:src.api.errors:404 PATCH /api/v1/activate/: User foo@bar.com not found.']
+        assert lg.records[0].exc_info is None
+        assert reporter.stats()['errors'] == {404: 1}
+
+    def test_client_errors_sampled(self):
+        reporter = ErrorReporter(tracebacks_per_minute=10, sample_rate=0)
+        with self.assertLogs(logger=self.logger, level='INFO') as lg:
+            logging.getLogger(self.logger).info('start')
+            for _ in range(10):
+                reporter.report(Http404Error(), self.request)
+        assert len(lg.output) == 1
+        assert reporter.stats()['errors'] == {404: 10}
+
+    def test_tracebacks_rate_limited(self):
+        reporter = ErrorReporter(tracebacks_per_minute=2, sample_rate=1)
+        with self.assertLogs(logger=self.logger, level='ERROR') as lg:
+            for _ in range(3):
+                try:
+                    raise ValueError('boom')
+                except ValueError as ex:
+                    reporter.report(ex)
+            try:
+                raise Http500Error(message='Failed')
+            except Http500Error as ex:
+                reporter.report(ex)
+        assert [record.exc_info is not None for record in lg.records] == [True, True, False, False]
+        assert lg.output[2] == 'ERROR:src.api.errors:500 -: ValueError: boom (traceback skipped)'
+        assert reporter.stats() == {'errors': {500: 4}, 'tracebacks_skipped': 2}
+
+
+class TestTokenBucket(TestCase):
+
+    def test_consume(self):
+        bucket = TokenBucket(rate=0, capacity=2)
+        assert bucket.consume()
+        assert bucket.consume()
+        assert not bucket.consume()
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=1000, capacity=1)
+        assert bucket.consume()
+        while not bucket.consume():
+            pass
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+from django.contrib.auth.hashers import check_password
+from django.test import TestCase
+
+from src.api.exceptions import Http503Error
+from src.api.hashing import Hasher
+
+
+class TestHasher(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestHasher, cls).setUpClass()
+        cls.hasher = Hasher(workers=1, max_pending=4)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hasher.close()
+        super(TestHasher, cls).tearDownClass()
+
+    def test_make_and_check_password_in_worker(self):
+        encoded = self.hasher.make_password('baz')
+        assert check_password('baz', encoded)
+        assert self.hasher.check_password('baz', encoded)
+        assert not self.hasher.check_password('qux', encoded)
+        stats = self.hasher.stats()
+        assert stats['pending'] == 0
+        assert stats['hashes'] >= 3
+        assert stats['avg_hash_time'] > 0
+
+    def test_async(self):
+        async def hash_and_check():
+            encoded = await self.hasher.amake_password('baz')
+            return await self.hasher.acheck_password('baz', encoded)
+
+        assert asyncio.run(hash_and_check())
+
+    def test_inline(self):
+        hasher = Hasher(workers=0, max_pending=1)
+        encoded = hasher.make_password('baz')
+        assert asyncio.run(hasher.acheck_password('baz', encoded))
+        assert hasher.stats()['hashes'] == 2
+
+    def test_worker_killed(self):
+        hasher = Hasher(workers=1, max_pending=4)
+        self.addCleanup(hasher.close)
+
+        def kill_workers():
+            for process in list(hasher._executor._processes.values()):
+                process.kill()
+
+        encoded = hasher.make_password('baz')
+        kill_workers()
+        assert hasher.check_password('baz', encoded)
+        kill_workers()
+        assert asyncio.run(hasher.acheck_password('baz', encoded))
+        kill_workers()
+        assert len(hasher.make_passwords(['baz', 'qux'])) == 2
+        assert hasher.stats()['restarts'] == 3
+
+    def test_rejects_when_saturated(self):
+        hasher = Hasher(workers=1, max_pending=1)
+        started, results = threading.Event(), []
+
+        def hash_password():
+            started.set()
+            results.append(hasher.make_password('baz'))
+
+        try:
+            thread = threading.Thread(target=hash_password)
+            thread.start()
+            started.wait()
+            while not hasher.stats()['pending']:
+                pass
+            with self.assertRaises(Http503Error) as ctx:
+                hasher.make_password('qux')
+            assert ctx.exception.status_code == 503
+            assert ctx.exception.headers['Retry-After'] == '1'
+            thread.join()
+        finally:
+            hasher.close()
+        assert len(results) == 1
+        stats = hasher.stats()
+        assert stats['rejected'] == 1
+        assert stats['pending'] == 0
@@ -0,0 +1,74 @@
+import io
+import json
+import logging
+import threading
+
+from django.test import TestCase
+
+from src.api.logs import JsonFormatter, QueueHandler, parse_levels
+
+
+class BlockingStream(io.StringIO):
+    """Stream whose writes wait for `released`"""
+
+    def __init__(self):
+        super(BlockingStream, self).__init__()
+        self.released = threading.Event()
+
+    def write(self, data):
+        self.released.wait()
+        return super(BlockingStream, self).write(data)
+
+
+class TestQueueHandler(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('tests.logs')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        self.logger.handlers = []
+        self.logger.propagate = True
+
+    def test_json_lines(self):
+        stream = io.StringIO()
+        handler = QueueHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        self.logger.addHandler(handler)
+        args = ['foo@bar.com']
+        self.logger.info('User with %s has been saved().', args, extra={'request_id': 'abcd'})
+        args.append('changed')
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            self.logger.exception('Failed')
+        handler.close()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert lines[0]['message'] == "User with ['foo@bar.com'] has been saved()."
+        assert lines[0]['level'] == 'INFO'
+        assert lines[0]['logger'] == 'tests.logs'
+        assert lines[0]['request_id'] == 'abcd'
+        assert 'ValueError: boom' in lines[1]['exc_info']
+
+    def test_never_blocks(self):
+        stream = BlockingStream()
+        handler = QueueHandler(stream, maxsize=2)
+        self.logger.addHandler(handler)
+        for i in range(10):
+            self.logger.info('record %s', i)
+        assert handler.dropped >= 7
+        stream.released.set()
+        handler.close()
+        assert 'record 0' in stream.getvalue()
+
+
+class TestParseLevels(TestCase):
+
+    def test_parse_levels(self):
+        assert parse_levels('') == {}
+        assert parse_levels('src.api.views=debug, django.db.backends=WARNING') == {
+            'src.api.views': {'level': 'DEBUG'},
+            'django.db.backends': {'level': 'WARNING'},
+        }
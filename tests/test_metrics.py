@@ -0,0 +1,80 @@
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from src.api import metrics
+from src.api.metrics import Histogram, Registry, span
+from src.api.utils import delete_api_user
+
+
+class TestHistograms(TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        cumulated, total = histogram.snapshot()
+        assert cumulated == [2, 3, 4]
+        assert total == 2.65
+
+    def test_export(self):
+        registry = Registry()
+        registry.observe_span('db', 0.002)
+        registry.observe_request('api.sign_up', 201, 0.3)
+        lines = registry.export().splitlines()
+        assert '# TYPE api_span_duration_seconds histogram' in lines
+        assert 'api_span_duration_seconds_bucket{span="db",le="0.001"} 0' in lines
+        assert 'api_span_duration_seconds_bucket{span="db",le="0.0025"} 1' in lines
+        assert 'api_span_duration_seconds_bucket{span="db",le="+Inf"} 1' in lines
+        assert 'api_span_duration_seconds_count{span="db"} 1' in lines
+        assert 'api_request_duration_seconds_count{view="api.sign_up",status="201"} 1' in lines
+
+    @override_settings(API_METRICS=False)
+    def test_disabled(self):
+        registry = metrics.registry
+        registry.clear()
+        with span('db'):
+            pass
+        assert registry.spans == {}
+
+
+class TestRequestMetrics(TestCase):
+    email = 'metrics@bar.com'
+
+    def setUp(self):
+        self.client = Client()
+        metrics.registry.clear()
+
+    def tearDown(self):
+        delete_api_user(self.email)
+
+    def signup(self):
+        return self.client.post(reverse('api.sign_up'), {'email': self.email, 'password': 'foo'},
+                                content_type='application/json')
+
+    @override_settings(API_METRICS=True, API_SERVER_TIMING=True)
+    def test_spans(self):
+        response = self.signup()
+        assert response.status_code == 201
+        timings = dict(part.split(';dur=') for part in response['Server-Timing'].split(', '))
+        assert {'db', 'hashing', 'json', 'total'} <= set(timings)
+        assert float(timings['total']) >= float(timings['hashing'])
+
+        response = self.client.get(reverse('metrics'))
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+        body = response.content.decode()
+        assert 'api_span_duration_seconds_count{span="hashing"} 1' in body
+        assert 'api_request_duration_seconds_count{view="api.sign_up",status="201"} 1' in body
+
+    @override_settings(API_METRICS=True, API_SERVER_TIMING=False)
+    def test_without_server_timing(self):
+        response = self.signup()
+        assert not response.has_header('Server-Timing')
+        assert 'hashing' in metrics.registry.spans
+
+    @override_settings(API_METRICS=False, API_SERVER_TIMING=True)
+    def test_disabled(self):
+        response = self.signup()
+        assert not response.has_header('Server-Timing')
+        assert self.client.get(reverse('metrics')).status_code == 404
+        assert metrics.registry.requests == {}
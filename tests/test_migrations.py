@@ -0,0 +1,41 @@
+import importlib
+from types import SimpleNamespace
+
+import psycopg2
+from django.test import TestCase
+
+from src.api.pool import get_pool
+
+
+unique_email = importlib.import_module('src.api.migrations.0002_apiuser_email_unique')
+
+
+class TestEmailUniqueIndex(TestCase):
+    emails = ['migrate@bar.com', 'MIGRATE@bar.com']
+
+    def test_invalid_index_built_again(self):
+        create = unique_email.Migration.operations[2].sql
+        with get_pool().connection() as conn:
+            schema_editor = SimpleNamespace(connection=conn)
+            cur = conn.cursor()
+            cur.execute(f'drop index concurrently {unique_email.INDEX}')
+            try:
+                cur.execute("insert into api_apiuser (email, password, token, activated, token_sent_at, created_at) "
+                            "values (%s, 'x', 'abcd', false, now(), now()), "
+                            "(%s, 'x', 'abcd', false, now(), now())", self.emails)
+                # the failed build leaves an invalid index
+                with self.assertRaises(psycopg2.IntegrityError):
+                    cur.execute(create)
+                cur.execute('delete from api_apiuser where email = %s', [self.emails[1]])
+                cur.execute(create)
+                with self.assertRaises(RuntimeError):
+                    unique_email.check_index(None, schema_editor)
+
+                unique_email.drop_invalid_index(None, schema_editor)
+                cur.execute(create)
+                unique_email.check_index(None, schema_editor)
+                assert unique_email.index_valid(cur) is True
+            finally:
+                cur.execute('delete from api_apiuser where lower(email) = %s', [self.emails[0]])
+                unique_email.drop_invalid_index(None, schema_editor)
+                cur.execute(create)
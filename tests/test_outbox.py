@@ -0,0 +1,132 @@
+import smtplib
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from src.api import outbox
+from src.api.utils import delete_api_user, execute_select_statement, execute_insert_update_statement
+
+
+SEND_MESSAGES = 'django.core.mail.backends.locmem.EmailBackend.send_messages'
+
+
+def outbox_rows(recipient):
+    return execute_select_statement(
+        "select status, attempts, last_error, next_attempt_at > now() "
+        "from api_outboxemail where recipient=%s order by id", [recipient])
+
+
+@override_settings(EMAIL_OUTBOX_RETRY_BACKOFF=10)
+class TestOutbox(TestCase):
+    email = "outbox@bar.com"
+
+    def setUp(self):
+        self.client.post(
+            reverse('api.sign_up'),
+            data={"email": self.email, "password": "baz"},
+            content_type='application/json'
+        )
+
+    def tearDown(self):
+        delete_api_user(email=self.email)
+        execute_insert_update_statement(
+            "delete from api_outboxemail where recipient=%s", [self.email])
+
+    def sent_emails(self):
+        return [message for message in mail.outbox if message.to == [self.email]]
+
+    def test_signup_queues_email(self):
+        assert self.sent_emails() == []
+        assert outbox_rows(self.email) == [('pending', 0, None, False)]
+
+    def test_deliver_pending(self):
+        result = outbox.deliver_pending()
+        assert result['sent'] >= 1
+        sent = self.sent_emails()
+        assert len(sent) == 1
+        assert sent[0].subject == "Activation code"
+        assert outbox_rows(self.email)[0][:2] == ('sent', 1)
+
+        outbox.deliver_pending()
+        assert len(self.sent_emails()) == 1
+
+    def test_failed_email_retried_later(self):
+        with mock.patch(SEND_MESSAGES, side_effect=OSError('Connection refused')):
+            result = outbox.deliver_pending()
+        assert result['failed'] >= 1
+        assert outbox_rows(self.email) == [('pending', 1, 'Connection refused', True)]
+
+        # not due yet
+        outbox.deliver_pending()
+        assert outbox_rows(self.email)[0][:2] == ('pending', 1)
+        assert self.sent_emails() == []
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=1)
+    def test_dead_after_max_attempts(self):
+        with mock.patch(SEND_MESSAGES, side_effect=OSError('Connection refused')):
+            outbox.deliver_pending()
+        assert outbox_rows(self.email)[0][:2] == ('dead', 1)
+
+    @override_settings(EMAIL_OUTBOX_MAX_AGE=0)
+    def test_expired_emails_not_sent(self):
+        outbox.deliver_pending()
+        assert outbox_rows(self.email)[0][:2] == ('dead', 0)
+        assert self.sent_emails() == []
+
+    def test_retry_delay(self):
+        with self.settings(EMAIL_OUTBOX_MAX_RETRY_DELAY=30):
+            assert [outbox.retry_delay(attempts) for attempts in range(1, 5)] == [10, 20, 30, 30]
+
+    def test_deleting_the_user_drops_pending_emails(self):
+        delete_api_user(email=self.email)
+        assert outbox_rows(self.email) == []
+
+
+class TestDispatcher(TestCase):
+    emails = ["dispatch1@bar.com", "dispatch2@bar.com"]
+
+    def setUp(self):
+        for email in self.emails:
+            self.client.post(
+                reverse('api.sign_up'),
+                data={"email": email, "password": "baz"},
+                content_type='application/json'
+            )
+        self.dispatcher = outbox.Dispatcher()
+
+    def tearDown(self):
+        self.dispatcher.close()
+        for email in self.emails:
+            delete_api_user(email=email)
+            execute_insert_update_statement(
+                "delete from api_outboxemail where recipient=%s", [email])
+
+    def test_batch_sent_over_one_connection(self):
+        self.dispatcher.deliver_pending()
+        assert {message.to[0] for message in mail.outbox} >= set(self.emails)
+        assert self.dispatcher.stats['connects'] == 1
+        assert self.dispatcher.stats['batches'] == 1
+        assert self.dispatcher.throughput() > 0
+
+    def test_connection_kept_between_batches(self):
+        self.dispatcher.deliver_pending(limit=1)
+        self.dispatcher.deliver_pending(limit=1)
+        assert self.dispatcher.stats['connects'] == 1
+        assert self.dispatcher.stats['batches'] == 2
+
+    def test_reconnects_when_disconnected(self):
+        send_messages = mock.Mock(side_effect=[smtplib.SMTPServerDisconnected('gone'), 1, 1])
+        with mock.patch(SEND_MESSAGES, send_messages):
+            result = self.dispatcher.deliver_pending()
+        assert result['failed'] == 0
+        assert self.dispatcher.stats['connects'] == 2
+        for email in self.emails:
+            assert outbox_rows(email)[0][0] == 'sent'
+
+    def test_closed_when_idle(self):
+        self.dispatcher.deliver_pending()
+        self.dispatcher.keepalive = 0
+        self.dispatcher.close_if_idle()
+        assert self.dispatcher.connection is None
@@ -0,0 +1,219 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from src.api import partitions, utils
+from src.api.exceptions import Http500Error
+from src.api.pool import ConnectionPool, get_pool
+from src.api.reaper import Reaper
+from src.api.utils import (
+    activate_user,
+    bulk_signup_api_users,
+    copy_api_users_from,
+    delete_api_user,
+    execute_insert_update_statement,
+    execute_select_statement,
+    get_api_user,
+    insert_api_user,
+    save_token,
+    signup_api_user,
+)
+
+
+def new_york_pool():
+    """A pool whose sessions aren't in UTC"""
+    return ConnectionPool(host=settings.DB_DEFAULT_HOST, database=settings.DB_DEFAULT_NAME,
+                          user=settings.DB_DEFAULT_USER, password=settings.DB_DEFAULT_PASSWORD,
+                          options='-c TimeZone=America/New_York')
+
+
+def early_utc_morning(days_ago):
+    """A moment of the day before in New York"""
+    day = datetime.utcnow() - timedelta(days=days_ago)
+    return pytz.UTC.localize(day.replace(hour=2, minute=0, second=0, microsecond=0))
+
+
+class TestPeriods(TestCase):
+
+    def test_periods(self):
+        moment = datetime(2022, 3, 17, 15, 30)
+        assert partitions.period_start(moment, 'day') == partitions.period_start(datetime(2022, 3, 17), 'day')
+        assert partitions.period_start(moment, 'week').date().isoformat() == '2022-03-14'
+        start = partitions.period_start(moment, 'month')
+        assert start.date().isoformat() == '2022-03-01'
+        assert partitions.next_period(start, 'month').date().isoformat() == '2022-04-01'
+        assert partitions.partition_name(start) == 'api_apiuser_p20220301'
+
+
+@override_settings(API_USER_PARTITIONS='day', API_USER_PARTITIONS_AHEAD=1)
+class TestPartitionedLayout(TestCase):
+    """The helpers on the partitioned table, converted for the tests of the
+    class and converted back afterwards"""
+    emails = ['partition-1@bar.com', 'partition-2@bar.com', 'partition-3@bar.com']
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestPartitionedLayout, cls).setUpClass()
+        partitions.convert('day', ahead=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        partitions.revert()
+        super(TestPartitionedLayout, cls).tearDownClass()
+
+    def tearDown(self):
+        for email in self.emails:
+            delete_api_user(email=email)
+
+    def partition_of(self, email):
+        return execute_select_statement(
+            "select tableoid::regclass::text from api_apiuser where lower(email)=lower(%s)", [email])[0][0]
+
+    def test_lookups(self):
+        assert signup_api_user(self.emails[0], 'foo', 'abcd') is True
+        assert signup_api_user(self.emails[0].upper(), 'foo', 'efgh') is False
+        user = get_api_user(self.emails[0].upper())[0]
+        assert user[1:5] == (self.emails[0], user[2], 'efgh', False)
+        assert self.partition_of(self.emails[0]).endswith('_pending')
+
+        save_token(self.emails[0], 'ijkl')
+        user = get_api_user(self.emails[0])[0]
+        assert user[3] == 'ijkl'
+        activate_user(user[0], created_at=user[6])
+        assert get_api_user(self.emails[0])[0][4] is True
+        assert self.partition_of(self.emails[0]).endswith('_active')
+
+        delete_api_user(self.emails[0])
+        assert get_api_user(self.emails[0]) == []
+        assert execute_select_statement(
+            "select * from api_apiuser_email where email=%s", [self.emails[0]]) == []
+
+    def test_unique_emails(self):
+        insert_api_user(self.emails[0], 'foo')
+        with self.assertRaises(Http500Error):
+            insert_api_user(self.emails[0].upper(), 'foo')
+        assert len(execute_select_statement(
+            "select id from api_apiuser where lower(email)=%s", [self.emails[0]])) == 1
+
+    def test_bulk_signup(self):
+        signup_api_user(self.emails[0], 'foo', 'abcd')
+        created = bulk_signup_api_users([(self.emails[0].upper(), 'x', 'efgh'), (self.emails[1], 'x', 'ijkl')])
+        assert created == {self.emails[0]: False, self.emails[1]: True}
+        assert get_api_user(self.emails[0])[0][3] == 'efgh'
+        assert get_api_user(self.emails[1])[0][3] == 'ijkl'
+
+    def test_lookup_pruned(self):
+        signup_api_user(self.emails[0], 'foo', 'abcd')
+        with get_pool().connection() as conn:
+            cur = conn.cursor()
+            cur.execute('explain (analyze, costs off) ' + partitions.GET_API_USER.sql.replace('$1', '%s'),
+                        [self.emails[0]])
+            plan = '\n'.join(row[0] for row in cur.fetchall())
+        # only the partition of the user is scanned
+        assert plan.count(' on api_apiuser_p') - plan.count('never executed') == 1
+
+    def test_expired_partitions_dropped(self):
+        expired = datetime.utcnow() - timedelta(days=3)
+        partitions.create_partitions([expired])
+        execute_insert_update_statement(
+            "insert into api_apiuser (email, password, token, activated, token_sent_at, created_at) "
+            "values (%s, 'x', 'abcd', false, %s, %s), (%s, 'x', 'abcd', true, %s, %s)",
+            [self.emails[0], expired, expired, self.emails[1], expired, expired])
+        signup_api_user(self.emails[2], 'foo', 'abcd')
+
+        reaper = Reaper(retention=3600)
+        reaper.reap()
+        assert reaper.stats['partitions_dropped'] >= 1
+        assert get_api_user(self.emails[0]) == []
+        assert execute_select_statement(
+            "select * from api_apiuser_email where email=%s", [self.emails[0]]) == []
+        assert get_api_user(self.emails[1])[0][4] is True
+        assert get_api_user(self.emails[2])[0][3] == 'abcd'
+
+    def test_import_of_pending_users_signed_up_again(self):
+        expired = datetime.utcnow() - timedelta(days=3)
+        copy_api_users_from([[(self.emails[0], 'x', 'abcd', False, datetime.utcnow(), expired),
+                              (self.emails[1], 'x', 'abcd', False, expired, expired)]])
+        Reaper(retention=3600).reap()
+        # in the partition of its last sign-up, not dropped with the first one
+        assert get_api_user(self.emails[0])[0][3] == 'abcd'
+        assert get_api_user(self.emails[1]) == []
+
+    def test_import_on_a_single_connection(self):
+        pool = ConnectionPool(host=settings.DB_DEFAULT_HOST, database=settings.DB_DEFAULT_NAME,
+                              user=settings.DB_DEFAULT_USER, password=settings.DB_DEFAULT_PASSWORD,
+                              min_size=1, max_size=1, timeout=0.5)
+        self.addCleanup(pool.close)
+        expired = datetime.utcnow() - timedelta(days=3)
+        # the partitions are created on the connection of the import
+        with patch.object(utils, 'get_pool', return_value=pool), \
+                patch.object(partitions, 'get_pool', return_value=pool):
+            result = copy_api_users_from([[(self.emails[0], 'x', 'abcd', True, expired, expired)]])
+            assert result['created'] == 1
+            with pool.connection() as conn:
+                assert conn.autocommit
+        assert get_api_user(self.emails[0])[0][4] is True
+
+    def test_import_in_another_time_zone(self):
+        pool = new_york_pool()
+        self.addCleanup(pool.close)
+        moment = early_utc_morning(2)
+        with patch.object(utils, 'get_pool', return_value=pool), \
+                patch.object(partitions, 'get_pool', return_value=pool):
+            assert copy_api_users_from([[(self.emails[0], 'x', 'abcd', False, moment, moment)]])['created'] == 1
+        assert self.partition_of(self.emails[0]) == f'api_apiuser_p{moment:%Y%m%d}_pending'
+
+    def test_email_of_dropped_partition_reused(self):
+        expired = datetime.utcnow() - timedelta(days=3)
+        partitions.create_partitions([expired])
+        execute_insert_update_statement(
+            "insert into api_apiuser (email, password, token, activated, token_sent_at, created_at) "
+            "values (%s, 'x', 'abcd', false, %s, %s)", [self.emails[0], expired, expired])
+        partitions.drop_expired_partitions(3600)
+        assert signup_api_user(self.emails[0], 'foo', 'efgh') is True
+        assert get_api_user(self.emails[0])[0][3] == 'efgh'
+
+
+@override_settings(API_USER_PARTITIONS='day', API_USER_PARTITIONS_AHEAD=1)
+class TestConversion(TestCase):
+    emails = ['convert-1@bar.com', 'convert-2@bar.com']
+
+    def test_pending_users_signed_up_again(self):
+        expired = datetime.utcnow() - timedelta(days=3)
+        # the unpartitioned layout keeps the created_at of the first sign-up
+        execute_insert_update_statement(
+            "insert into api_apiuser (email, password, token, activated, token_sent_at, created_at) "
+            "values (%s, 'x', 'abcd', false, %s, %s), (%s, 'x', 'abcd', false, %s, %s)",
+            [self.emails[0], datetime.utcnow(), expired, self.emails[1], expired, expired])
+        partitions.convert('day', ahead=1)
+        try:
+            reaper = Reaper(retention=3600)
+            reaper.reap()
+            assert reaper.stats['partitions_dropped'] >= 1
+            assert get_api_user(self.emails[0])[0][3] == 'abcd'
+            assert get_api_user(self.emails[1]) == []
+        finally:
+            for email in self.emails:
+                delete_api_user(email=email)
+            partitions.revert()
+
+    def test_in_another_time_zone(self):
+        moment = early_utc_morning(2)
+        execute_insert_update_statement(
+            "insert into api_apiuser (email, password, token, activated, token_sent_at, created_at) "
+            "values (%s, 'x', 'abcd', false, %s, %s)", [self.emails[0], moment, moment])
+        pool = new_york_pool()
+        self.addCleanup(pool.close)
+        with patch.object(partitions, 'get_pool', return_value=pool):
+            partitions.convert('day', ahead=1)
+        try:
+            assert execute_select_statement(
+                "select tableoid::regclass::text from api_apiuser where email=%s",
+                [self.emails[0]])[0][0] == f'api_apiuser_p{moment:%Y%m%d}_pending'
+        finally:
+            delete_api_user(email=self.emails[0])
+            partitions.revert()
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.test import TestCase
+
+from src.api.pool import ConnectionPool, PoolTimeout, get_pool
+
+
+def make_pool(**kwargs):
+    return ConnectionPool(
+        host=settings.DB_DEFAULT_HOST,
+        database=settings.DB_DEFAULT_NAME,
+        user=settings.DB_DEFAULT_USER,
+        password=settings.DB_DEFAULT_PASSWORD,
+        **kwargs
+    )
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        self.pool = make_pool(min_size=1, max_size=2, timeout=0.1)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_min_size_opened_upfront(self):
+        stats = self.pool.stats()
+        assert stats['connects'] == 1
+        assert stats['idle'] == 1
+        assert stats['in_use'] == 0
+
+    def test_connection_reused(self):
+        with self.pool.connection() as conn:
+            first = conn
+        with self.pool.connection() as conn:
+            assert conn is first
+        assert self.pool.stats()['connects'] == 1
+
+    def test_connections_in_autocommit(self):
+        with self.pool.connection() as conn:
+            assert conn.autocommit
+
+    def test_timeout_when_exhausted(self):
+        with self.pool.connection(), self.pool.connection():
+            with self.assertRaises(PoolTimeout):
+                self.pool.getconn()
+        stats = self.pool.stats()
+        assert stats['timeouts'] == 1
+        assert stats['size'] == 2
+
+    def test_broken_connection_discarded(self):
+        with self.pool.connection() as conn:
+            conn.close()
+        stats = self.pool.stats()
+        assert stats['discarded'] == 1
+        assert stats['size'] == 0
+        with self.pool.connection() as conn:
+            assert not conn.closed
+
+    def test_failed_health_check_replaces_connection(self):
+        pool = make_pool(min_size=1, max_size=1, check_interval=0)
+        try:
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute('select pg_backend_pid()')
+                    backend_pid = cur.fetchone()[0]
+            with self.pool.connection() as other:
+                with other.cursor() as cur:
+                    cur.execute('select pg_terminate_backend(%s)', [backend_pid])
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute('select 1')
+            stats = pool.stats()
+            assert stats['failed_checks'] == 1
+            assert stats['connects'] == 2
+        finally:
+            pool.close()
+
+    def test_idle_connections_reaped(self):
+        pool = make_pool(min_size=1, max_size=3, max_idle=0)
+        try:
+            with pool.connection(), pool.connection(), pool.connection():
+                pass
+            pool.reap()
+            stats = pool.stats()
+            assert stats['size'] == 1
+            assert stats['reaped'] == 2
+        finally:
+            pool.close()
+
+    def test_open_transaction_rolled_back(self):
+        with self.pool.connection() as conn:
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                cur.execute('select 1')
+        with self.pool.connection() as conn:
+            assert conn.autocommit
+            assert conn.info.transaction_status == 0
+
+    def test_get_pool_is_shared(self):
+        assert get_pool() is get_pool()
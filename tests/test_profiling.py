@@ -0,0 +1,182 @@
+import asyncio
+import io
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from src.api import profiling
+from src.api.decorators import user_api
+from src.api.profiling import Sampler, leaves, merge
+from src.api.utils import delete_api_user
+
+
+def spin(stopped):
+    while not stopped.is_set():
+        sum(range(100))
+
+
+class TestSampler(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.sampler = Sampler(interval=0.001, directory=self.tmpdir.name, flush_interval=60)
+
+    def profile(self, view, seconds=0.1):
+        stopped = threading.Event()
+
+        def target():
+            token = self.sampler.start_profile(view)
+            try:
+                spin(stopped)
+            finally:
+                self.sampler.end_profile(token)
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        time.sleep(seconds)
+        stopped.set()
+        thread.join()
+
+    def test_sample(self):
+        self.sampler.start()
+        self.addCleanup(self.sampler.stop)
+        self.profile('api.sign_up')
+        counts = self.sampler.stacks()['api.sign_up']
+        assert sum(counts.values()) >= 10
+        stack = counts.most_common(1)[0][0]
+        frames = stack.split(';')
+        # root first
+        assert frames[0].startswith('_bootstrap (threading.py')
+        assert any(frame.startswith('spin (test_profiling.py:') for frame in frames)
+
+    def test_requests_of_an_event_loop(self):
+        self.sampler.start()
+        self.addCleanup(self.sampler.stop)
+
+        async def request(view, seconds):
+            token = self.sampler.start_profile(view)
+            try:
+                await asyncio.sleep(seconds)
+                if view == 'api.sign_up':
+                    stopped = threading.Event()
+                    threading.Timer(0.1, stopped.set).start()
+                    spin(stopped)
+            finally:
+                self.sampler.end_profile(token)
+
+        async def main():
+            await asyncio.gather(request('api.sign_up', 0.01), request('api.activate', 0.2))
+
+        asyncio.run(main())
+        stacks = self.sampler.stacks()
+        assert any('spin (test_profiling.py:' in stack for stack in stacks['api.sign_up'])
+        # suspended while the other request ran, then awaiting the event loop
+        assert not any('spin (test_profiling.py:' in stack for stack in stacks.get('api.activate', {}))
+        assert self.sampler._profiled == {}
+
+    def test_idle(self):
+        # without profiled threads nothing is sampled
+        self.sampler.sample()
+        assert self.sampler.stacks() == {}
+
+    def test_flush_and_merge(self):
+        self.sampler._stacks['api.activate'].update({'a;b': 3, 'a;c': 1})
+        other = Sampler(directory=self.tmpdir.name)
+        other.pid = self.sampler.pid + 1
+        other._stacks['api.activate'].update({'a;b': 2})
+        other._stacks['api.sign_up'].update({'a;d': 5})
+        for sampler in (self.sampler, other):
+            sampler.flush()
+        assert len(os.listdir(self.tmpdir.name)) == 3
+
+        profiles = merge(self.tmpdir.name)
+        assert profiles['api.activate'] == {'a;b': 5, 'a;c': 1}
+        with open(os.path.join(self.tmpdir.name, 'api.activate.collapsed')) as file:
+            assert file.read() == 'a;b 5\na;c 1\n'
+        # the merged files are not merged again
+        assert merge(self.tmpdir.name) == profiles
+        assert leaves(profiles['api.activate']) == [('b', 5), ('c', 1)]
+
+
+class TestProfiledViews(TestCase):
+    email = 'profiled@bar.com'
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.sampler = Sampler(interval=0.001, directory=self.tmpdir.name, flush_interval=60)
+        self.sampler.start()
+        self.addCleanup(self.sampler.stop)
+        patcher = patch.object(profiling, '_sampler', self.sampler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client()
+
+    def tearDown(self):
+        delete_api_user(self.email)
+
+    def signup(self):
+        return self.client.post(reverse('api.sign_up'), {'email': self.email, 'password': 'foo'},
+                                content_type='application/json')
+
+    @override_settings(API_PROFILE_SAMPLE_RATE=0)
+    def test_disabled(self):
+        with patch.object(self.sampler, 'start_profile') as start_profile:
+            assert self.signup().status_code == 201
+        start_profile.assert_not_called()
+
+    @override_settings(API_PROFILE_SAMPLE_RATE=1)
+    def test_profiled(self):
+        assert self.signup().status_code == 201
+        assert self.sampler._profiled == {}
+        counts = self.sampler.stacks()['api.sign_up']
+        # the password is hashed during most of the request
+        assert sum(counts.values()) >= 1
+
+    @override_settings(API_PROFILE_SAMPLE_RATE=1)
+    def test_user_api(self):
+        calls = []
+
+        def view(request):
+            calls.append([profiled[2] for profiled in self.sampler._profiled.values()])
+            return {'message': 'ok'}
+
+        async def async_view(request):
+            return view(request)
+
+        request = RequestFactory().post('/', {}, content_type='application/json')
+        assert user_api(['POST'])(view)(request).status_code == 200
+        assert asyncio.run(user_api(['POST'])(async_view)(request)).status_code == 200
+        assert calls == [[view.__qualname__], [async_view.__qualname__]]
+        assert self.sampler._profiled == {}
+
+    def test_profiles_view(self):
+        self.sampler._stacks['api.sign_up'].update({'a;b': 2})
+        self.sampler._stacks['api.activate'].update({'a;c': 1})
+        with override_settings(API_PROFILE_DIR=self.tmpdir.name):
+            assert self.client.get(reverse('profiles')).status_code == 302
+            User.objects.create_user('admin', password='foo', is_staff=True)
+            self.client.login(username='admin', password='foo')
+            response = self.client.get(reverse('profiles'))
+            assert response.status_code == 200
+            assert response.content == b'api.activate;a;c 1\napi.sign_up;a;b 2\n'
+            response = self.client.get(reverse('profiles'), {'view': 'api.sign_up'})
+            assert response.content == b'a;b 2\n'
+
+    def test_command(self):
+        self.sampler._stacks['api.sign_up'].update({'a;b': 3, 'a;c': 1})
+        self.sampler.flush()
+        stdout = io.StringIO()
+        call_command('dump_profiles', '--dir', self.tmpdir.name, '--clear', stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        assert lines[0].startswith('api.sign_up: 4 samples')
+        assert lines[1].strip() == '75.0% b'
+        assert os.listdir(self.tmpdir.name) == ['api.sign_up.collapsed']
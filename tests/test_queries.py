@@ -0,0 +1,67 @@
+from django.test import TestCase
+
+from src.api import queries
+from src.api.pool import get_pool
+from src.api.utils import (
+    delete_api_user,
+    execute_prepared_statement,
+    get_api_user,
+    insert_api_user,
+    save_token
+)
+
+
+class TestStatement(TestCase):
+
+    def test_prepare_and_execute_sql(self):
+        statement = queries.Statement('foo', [('a', 'int'), ('b', 'text')], "select $1, $2")
+        assert statement.prepare_sql == 'prepare foo (int, text) as select $1, $2'
+        assert statement.execute_sql == 'execute foo (%(a)s, %(b)s)'
+
+    def test_without_params(self):
+        statement = queries.Statement('foo', [], "select 1")
+        assert statement.prepare_sql == 'prepare foo as select 1'
+        assert statement.execute_sql == 'execute foo'
+
+
+class TestPreparedStatements(TestCase):
+    email = "o'brien@bar.com"
+
+    def tearDown(self):
+        delete_api_user(email=self.email)
+
+    def test_values_are_not_formatted_into_the_sql(self):
+        insert_api_user(email=self.email, password="baz")
+        save_token(self.email, "ab'c")
+        user = get_api_user(self.email)[0]
+        assert user[1] == self.email
+        assert user[3] == "ab'c"
+
+    def test_prepared_once_per_connection(self):
+        pool = get_pool()
+        with pool.connection() as conn:
+            for _ in range(3):
+                queries.execute(conn, [queries.GET_API_USER], {'email': self.email})
+            assert 'get_api_user' in conn.prepared
+            cur = conn.cursor()
+            cur.execute("select count(*) from pg_prepared_statements where name='get_api_user'")
+            assert cur.fetchone()[0] == 1
+
+    def test_failed_round_trip_resets_prepared_statements(self):
+        pool = get_pool()
+        with pool.connection() as conn:
+            statement = queries.Statement('fails', [('id', 'int')], "select 1 / $1")
+            with self.assertRaises(Exception):
+                queries.execute(conn, [statement], {'id': 0})
+            assert conn.prepared == set()
+            queries.execute(conn, [statement], {'id': 1})
+            assert 'fails' in conn.prepared
+
+    def test_returns_rows_of_last_statement(self):
+        rows = execute_prepared_statement(
+            queries.SIGNUP,
+            params={'email': self.email, 'password': 'x', 'token': 'abcd', 'now': '2022-01-01',
+                    'subject': 'foo', 'body': 'bar'}
+        )
+        assert len(rows) == 1
+        assert rows[0][1] is True
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import psycopg2
+from django.conf import settings
+from django.test import TestCase
+
+from src.api import queries
+
+
+SAMPLE_VALUES = {
+    'token': 'abcd',
+    'varchar': 'foo@bar.com',
+    'timestamptz': datetime(2022, 1, 1),
+    'bigint': 1,
+    'bigint[]': [1],
+    'int': 1,
+    'float8': 1.0,
+    'text': 'foo',
+    'boolean': False,
+}
+
+
+class TestQueryPlans(TestCase):
+    """EXPLAIN every statement of src.api.queries with sequential scans
+    disabled: the planner still picks a sequential scan when no index can
+    be used, no matter how small the table is.
+    """
+
+    def setUp(self):
+        self.conn = psycopg2.connect(
+            host=settings.DB_DEFAULT_HOST,
+            database=settings.DB_DEFAULT_NAME,
+            user=settings.DB_DEFAULT_USER,
+            password=settings.DB_DEFAULT_PASSWORD
+        )
+        self.conn.autocommit = True
+        self.cur = self.conn.cursor()
+        self.cur.execute('set enable_seqscan = off')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def explain(self, statement):
+        self.cur.execute(statement.prepare_sql)
+        self.cur.execute('explain ' + statement.execute_sql, {
+            param: SAMPLE_VALUES.get(param, SAMPLE_VALUES[param_type])
+            for param, param_type in statement.params
+        })
+        return '\n'.join(row[0] for row in self.cur.fetchall())
+
+    def test_no_sequential_scans(self):
+        statements = [value for value in vars(queries).values()
+                      if isinstance(value, queries.Statement)]
+        assert statements
+        for statement in statements:
+            with self.subTest(statement=statement.name):
+                plan = self.explain(statement)
+                self.assertNotIn('Seq Scan', plan)
@@ -0,0 +1,56 @@
+import io
+from datetime import datetime, timedelta
+
+import psycopg2
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+
+from src.api.reaper import Reaper
+from src.api.utils import activate_user, delete_api_user, get_api_user, save_token, signup_api_user
+
+
+class TestReaper(TestCase):
+    emails = ['reaper-1@bar.com', 'reaper-2@bar.com', 'reaper-3@bar.com', 'reaper-4@bar.com']
+
+    def setUp(self):
+        expired = datetime.utcnow() - timedelta(minutes=5)
+        for email in self.emails:
+            signup_api_user(email, 'foo', 'abcd')
+        for email in self.emails[:3]:
+            save_token(email, 'abcd', pref_date=expired)
+        api_user = get_api_user(self.emails[2])[0]
+        activate_user(api_user[0], created_at=api_user[6])
+
+    def tearDown(self):
+        for email in self.emails:
+            delete_api_user(email=email)
+
+    def remaining(self):
+        return [email for email in self.emails if get_api_user(email)]
+
+    def test_reap(self):
+        reaper = Reaper(batch_size=1, retention=60)
+        assert reaper.reap() >= 2
+        assert reaper.stats['batches'] >= 3
+        assert reaper.throughput() > 0
+        # activated, or with a token still valid
+        assert self.remaining() == self.emails[2:]
+
+    def test_locked_users_skipped(self):
+        conn = psycopg2.connect(host=settings.DB_DEFAULT_HOST, database=settings.DB_DEFAULT_NAME,
+                                user=settings.DB_DEFAULT_USER, password=settings.DB_DEFAULT_PASSWORD)
+        try:
+            conn.cursor().execute('select * from api_apiuser where email=%s for update', [self.emails[0]])
+            Reaper(retention=60).reap()
+            assert self.remaining() == [self.emails[0]] + self.emails[2:]
+        finally:
+            # released once the rollback returns, not the close
+            conn.rollback()
+            conn.close()
+        Reaper(retention=60).reap()
+        assert self.remaining() == self.emails[2:]
+
+    def test_command(self):
+        call_command('reap_users', '--once', '--retention', '600', stdout=io.StringIO())
+        assert self.remaining() == self.emails
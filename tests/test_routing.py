@@ -0,0 +1,205 @@
+import asyncio
+import base64
+import contextvars
+import json
+from unittest.mock import patch
+
+import psycopg2
+from django.conf import settings
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from src.api import cache, routing, utils
+from src.api.cache import get_user_cache
+from src.api.pool import get_replica_pool
+from src.api.utils import aget_api_user, delete_api_user, get_api_user, signup_api_user
+
+
+REPLICA_NAME = f'{settings.DB_DEFAULT_NAME}_replica'
+
+
+def connect(database):
+    conn = psycopg2.connect(host=settings.DB_DEFAULT_HOST, database=database,
+                            user=settings.DB_DEFAULT_USER, password=settings.DB_DEFAULT_PASSWORD)
+    conn.autocommit = True
+    return conn
+
+
+@override_settings(DB_REPLICA_HOST=settings.DB_DEFAULT_HOST, DB_REPLICA_NAME=REPLICA_NAME)
+class TestReadReplica(TestCase):
+    """The replica is a stand-in, a second database with a copy of the users
+    table, which never replays the writes of the primary"""
+    email = 'replica@bar.com'
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestReadReplica, cls).setUpClass()
+        conn = connect(settings.DB_DEFAULT_NAME)
+        try:
+            cur = conn.cursor()
+            cur.execute("select column_name, data_type from information_schema.columns "
+                        "where table_name='api_apiuser' order by ordinal_position")
+            columns = ', '.join(f'{name} {data_type}' for name, data_type in cur.fetchall())
+            cur.execute(f'drop database if exists {REPLICA_NAME}')
+            cur.execute(f'create database {REPLICA_NAME}')
+        finally:
+            conn.close()
+        conn = connect(REPLICA_NAME)
+        try:
+            conn.cursor().execute(f'create table api_apiuser ({columns})')
+        finally:
+            conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        with override_settings(DB_REPLICA_HOST=settings.DB_DEFAULT_HOST, DB_REPLICA_NAME=REPLICA_NAME):
+            get_replica_pool().close()
+        conn = connect(settings.DB_DEFAULT_NAME)
+        try:
+            conn.cursor().execute(f'drop database if exists {REPLICA_NAME} with (force)')
+        finally:
+            conn.close()
+        super(TestReadReplica, cls).tearDownClass()
+
+    def setUp(self):
+        self.router = routing.ReadRouter(stickiness=5, retry_interval=5)
+        patcher = patch.object(routing, '_router', self.router)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_user_cache().clear()
+
+    def tearDown(self):
+        delete_api_user(self.email)
+        conn = connect(REPLICA_NAME)
+        try:
+            conn.cursor().execute('delete from api_apiuser')
+        finally:
+            conn.close()
+
+    def replicate(self, token):
+        """The replica lagging behind, with the former token of the user"""
+        with routing.pinning('write'):
+            api_user = get_api_user(self.email)[0]
+        conn = connect(REPLICA_NAME)
+        try:
+            conn.cursor().execute('insert into api_apiuser values (%s)' % ', '.join(['%s'] * len(api_user)),
+                                  api_user[:3] + (token,) + api_user[4:])
+        finally:
+            conn.close()
+        get_user_cache().clear()
+        self.router.recent_writes.clear()
+
+    def test_read_your_writes(self):
+        with routing.pinning():
+            signup_api_user(self.email, 'foo', 'abcd')
+            assert get_api_user(self.email)[0][3] == 'abcd'
+            assert self.router.stats()['sticky'] >= 1
+
+        # another request, in the process which wrote the user
+        get_user_cache().clear()
+        with routing.pinning():
+            assert get_api_user(self.email)[0][3] == 'abcd'
+        assert self.router.stats()['replica'] == 0
+
+    def test_replica_reads(self):
+        with routing.pinning():
+            signup_api_user(self.email, 'foo', 'abcd')
+        self.replicate('efgh')
+
+        with routing.pinning():
+            assert get_api_user(self.email)[0][3] == 'efgh'
+            assert self.router.stats()['replica'] == 1
+            # an activation with the token of the sign-up the replica misses
+            assert get_api_user(self.email, token='abcd')[0][3] == 'abcd'
+            assert asyncio.run(aget_api_user(self.email, token='abcd'))[0][3] == 'abcd'
+
+    def test_missing_on_replica(self):
+        with routing.pinning():
+            signup_api_user(self.email, 'foo', 'abcd')
+        self.router.recent_writes.clear()
+        get_user_cache().clear()
+
+        with routing.pinning():
+            assert get_api_user(self.email)[0][3] == 'abcd'
+            get_user_cache().clear()
+            assert asyncio.run(aget_api_user(self.email))[0][3] == 'abcd'
+        assert self.router.stats()['misses'] == 2
+
+    def test_replica_down(self):
+        with routing.pinning():
+            signup_api_user(self.email, 'foo', 'abcd')
+        self.router.recent_writes.clear()
+        get_user_cache().clear()
+
+        with override_settings(DB_REPLICA_NAME=f'{REPLICA_NAME}_missing'), routing.pinning():
+            with self.assertLogs('src.api.routing', 'WARNING'):
+                assert get_api_user(self.email)[0][3] == 'abcd'
+            get_user_cache().clear()
+            assert get_api_user(self.email)[0][3] == 'abcd'
+        stats = self.router.stats()
+        assert (stats['failures'], stats['skipped'], stats['down']) == (1, 1, True)
+
+    def test_pin_cookie(self):
+        client = Client()
+        response = client.post(reverse('api.sign_up'), {'email': self.email, 'password': 'foo'},
+                               content_type='application/json')
+        assert response.status_code == 201
+        assert response.cookies[settings.DB_READ_PIN_COOKIE]['max-age'] == 5
+        self.replicate('efgh')
+
+        headers = {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(f'{self.email}:foo'.encode()).decode()}
+        response = client.patch(reverse('api.activate'), {'token': 'efgh'}, content_type='application/json',
+                                **headers)
+        # read from the primary, with the token of the sign-up
+        assert response.status_code == 403
+        assert self.router.stats()['replica'] == 0
+
+        client.cookies.clear()
+        get_user_cache().clear()
+        client.patch(reverse('api.activate'), {'token': 'efgh'}, content_type='application/json', **headers)
+        assert self.router.stats()['replica'] == 1
+
+    @override_settings(BULK_SIGNUP_API_KEY='secret')
+    def test_bulk_pin_cookie(self):
+        response = Client().post(reverse('api.sign_up_bulk'), [{'email': self.email, 'password': 'foo'}],
+                                 content_type='application/json', HTTP_AUTHORIZATION='Bearer secret')
+        # set before the users are saved, by the streamed response
+        assert response.cookies[settings.DB_READ_PIN_COOKIE]['max-age'] == 5
+        assert json.loads(b''.join(response.streaming_content))['status'] == 'created'
+
+    def test_write_outside_of_a_request(self):
+        def write():
+            self.router.record_write(self.email)
+            return routing._pinned.get(), self.router.use_replica()
+
+        # e.g. the generator of a streamed response, under WSGI
+        assert contextvars.copy_context().run(write) == (None, True)
+        assert not self.router.use_replica(self.email)
+
+
+@override_settings(DB_REPLICA_HOST='', API_USER_CACHE_BACKEND='')
+class TestStaleReads(TestCase):
+    email = 'stale@bar.com'
+
+    def setUp(self):
+        patcher = patch.object(cache, '_user_cache', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        signup_api_user(self.email, 'foo', 'abcd')
+
+    def tearDown(self):
+        delete_api_user(self.email)
+
+    def test_token_mismatch_reads_primary(self):
+        # a read racing the sign-up sending the token, without replica nor cache
+        row = get_api_user(self.email)[0]
+        stale = [row[:3] + ('efgh',) + row[4:]]
+        with patch.object(utils, 'execute_read_statement', return_value=stale):
+            assert get_api_user(self.email)[0][3] == 'efgh'
+            assert get_api_user(self.email, token='abcd')[0][3] == 'abcd'
+
+        async def aread(*args, **kwargs):
+            return stale
+
+        with patch.object(utils, 'aexecute_read_statement', aread):
+            assert asyncio.run(aget_api_user(self.email, token='abcd'))[0][3] == 'abcd'
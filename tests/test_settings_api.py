@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from src import settings as full_settings, settings_api
+from src.api.utils import delete_api_user
+
+
+@override_settings(ROOT_URLCONF='src.urls_api', MIDDLEWARE=settings_api.MIDDLEWARE)
+class TestApiProfile(TestCase):
+    email = 'api-profile@bar.com'
+
+    def setUp(self):
+        self.client = Client()
+
+    def tearDown(self):
+        delete_api_user(self.email)
+
+    def test_api(self):
+        response = self.client.post(reverse('api.sign_up'), {'email': self.email, 'password': 'foo'},
+                                    content_type='application/json')
+        assert response.status_code == 201
+        assert not response.cookies
+        assert self.client.get(reverse('api.sign_up'))['Allow'] == 'POST'
+
+    def test_without_admin(self):
+        assert self.client.get('/admin/').status_code == 404
+        assert self.client.get('/profiles').status_code == 404
+
+    def test_settings(self):
+        assert set(settings_api.MIDDLEWARE) < set(full_settings.MIDDLEWARE)
+        assert settings_api.INSTALLED_APPS == ['src.api']
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='src.settings_api', PASSWORD_HASHING_WORKERS='0')
+        result = subprocess.run([sys.executable, 'manage.py', 'check'], cwd=settings.BASE_DIR, env=env,
+                                capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
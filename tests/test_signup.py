@@ -1,8 +1,18 @@
 import logging
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth.hashers import check_password
 from django.urls import reverse
 from django.test import TestCase, Client
 
-from src.api.utils import delete_api_user
+from src.api import hashing
+from src.api.utils import (
+    delete_api_user,
+    execute_select_statement,
+    get_api_user,
+    signup_api_user
+)
 from src.api.models import ApiUser
 
 
@@ -72,7 +82,66 @@ class TestSignUp(TestCase):
                 content_type='application/json'
             )
 
-            self.assertIn("Activation mail sent to foo@bar.com.", ','.join(lg.output))
+            self.assertIn("Activation mail to foo@bar.com queued.", ','.join(lg.output))
         assert response.status_code == 201
         content = response.json()
         assert "Activation mail sent to foo@bar.com." in content['message']
+
+    def test_post_existing_user(self):
+        signup_api_user(email="foo@bar.com", password="baz", token="abcd")
+        with self.assertLogs(logger=self.logger, level='INFO') as lg:
+            response = self.client.post(
+                self.url,
+                data={
+                    "email": "foo@bar.com",
+                    "password": "baz"
+                },
+                content_type='application/json'
+            )
+            self.assertIn("User with foo@bar.com already exists.", ','.join(lg.output))
+        assert response.status_code == 201
+        users = execute_select_statement(
+            "select token from api_apiuser where email=%s", ["foo@bar.com"])
+        assert users == [(response.json()['token'],)]
+
+
+class TestSignupApiUser(TestCase):
+    email = "concurrent@bar.com"
+
+    def tearDown(self):
+        delete_api_user(email=self.email)
+
+    def test_creates_then_updates(self):
+        assert signup_api_user(self.email, "baz", "abcd") is True
+        assert signup_api_user(self.email, "baz", "efgh") is False
+        user = get_api_user(self.email)[0]
+        assert user[3] == "efgh"
+        assert check_password("baz", user[2])
+
+    def test_email_is_case_insensitive(self):
+        assert signup_api_user(self.email, "baz", "abcd") is True
+        assert signup_api_user(self.email.upper(), "baz", "efgh") is False
+        user = get_api_user(self.email.upper())[0]
+        assert user[1] == self.email
+        assert user[3] == "efgh"
+
+    def test_concurrent_signups_create_one_user(self):
+        barrier = threading.Barrier(8)
+        results = []
+
+        def signup(token):
+            barrier.wait()
+            results.append(signup_api_user(self.email, "baz", token))
+
+        threads = [threading.Thread(target=signup, args=(f"t{i:03}",)) for i in range(8)]
+        # room for the 8 hashes, whatever the number of cores
+        with patch.object(hashing, '_hasher', hashing.Hasher(workers=0, max_pending=8)):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert sorted(results) == [False] * 7 + [True]
+        users = execute_select_statement(
+            "select count(*) from api_apiuser where email=%s", [self.email])
+        assert users == [(1,)]
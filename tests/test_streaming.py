@@ -0,0 +1,54 @@
+import io
+import json
+
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from src.api import bulk, serializers
+from src.api.exceptions import Http413Error
+from src.api.streaming import iter_ndjson
+
+
+class TestIterNdjson(TestCase):
+
+    def test_lines_across_chunks(self):
+        lines = [json.dumps({'email': f'user-{i}@bar.com'}) for i in range(50)]
+        stream = io.BytesIO(('\n'.join(lines[:25]) + '\n\n' + '\n'.join(lines[25:])).encode())
+        items = list(iter_ndjson(stream, max_size=10000, max_line_size=100, chunk_size=7))
+        assert items == [json.loads(line) for line in lines]
+
+    def test_invalid_line(self):
+        items = list(iter_ndjson(io.BytesIO(b'{"a": 1}\n{"a"\n[]'), max_size=100, max_line_size=100))
+        assert items[0] == {'a': 1}
+        assert isinstance(items[1], serializers.DecodeError)
+        assert items[2] == []
+
+    def test_too_large(self):
+        items = iter_ndjson(io.BytesIO(b'{"a": 1}\n' * 10), max_size=20, max_line_size=100, chunk_size=9)
+        assert next(items) == {'a': 1}
+        assert next(items) == {'a': 1}
+        with self.assertRaises(Http413Error):
+            next(items)
+
+    def test_line_too_long(self):
+        stream = io.BytesIO(b'{"a": 1}\n' + b' ' * 50 + b'\n')
+        items = iter_ndjson(stream, max_size=1000, max_line_size=40, chunk_size=16)
+        assert next(items) == {'a': 1}
+        with self.assertRaises(Http413Error):
+            next(items)
+
+    def test_bulk_sign_up_reports_unreadable_body(self):
+        stream = io.BytesIO(b'{"email": "foo"}\n' * 10)
+        results = list(bulk.sign_up(iter_ndjson(stream, max_size=40, max_line_size=100, chunk_size=17)))
+        assert [(r['index'], r['status']) for r in results] == [(0, 'invalid'), (1, 'invalid'), (2, 'error')]
+        assert results[2]['errors'] == 'The request body should be at most 40 bytes.'
+
+
+class TestMaxBodySize(TestCase):
+
+    @override_settings(API_MAX_BODY_SIZE=10)
+    def test_json_body_too_large(self):
+        response = Client().post(reverse('api.sign_up'), data={'email': 'foo@bar.com', 'password': 'baz'},
+                                 content_type='application/json')
+        assert response.status_code == 413
+        assert response.json() == {'errors': 'The request body should be at most 10 bytes.'}
@@ -0,0 +1,169 @@
+import base64
+import json
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from src.api import bulk, throttling
+from src.api.exceptions import Http429Error
+from src.api.ratelimit import SlidingWindow, TokenBucket, window_delay
+from src.api.throttling import DjangoCacheBackend, LocalBackend, Throttler, parse_rate
+from src.api.utils import delete_api_user, get_api_user, signup_api_user
+
+
+class TestRateLimits(TestCase):
+
+    def test_parse_rate(self):
+        assert parse_rate('10/m') == (10, 60)
+        assert parse_rate('10 / 5m') == (10, 300)
+        assert parse_rate('') is None
+        with self.assertRaises(ValueError):
+            parse_rate('10/minute')
+
+    def test_token_bucket_delay(self):
+        with patch('src.api.ratelimit.time.monotonic', return_value=100.0):
+            bucket = TokenBucket(rate=0.5, capacity=2)
+            assert bucket.consume() and bucket.consume()
+            assert not bucket.consume()
+            assert bucket.delay() == 2.0
+
+    def test_sliding_window(self):
+        window = SlidingWindow(limit=4, window=10)
+        with patch('src.api.ratelimit.time.monotonic', return_value=105.0):
+            for _ in range(4):
+                assert window.delay() == 0
+                window.hit()
+            # until the next window starts, and the 4 hits weigh less
+            assert window.delay() == 5.0
+        with patch('src.api.ratelimit.time.monotonic', return_value=115.0):
+            # they weigh 2 once it's half elapsed
+            assert window.delay() == 0
+            for _ in range(3):
+                window.hit()
+            assert window.delay() == 2.5
+
+    def test_window_delay(self):
+        assert window_delay(10, 60, 5, 4, 0.5) == 0
+        assert window_delay(10, 60, 20, 0, 0.25) == 15.0
+        assert window_delay(10, 60, 0, 20, 0.5) == 60.0
+
+
+class TestThrottler(TestCase):
+    backends = [lambda: LocalBackend(100), lambda: DjangoCacheBackend('default', prefix='test-throttle:')]
+
+    def test_signup(self):
+        for backend in self.backends:
+            throttler = Throttler(backend(), signup_rate=(2, 60))
+            throttler.check_signup('foo@bar.com')
+            throttler.check_signup('FOO@bar.com')
+            with self.assertRaises(Http429Error) as raised:
+                throttler.check_signup('foo@bar.com')
+            assert 1 <= int(raised.exception.headers['Retry-After']) <= 60
+            throttler.check_signup('baz@bar.com')
+            assert throttler.stats()['signup'] == 1
+            throttler.backend.clear()
+
+    def test_failed_activations(self):
+        for backend in self.backends:
+            throttler = Throttler(backend(), activation_rate=(2, 600))
+            for _ in range(2):
+                throttler.check_activation('foo@bar.com')
+                throttler.activation_failed('foo@bar.com')
+            with self.assertRaises(Http429Error):
+                throttler.check_activation('foo@bar.com')
+            throttler.check_activation('baz@bar.com')
+            throttler.backend.clear()
+
+    def test_disabled(self):
+        throttler = Throttler(LocalBackend(100))
+        for _ in range(10):
+            throttler.check_ip('127.0.0.1')
+            throttler.check_signup('foo@bar.com')
+            throttler.activation_failed('foo@bar.com')
+            throttler.check_activation('foo@bar.com')
+
+    def test_client_ip(self):
+        request = RequestFactory().get('/api/v1/sign_up/', HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.2')
+        assert throttling.client_ip(request, 'HTTP_X_FORWARDED_FOR') == '10.0.0.2'
+        assert throttling.client_ip(request) == '127.0.0.1'
+
+    def test_local_backend_size(self):
+        backend = LocalBackend(2)
+        throttler = Throttler(backend, ip_rate=(1, 60))
+        for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+            throttler.check_ip(ip)
+        # the counter of the least recently seen client was dropped
+        throttler.check_ip('10.0.0.1')
+
+
+class TestThrottledViews(TestCase):
+    email = 'throttled@bar.com'
+
+    def setUp(self):
+        self.client = Client()
+        self.throttler = Throttler(LocalBackend(100), ip_rate=(3, 60), activation_rate=(2, 600))
+        patcher = patch.object(throttling, '_throttler', self.throttler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        delete_api_user(self.email)
+
+    def test_client_ip(self):
+        for _ in range(3):
+            response = self.client.get(reverse('api.sign_up'))
+            assert response.status_code == 405
+        response = self.client.get(reverse('api.sign_up'))
+        assert response.status_code == 429
+        assert response.json() == {'errors': 'Too many requests'}
+        assert int(response['Retry-After']) >= 1
+        # other clients, and the other paths
+        assert self.client.get(reverse('api.sign_up'), REMOTE_ADDR='10.0.0.1').status_code == 405
+        assert self.client.get('/admin/login/').status_code == 200
+
+    def test_activation_brute_force(self):
+        self.throttler.ip_rate = None
+        signup_api_user(self.email, 'foo', 'abcd')
+        headers = {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(f'{self.email}:foo'.encode()).decode()}
+        for token in ('efgh', 'ijkl'):
+            response = self.client.patch(reverse('api.activate'), {'token': token},
+                                         content_type='application/json', **headers)
+            assert response.status_code == 403
+        response = self.client.patch(reverse('api.activate'), {'token': 'abcd'},
+                                     content_type='application/json', **headers)
+        assert response.status_code == 429
+        assert get_api_user(self.email)[0][4] is False
+
+    @override_settings(BULK_SIGNUP_API_KEY='secret')
+    def test_bulk_signup(self):
+        emails = [f'throttled-{i}@bar.com' for i in range(4)]
+        self.addCleanup(lambda: [delete_api_user(email) for email in emails])
+        self.throttler.bulk_rate = (3, 60)
+        self.throttler.signup_rate = (1, 60)
+        self.throttler.check_signup(emails[1])
+        response = self.client.post(reverse('api.sign_up_bulk'), [{'email': email, 'password': 'foo'}
+                                                                  for email in emails],
+                                    content_type='application/json', HTTP_AUTHORIZATION='Bearer secret')
+        results = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        # 3 users are counted for the client, the email of the second one signed up already
+        assert [result['status'] for result in results] == ['created', 'throttled', 'created', 'throttled']
+        assert results[3]['retry_after'] >= 1
+        assert get_api_user(emails[1]) == get_api_user(emails[3]) == []
+        # the other requests of the client are not throttled
+        assert self.client.get(reverse('api.sign_up')).status_code == 405
+
+    @override_settings(BULK_SIGNUP_API_KEY='secret')
+    def test_bulk_signup_of_max_items(self):
+        emails = [f'throttled-{i}@bar.com' for i in range(settings.BULK_SIGNUP_MAX_ITEMS)]
+        self.addCleanup(lambda: [delete_api_user(email) for email in emails])
+        # the default rates, the passwords not hashed for real
+        with patch.object(throttling, '_throttler', None), \
+                patch.object(bulk, 'make_passwords', lambda passwords: ['x'] * len(passwords)):
+            response = self.client.post(reverse('api.sign_up_bulk'), [{'email': email, 'password': 'foo'}
+                                                                      for email in emails],
+                                        content_type='application/json', HTTP_AUTHORIZATION='Bearer secret')
+            results = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        assert len(results) == len(emails)
+        assert {result['status'] for result in results} == {'created'}